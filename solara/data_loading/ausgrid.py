@@ -0,0 +1,294 @@
+"""Module for ingesting the Ausgrid solar home electricity dataset.
+
+The dataset is available at
+https://www.ausgrid.com.au/Industry/Our-Research/Data-to-share/Solar-home-electricity-data.
+Each raw CSV file has one row per customer, consumption category and day, with 48
+half-hourly energy values (in kWh). The categories are general consumption (GC),
+controlled load (CL) and gross generation (GG).
+
+The raw files are streamed in chunks of rows and pivoted into one load trace
+(GC + CL) and one PV trace (GG) per customer, which are written directly into a
+`solara.data_loading.trace_store.TraceStore`. Traces of the same customer in
+different files (e.g. different years) are merged by date.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterator, List, Tuple
+import csv
+import datetime
+import logging
+import multiprocessing
+import os
+import shutil
+
+import numpy as np
+
+from solara.data_loading.trace_store import TraceStore
+
+logger = logging.getLogger(__name__)
+
+VALUES_PER_DAY = 48
+DATE_FORMATS = ["%d/%m/%Y", "%d-%b-%y", "%Y-%m-%d"]
+LOAD_CATEGORIES = ["GC", "CL"]
+PV_CATEGORIES = ["GG"]
+
+
+def parse_date(date: str) -> int:
+    """Parse date of Ausgrid row into proleptic Gregorian ordinal.
+
+    Args:
+        date (str): date as given in raw data, e.g. "1/07/2012" or "01-Jul-12".
+
+    Returns:
+        int: ordinal of date
+    """
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(date, date_format).toordinal()
+        except ValueError:
+            pass
+    raise ValueError("Unknown date format of date '{}'.".format(date))
+
+
+def read_chunks(
+    csv_path: str, chunk_size: int = 10000
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, List[Dict]]]:
+    """Read raw Ausgrid CSV file in chunks of rows.
+
+    Args:
+        csv_path (str): path to raw CSV file.
+        chunk_size (int, optional): number of rows per chunk. Defaults to 10000.
+
+    Yields:
+        Tuple: arrays of customer numbers, consumption categories, date ordinals and
+            half-hourly values (in kWh, shape (num_rows, 48)) of the rows in chunk,
+            and metadata of the customers in chunk.
+    """
+    with open(csv_path, "r", newline="") as file:
+        reader = csv.reader(file)
+
+        # First line is a title, second line the header
+        header = next(reader)
+        if "Customer" not in header:
+            header = next(reader)
+
+        customer_col = header.index("Customer")
+        category_col = header.index("Consumption Category")
+        date_col = header.index("date")
+        capacity_col = header.index("Generator Capacity")
+        postcode_col = header.index("Postcode")
+        value_cols = slice(date_col + 1, date_col + 1 + VALUES_PER_DAY)
+
+        while True:
+            rows = [row for _, row in zip(range(chunk_size), reader) if row]
+            if not rows:
+                break
+
+            customers = np.array([int(row[customer_col]) for row in rows])
+            categories = np.array([row[category_col] for row in rows])
+            dates = np.array([parse_date(row[date_col]) for row in rows])
+            values = np.array(
+                [[value or "nan" for value in row[value_cols]] for row in rows],
+                dtype=float,
+            )
+            metadata = {
+                int(row[customer_col]): {
+                    "generator_capacity": float(row[capacity_col] or "nan"),
+                    "postcode": row[postcode_col],
+                }
+                for row in rows
+            }
+
+            yield customers, categories, dates, values, metadata
+
+
+def resample(values: np.ndarray, steps_per_day: int) -> np.ndarray:
+    """Resample half-hourly energy values into power values.
+
+    Args:
+        values (np.ndarray): energy values per half hour (kWh), shape (num_days, 48).
+        steps_per_day (int): number of steps per day of resampled values, must divide
+            48.
+
+    Returns:
+        np.ndarray: average power per step (kW), shape (num_days * steps_per_day,).
+    """
+    if VALUES_PER_DAY % steps_per_day != 0:
+        raise ValueError(
+            "Steps per day must divide {}, got {}.".format(
+                VALUES_PER_DAY, steps_per_day
+            )
+        )
+    step_len = 24 / steps_per_day
+    values = values.reshape(len(values), steps_per_day, -1).sum(axis=-1)
+    return values.ravel() / step_len
+
+
+def _write_customer(
+    store: TraceStore,
+    customer: int,
+    days: Dict[str, Dict[int, np.ndarray]],
+    metadata: Dict,
+    steps_per_day: int,
+    dtype: str,
+) -> None:
+    """Pivot buffered rows of a customer into load and PV traces and write them.
+
+    Args:
+        store (TraceStore): store to write traces to.
+        customer (int): customer number.
+        days (Dict[str, Dict[int, np.ndarray]]): half-hourly values per consumption
+            category and date ordinal.
+        metadata (Dict): metadata of customer.
+        steps_per_day (int): number of steps per day of traces.
+        dtype (str): data type of traces.
+    """
+    all_days = [day for category_days in days.values() for day in category_days]
+    first_day = min(all_days)
+    num_days = max(all_days) - first_day + 1
+
+    def pivot(categories: List[str]) -> np.ndarray:
+        """Sum categories into daily values, missing where first category is."""
+        pivoted = np.full((num_days, VALUES_PER_DAY), np.nan)
+        for day, values in days.get(categories[0], {}).items():
+            pivoted[day - first_day] = values
+        for category in categories[1:]:
+            for day, values in days.get(category, {}).items():
+                pivoted[day - first_day] += np.nan_to_num(values)
+        return resample(pivoted, steps_per_day).astype(dtype)
+
+    start_date = datetime.date.fromordinal(first_day).isoformat()
+    for name, categories, channel in [
+        ("load_{}", LOAD_CATEGORIES, "load"),
+        ("PV_{}", PV_CATEGORIES, "pv"),
+    ]:
+        store.merge(
+            name.format(customer),
+            pivot(categories),
+            start_date=start_date,
+            steps_per_day=steps_per_day,
+            customer=customer,
+            channel=channel,
+            **metadata,
+        )
+
+
+def ingest_file(
+    csv_path: str,
+    store_path: str,
+    steps_per_day: int = 24,
+    chunk_size: int = 10000,
+    dtype: str = "float32",
+) -> List[str]:
+    """Ingest a raw Ausgrid CSV file into a trace store.
+
+    The rows of the raw files are grouped by customer, such that only the rows of
+    the current customer (and of the current chunk) are held in memory. If a
+    customer's rows are not contiguous, the parts are merged by date in the store.
+
+    Args:
+        csv_path (str): path to raw CSV file.
+        store_path (str): directory of trace store.
+        steps_per_day (int, optional): number of steps per day in traces, e.g. 24
+            for hourly and 48 for (the native) half-hourly resolution. Defaults to 24.
+        chunk_size (int, optional): number of rows read at once. Defaults to 10000.
+        dtype (str, optional): data type of traces. Defaults to "float32".
+
+    Returns:
+        List[str]: names of traces written.
+    """
+    store = TraceStore(store_path)
+
+    names = []
+    customer = None
+    days = {}
+    metadata = {}
+
+    def flush():
+        _write_customer(store, customer, days, metadata[customer], steps_per_day, dtype)
+        names.extend(["load_{}".format(customer), "PV_{}".format(customer)])
+
+    for customers, categories, dates, values, chunk_metadata in read_chunks(
+        csv_path, chunk_size=chunk_size
+    ):
+        metadata.update(chunk_metadata)
+
+        # Split chunk into contiguous blocks of rows of the same customer
+        block_starts = np.flatnonzero(np.diff(customers, prepend=np.nan))
+        block_ends = np.append(block_starts[1:], len(customers))
+        for start, end in zip(block_starts, block_ends):
+            if customers[start] != customer:
+                if customer is not None:
+                    flush()
+                customer = int(customers[start])
+                days = {}
+            for category, date, day_values in zip(
+                categories[start:end], dates[start:end], values[start:end]
+            ):
+                days.setdefault(category, {})[date] = day_values
+
+    if customer is not None:
+        flush()
+
+    logger.info("Ingested %s traces from %s.", len(names), csv_path)
+
+    return names
+
+
+def _ingest_file_into_part(args: Tuple) -> str:
+    """Ingest file into its own part store, for use with multiprocessing."""
+    csv_path, part_path, kwargs = args
+    ingest_file(csv_path, part_path, **kwargs)
+    return part_path
+
+
+def ingest(
+    csv_paths: List[str],
+    store_path: str,
+    steps_per_day: int = 24,
+    chunk_size: int = 10000,
+    dtype: str = "float32",
+    num_workers: int = 1,
+) -> TraceStore:
+    """Ingest raw Ausgrid CSV files into a trace store.
+
+    Args:
+        csv_paths (List[str]): paths to raw CSV files.
+        store_path (str): directory of trace store.
+        steps_per_day (int, optional): number of steps per day in traces. Defaults to
+            24.
+        chunk_size (int, optional): number of rows read at once. Defaults to 10000.
+        dtype (str, optional): data type of traces. Defaults to "float32".
+        num_workers (int, optional): number of processes ingesting files in
+            parallel. Each process writes into a separate part store, which are
+            merged afterwards. Defaults to 1.
+
+    Returns:
+        TraceStore: store with ingested traces.
+    """
+    kwargs = {"steps_per_day": steps_per_day, "chunk_size": chunk_size, "dtype": dtype}
+
+    if num_workers == 1 or len(csv_paths) == 1:
+        for csv_path in csv_paths:
+            ingest_file(csv_path, store_path, **kwargs)
+        return TraceStore(store_path)
+
+    parts_path = os.path.join(store_path, "parts")
+    jobs = [
+        (csv_path, os.path.join(parts_path, str(i)), kwargs)
+        for i, csv_path in enumerate(csv_paths)
+    ]
+    with multiprocessing.Pool(num_workers) as pool:
+        part_paths = pool.map(_ingest_file_into_part, jobs)
+
+    store = TraceStore(store_path)
+    for part_path in part_paths:
+        part = TraceStore(part_path)
+        for name in part.names():
+            part_metadata = dict(part.get_metadata(name))
+            del part_metadata["file"], part_metadata["length"]
+            store.merge(name, part.load(name), **part_metadata)
+    shutil.rmtree(parts_path)
+
+    return store
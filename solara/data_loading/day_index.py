@@ -0,0 +1,146 @@
+"""Module with per-day index of traces used for sampling episodes."""
+
+from __future__ import annotations
+
+import numpy as np
+
+
+def get_steps_per_day(time_step_len: float) -> int:
+    """Get number of time steps per day.
+
+    Args:
+        time_step_len (float): length of time steps in hours, e.g. 0.5 for
+            half-hourly or 1/12 for 5-minute traces.
+
+    Returns:
+        int: number of time steps per day.
+    """
+    steps_per_day = int(round(24 / time_step_len))
+    if not np.isclose(steps_per_day * time_step_len, 24):
+        raise ValueError(
+            "Time step length {} does not divide a day.".format(time_step_len)
+        )
+    return steps_per_day
+
+
+def get_num_start_days(trace_len: int, steps_per_day: int, num_steps: int) -> int:
+    """Get number of days at whose beginning an episode can start.
+
+    Args:
+        trace_len (int): number of values in trace.
+        steps_per_day (int): number of values per day.
+        num_steps (int): number of time steps of episode, which can span several
+            days. An episode requires num_steps + 1 values.
+
+    Returns:
+        int: number of days, i.e. episodes can start at days 0 to this number - 1.
+    """
+    return max((trace_len - num_steps - 1) // steps_per_day + 1, 0)
+
+
+class DayIndex:
+    """Index of the days in a trace with precomputed per-day statistics."""
+
+    def __init__(
+        self, trace: np.ndarray, steps_per_day: int = 24, start_date: str = None
+    ) -> None:
+        """Index of the days in a trace with precomputed per-day statistics.
+
+        The statistics are arrays with one entry per (complete) day in the trace,
+        such that days can be selected by their properties with array operations,
+        e.g. `(index.sums > 10) & ~index.is_weekend`, and passed as mask to a
+        `DaySampler`.
+
+        Args:
+            trace (np.ndarray): trace with values starting at the beginning of a day.
+            steps_per_day (int, optional): number of values per day. Defaults to 24.
+            start_date (str, optional): date of first value of trace in ISO format
+                (YYYY-MM-DD). Defaults to None, in which case no calendar information
+                (dates, weekdays, months) is available.
+        """
+        self.steps_per_day = steps_per_day
+        self.num_days = len(trace) // steps_per_day
+
+        days = np.asarray(trace[: self.num_days * steps_per_day]).reshape(
+            self.num_days, steps_per_day
+        )
+        missing = np.isnan(days)
+
+        self.num_missing = missing.sum(axis=1)
+        self.has_missing = self.num_missing > 0
+        self.sums = np.where(missing, 0, days).sum(axis=1)
+        self.peaks = np.where(missing, -np.inf, days).max(axis=1)
+        self.minima = np.where(missing, np.inf, days).min(axis=1)
+
+        if start_date is not None:
+            self.dates = np.datetime64(start_date, "D") + np.arange(self.num_days)
+            # 1970-01-01 (day 0) was a Thursday, weekday 3 with Monday as 0
+            self.weekdays = (self.dates.astype(np.int64) + 3) % 7
+            self.is_weekend = self.weekdays >= 5
+            self.months = self.dates.astype("datetime64[M]").astype(np.int64) % 12 + 1
+        else:
+            self.dates = None
+            self.weekdays = None
+            self.is_weekend = None
+            self.months = None
+
+
+class DaySampler:
+    """Sampler of days with optional mask and weights."""
+
+    def __init__(
+        self,
+        num_days: int,
+        mask: np.ndarray = None,
+        weights: np.ndarray = None,
+        rng: np.random.Generator = None,
+    ) -> None:
+        """Sampler of days with optional mask and weights.
+
+        Without mask and weights days are sampled uniformly. Otherwise, the
+        cumulative sum of the (masked) weights is computed once, such that each
+        sample only requires a binary search.
+
+        Args:
+            num_days (int): number of days to sample from, i.e. days 0 to
+                num_days - 1.
+            mask (np.ndarray, optional): boolean array of days that can be sampled,
+                only the first num_days entries are used. Defaults to None.
+            weights (np.ndarray, optional): non-negative sampling weights of days,
+                only the first num_days entries are used. Defaults to None.
+            rng (np.random.Generator, optional): random number generator to sample
+                with. Defaults to None, which creates a new unseeded generator.
+        """
+        self.num_days = num_days
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        if mask is None and weights is None:
+            self.cdf = None
+        else:
+            if weights is None:
+                weights = np.ones(num_days)
+            weights = np.asarray(weights[:num_days], dtype=float)
+            if mask is not None:
+                weights = weights * mask[:num_days]
+            self.cdf = np.cumsum(weights)
+            if len(self.cdf) < num_days or not self.cdf[-1] > 0:
+                raise ValueError(
+                    "Mask and weights must cover all days and select at least one."
+                )
+
+    def sample(self, size: int = None) -> np.ndarray:
+        """Sample day(s).
+
+        Args:
+            size (int, optional): number of days to sample. Defaults to None, which
+                returns a single day.
+
+        Returns:
+            np.ndarray: sampled day index (or indices).
+        """
+        if self.cdf is None:
+            return self.rng.integers(self.num_days, size=size)
+
+        return np.searchsorted(
+            self.cdf, self.rng.random(size) * self.cdf[-1], side="right"
+        )
@@ -0,0 +1,287 @@
+"""Module with a binary store for load and PV traces.
+
+Text traces (e.g. `PV_5796.txt`) are converted once into `.npy` files next to the
+original file. These are then opened as memory maps, so that all processes reading
+the same trace share its pages via the OS cache instead of parsing and holding their
+own copy of the data. Collections of traces with metadata (e.g. from the Ausgrid
+dataset) are kept in a `TraceStore` directory.
+"""
+
+from typing import Dict, List
+import datetime
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache_path(data_path: str, dtype: str = "float64") -> str:
+    """Get path of binary cache file for a text trace.
+
+    Args:
+        data_path (str): path to text trace.
+        dtype (str, optional): data type of cached trace. Defaults to "float64".
+
+    Returns:
+        str: path of cache file, e.g. `PV_5796.float32.npy` for `PV_5796.txt`.
+    """
+    root, _ = os.path.splitext(data_path)
+    return "{}.{}.npy".format(root, np.dtype(dtype).name)
+
+
+def is_cache_valid(data_path: str, cache_path: str) -> bool:
+    """Check whether cache file exists and is not older than text trace.
+
+    Args:
+        data_path (str): path to text trace.
+        cache_path (str): path to cache file.
+
+    Returns:
+        bool: whether cache can be used instead of text trace.
+    """
+    return os.path.exists(cache_path) and os.path.getmtime(
+        cache_path
+    ) >= os.path.getmtime(data_path)
+
+
+def save_trace(trace: np.ndarray, path: str) -> None:
+    """Atomically save trace to `.npy` file.
+
+    The trace is first written to a temporary file in the same directory, which is
+    then moved into place. This way, concurrent processes never read a partially
+    written file.
+
+    Args:
+        trace (np.ndarray): trace to save.
+        path (str): path of `.npy` file.
+    """
+    file_descriptor, tmp_path = tempfile.mkstemp(
+        suffix=".npy", dir=os.path.dirname(os.path.abspath(path))
+    )
+    try:
+        with os.fdopen(file_descriptor, "wb") as file:
+            np.save(file, trace)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_trace(
+    data_path: str, dtype: str = "float64", use_cache: bool = True
+) -> np.ndarray:
+    """Load a trace, preferring a memory-mapped binary cache of it.
+
+    If there is no up-to-date cache file for the text trace, it is created first.
+    If the cache can't be written (e.g. in a read-only data directory), the text
+    trace is loaded into memory instead.
+
+    Args:
+        data_path (str): path to trace, either a text file with one value per line or
+            a `.npy` file.
+        dtype (str, optional): data type of returned trace. Defaults to "float64".
+        use_cache (bool, optional): whether to use binary cache. Defaults to True.
+
+    Returns:
+        np.ndarray: trace, read-only if memory-mapped.
+    """
+    if data_path.endswith(".npy"):
+        trace = np.load(data_path, mmap_mode="r")
+        if trace.dtype != np.dtype(dtype):
+            trace = trace.astype(dtype)
+        return trace
+
+    if not use_cache:
+        return np.loadtxt(data_path, delimiter=",", dtype=dtype)
+
+    cache_path = get_cache_path(data_path, dtype)
+
+    if not is_cache_valid(data_path, cache_path):
+        trace = np.loadtxt(data_path, delimiter=",", dtype=dtype)
+        try:
+            save_trace(trace, cache_path)
+        except OSError as error:
+            logger.warning("Could not cache trace %s (%s).", data_path, error)
+            return trace
+        logger.info("Cached trace %s at %s.", data_path, cache_path)
+
+    return np.load(cache_path, mmap_mode="r")
+
+
+class TraceStore:
+    """Directory of binary traces with an index of their metadata."""
+
+    index_file_name = "index.json"
+
+    def __init__(self, path: str) -> None:
+        """Directory of binary traces with an index of their metadata.
+
+        Each trace is saved as a `.npy` file in the directory, and the index
+        (`index.json`) maps trace names to their file and metadata, e.g. the date of
+        their first value and number of steps per day.
+
+        Args:
+            path (str): directory of store, created if it doesn't exist.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        index_path = os.path.join(path, self.index_file_name)
+        if os.path.exists(index_path):
+            with open(index_path, "r") as file:
+                self.index = json.load(file)
+        else:
+            self.index = {}
+
+    def __contains__(self, name: str) -> bool:
+        """Whether trace is in store."""
+        return name in self.index
+
+    def __len__(self) -> int:
+        """Number of traces in store."""
+        return len(self.index)
+
+    def names(self) -> List[str]:
+        """Get names of all traces in store."""
+        return list(self.index.keys())
+
+    def get_path(self, name: str) -> str:
+        """Get path of trace file, e.g. to use as `data_path` of `DataLoad`.
+
+        Args:
+            name (str): name of trace.
+
+        Returns:
+            str: path of `.npy` file
+        """
+        return os.path.join(self.path, self.index[name]["file"])
+
+    def get_metadata(self, name: str) -> Dict:
+        """Get metadata of trace.
+
+        Args:
+            name (str): name of trace.
+
+        Returns:
+            Dict: metadata of trace.
+        """
+        return self.index[name]
+
+    def load(self, name: str) -> np.ndarray:
+        """Load trace as read-only memory map.
+
+        Args:
+            name (str): name of trace.
+
+        Returns:
+            np.ndarray: trace
+        """
+        return np.load(self.get_path(name), mmap_mode="r")
+
+    def write(self, name: str, trace: np.ndarray, **metadata) -> None:
+        """Write trace to store, replacing any existing trace of the same name.
+
+        Args:
+            name (str): name of trace.
+            trace (np.ndarray): trace to write.
+            **metadata: metadata saved in index, must be JSON serialisable.
+        """
+        file_name = name + ".npy"
+        save_trace(trace, os.path.join(self.path, file_name))
+        self.index[name] = {"file": file_name, "length": len(trace), **metadata}
+        self.save_index()
+
+    def merge(
+        self,
+        name: str,
+        trace: np.ndarray,
+        start_date: str,
+        steps_per_day: int,
+        **metadata,
+    ) -> None:
+        """Merge trace into store, combining it with an existing trace of same name.
+
+        Traces are aligned by date. Days only covered by one of the traces are taken
+        from that trace, and missing values (NaN) in the new trace are filled with
+        values of the existing trace. Days covered by neither are set to NaN.
+
+        Args:
+            name (str): name of trace.
+            trace (np.ndarray): trace to merge, starting at the beginning of a day.
+            start_date (str): date of the first value in ISO format (YYYY-MM-DD).
+            steps_per_day (int): number of values per day.
+            **metadata: further metadata saved in index.
+        """
+        start = datetime.date.fromisoformat(start_date).toordinal()
+
+        if name in self:
+            old_metadata = self.get_metadata(name)
+            if old_metadata["steps_per_day"] != steps_per_day:
+                raise ValueError(
+                    "Can't merge trace {} with different steps per day.".format(name)
+                )
+            old_trace = self.load(name)
+            old_start = datetime.date.fromisoformat(
+                old_metadata["start_date"]
+            ).toordinal()
+
+            new_start = min(start, old_start)
+            new_end = max(
+                start + len(trace) // steps_per_day,
+                old_start + len(old_trace) // steps_per_day,
+            )
+            merged = np.full(
+                (new_end - new_start) * steps_per_day,
+                np.nan,
+                dtype=np.result_type(trace, old_trace),
+            )
+
+            old_offset = (old_start - new_start) * steps_per_day
+            old_end_offset = old_offset + len(old_trace)
+            merged[old_offset:old_end_offset] = old_trace
+
+            offset = (start - new_start) * steps_per_day
+            end_offset = offset + len(trace)
+            np.copyto(merged[offset:end_offset], trace, where=~np.isnan(trace))
+
+            metadata = {**old_metadata, **metadata}
+            start, trace = new_start, merged
+            del old_trace
+
+        metadata["start_date"] = datetime.date.fromordinal(start).isoformat()
+        metadata["steps_per_day"] = steps_per_day
+        metadata.pop("file", None)
+        metadata.pop("length", None)
+        self.write(name, trace, **metadata)
+
+    def save_index(self) -> None:
+        """Atomically save index to store directory."""
+        file_descriptor, tmp_path = tempfile.mkstemp(suffix=".json", dir=self.path)
+        with os.fdopen(file_descriptor, "w") as file:
+            json.dump(self.index, file, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, self.index_file_name))
+
+
+def get_trace_metadata(data_path: str) -> Dict:
+    """Get metadata of trace if it is part of a trace store.
+
+    Args:
+        data_path (str): path to trace file.
+
+    Returns:
+        Dict: metadata of trace from store index, empty if trace is not in a store.
+    """
+    index_path = os.path.join(os.path.dirname(data_path), TraceStore.index_file_name)
+    if not os.path.exists(index_path):
+        return {}
+
+    with open(index_path, "r") as file:
+        index = json.load(file)
+    for metadata in index.values():
+        if metadata["file"] == os.path.basename(data_path):
+            return metadata
+    return {}
@@ -0,0 +1,272 @@
+"""Module with battery control environment simulating many households at once."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Tuple, List, Dict, Union
+import logging
+import numpy as np
+
+if TYPE_CHECKING:
+    from solara.envs.battery_control import BatteryControlEnv
+
+
+class BatchedBatteryControlEnv:
+    """A batch of battery control environments stepped in a single vectorized call."""
+
+    def __init__(self, envs: List[BatteryControlEnv]) -> None:
+        """A batch of battery control environments stepped in a single vectorized call.
+
+        The battery contents, load and PV windows and grid parameters of all
+        households are held as arrays, such that stepping the whole batch costs
+        roughly as much as stepping a single `BatteryControlEnv`. The results match
+        those of the given environments stepped independently (up to floating point
+        precision).
+
+        The given environments are only used as a source of components and settings,
+        they are not stepped themselves. The same environment can therefore be given
+        several times, e.g. to simulate many days of one household. All environments
+        must share the same episode length, time step length and observation
+        settings. With flat observations (`flat_obs=True`), the observations of all
+        households are returned as a single array of shape (num_envs, obs_size).
+
+        Args:
+            envs (List[BatteryControlEnv]): environments of the households.
+        """
+
+        for attr in [
+            "episode_len",
+            "time_step_len",
+            "obs_keys",
+            "flat_obs",
+            "time_step_encoding",
+        ]:
+            if any(getattr(env, attr) != getattr(envs[0], attr) for env in envs):
+                raise ValueError(
+                    "All environments in batch must have the same {}.".format(attr)
+                )
+
+        self.envs = envs
+        self.num_envs = len(envs)
+
+        self.episode_len = envs[0].episode_len
+        self.time_step_len = envs[0].time_step_len
+        self.obs_keys = envs[0].obs_keys
+        self.flat_obs = envs[0].flat_obs
+
+        self.single_action_space = envs[0].action_space
+        self.single_observation_space = envs[0].observation_space
+
+        # Components with one entry per household in their parameters
+        self.battery = type(envs[0].battery).stack([env.battery for env in envs])
+        self.grid = type(envs[0].grid).stack([env.grid for env in envs])
+
+        self.min_charge_power = np.array([env.min_charge_power for env in envs])
+        self.max_charge_power = np.array([env.max_charge_power for env in envs])
+        self.grid_charging = np.array([env.grid_charging for env in envs])
+        self.infeasible_control_penalty = np.array(
+            [env.infeasible_control_penalty for env in envs]
+        )
+
+        self._env_idxs = np.arange(self.num_envs)
+        self._load_values = np.zeros((self.num_envs, self.episode_len + 1))
+        self._pv_values = np.zeros((self.num_envs, self.episode_len + 1))
+        self.state = {
+            "load": np.zeros(self.num_envs, dtype=np.float32),
+            "pv_gen": np.zeros(self.num_envs, dtype=np.float32),
+            "battery_cont": np.zeros(self.num_envs, dtype=np.float32),
+            "time_step": np.zeros(self.num_envs, dtype=int),
+            "time_step_cont": np.zeros(self.num_envs, dtype=np.float32),
+            "cum_load": np.zeros(self.num_envs, dtype=np.float32),
+            "cum_pv_gen": np.zeros(self.num_envs, dtype=np.float32),
+            "load_change": np.zeros(self.num_envs, dtype=np.float32),
+            "pv_change": np.zeros(self.num_envs, dtype=np.float32),
+        }
+
+        self.logger = logging.getLogger(type(self).__name__)
+        self.logger.info(
+            "Batched environment with %s households initialised.", len(envs)
+        )
+
+        self.reset()
+
+    def step(
+        self, actions: np.ndarray
+    ) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+        """Run one timestep of the dynamics of all households.
+
+        Args:
+            actions (np.ndarray): one action per household, shape (num_envs,) or
+                (num_envs, 1).
+
+        Returns:
+            observations (Dict[str, np.ndarray]): observation of each household,
+                with the household along the first axis of each entry.
+            rewards (np.ndarray): reward of each household.
+            dones (np.ndarray): whether the episode of each household has ended.
+            infos (Dict[str, np.ndarray]): auxiliary information, with one entry per
+                household for each key.
+        """
+        actions = np.asarray(actions, dtype=np.float64).reshape(self.num_envs)
+
+        load = self.state["load"]
+        pv_generation = self.state["pv_gen"]
+
+        # Actions are proportion of max/min charging power, hence scale up
+        power = np.where(
+            actions > 0,
+            actions * self.max_charge_power,
+            actions * -self.min_charge_power,
+        )
+        attempted_power = power
+
+        # If charging from grid not enabled, limit charging to solar generation
+        power = np.where(self.grid_charging, power, np.minimum(power, pv_generation))
+
+        charging_power, self.battery.b = self.battery.simulate_charge(power)
+
+        # Get the net load after accounting for power stream of battery and PV
+        net_load = load + charging_power - pv_generation
+        net_load = np.maximum(net_load, 0)
+
+        # Draw remaining net load from grid and get price paid
+        cost = self.grid.draw_power(net_load)
+
+        reward = -cost
+
+        infos = {}
+
+        # Add impossible control penalty to cost
+        if np.any(self.infeasible_control_penalty):
+            power_diff = np.abs(charging_power - attempted_power)
+            power_diff = np.where(self.infeasible_control_penalty, power_diff, 0)
+            reward = reward - power_diff
+            infos["power_diff"] = power_diff
+
+        # Get load and PV generation for next time step
+        time_step = self.state["time_step"] + 1
+        new_load = self._load_values[self._env_idxs, time_step]
+        new_pv_generation = self._pv_values[self._env_idxs, time_step]
+
+        battery_cont = self.battery.get_energy_content()
+
+        self.state = {
+            "load": new_load.astype(np.float32),
+            "pv_gen": new_pv_generation.astype(np.float32),
+            "battery_cont": battery_cont.astype(np.float32),
+            "time_step": time_step,
+            "time_step_cont": time_step.astype(np.float32),
+            "cum_load": (self.state["cum_load"] + new_load).astype(np.float32),
+            "cum_pv_gen": (self.state["cum_pv_gen"] + new_pv_generation).astype(
+                np.float32
+            ),
+            "load_change": (load - new_load).astype(np.float32),
+            "pv_change": (pv_generation - new_pv_generation).astype(np.float32),
+        }
+
+        dones = time_step >= self.episode_len
+
+        infos["net_load"] = net_load
+        infos["charging_power"] = charging_power
+        infos["cost"] = cost
+        infos["battery_cont"] = battery_cont
+        infos["price_threshold"] = self.grid.peak_threshold
+
+        return self._get_obs_from_state(self.state), reward, dones, infos
+
+    def _get_obs_from_state(self, state: dict) -> Dict[str, np.ndarray]:
+        """Get observations of all households from state dict.
+
+        Args:
+            state (dict): state dictionary
+
+        Returns:
+            Dict[str, np.ndarray]: observation dictionary, or array of flat
+                observations if `flat_obs` is set.
+        """
+        if self.flat_obs:
+            return self.envs[0].flatten_obs(state)
+        return {
+            key: state[key].copy() if key == "time_step" else state[key][:, np.newaxis]
+            for key in self.obs_keys
+        }
+
+    def reset(
+        self, env_idxs: List[int] = None, days: List[int] = None
+    ) -> Dict[str, np.ndarray]:
+        """Reset households to new initial states and return the observations.
+
+        Args:
+            env_idxs (List[int], optional): households to reset. Defaults to None,
+                which resets all households.
+            days (List[int], optional): day of the traces to start the episode of each
+                reset household at. The load and solar components of the households
+                must not have a fixed start (see `DataLoad.fix_start()`), which would
+                override the days. Defaults to None, which samples the days.
+
+        Returns:
+            Dict[str, np.ndarray]: observations of all households.
+        """
+        if env_idxs is None:
+            env_idxs = self._env_idxs
+        if days is None:
+            days = [None] * len(env_idxs)
+        elif len(days) != len(env_idxs):
+            raise ValueError("Number of days must match number of reset households.")
+        elif any(
+            self.envs[idx].load.fixed_start is not None
+            or self.envs[idx].solar.fixed_start is not None
+            for idx in env_idxs
+        ):
+            raise ValueError(
+                "Days given for households with a fixed start of load or solar data."
+            )
+
+        for idx, day in zip(env_idxs, days):
+            env = self.envs[idx]
+            if day is None:
+                day = env.day_sampler.sample()
+            start = day * env.steps_per_day
+
+            env.load.reset(start=start)
+            env.solar.reset(start=start)
+
+            self._load_values[idx] = env.load.episode_values[: self.episode_len + 1]
+            self._pv_values[idx] = env.solar.episode_values[: self.episode_len + 1]
+
+        self.battery.b = np.array(self.battery.b, dtype=float).reshape(self.num_envs)
+        self.battery.b[env_idxs] = self.battery.v1_bar[env_idxs]
+
+        self.state = {key: value.copy() for key, value in self.state.items()}
+        for value in self.state.values():
+            value[env_idxs] = 0
+        self.state["load"][env_idxs] = self._load_values[env_idxs, 0]
+        self.state["pv_gen"][env_idxs] = self._pv_values[env_idxs, 0]
+
+        self.logger.debug("Households %s reset.", env_idxs)
+
+        return self._get_obs_from_state(self.state)
+
+    def seed(self, seed: Union[int, np.random.SeedSequence] = None) -> List[int]:
+        """Sets the seeds of the random number generators of all households.
+
+        Each distinct environment of the batch is seeded with its own seed sequence
+        spawned from `seed`, such that the days of the households are sampled from
+        independent streams.
+
+        Args:
+            seed (Union[int, np.random.SeedSequence], optional): seed. Defaults to
+                None, which seeds from fresh entropy.
+
+        Returns:
+            List[int]: entropy of the seed sequence, to pass as seed to reproduce.
+        """
+        if isinstance(seed, np.random.SeedSequence):
+            seed_seq = seed
+        else:
+            seed_seq = np.random.SeedSequence(seed)
+
+        # The same environment can be in the batch several times, it is seeded once
+        envs = list({id(env): env for env in self.envs}.values())
+        for env, env_seq in zip(envs, seed_seq.spawn(len(envs))):
+            env.seed(env_seq)
+
+        return [seed_seq.entropy]
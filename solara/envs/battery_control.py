@@ -1,12 +1,17 @@
 """Module with battery control environment of a photovoltaic installation."""
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Tuple, List
+from typing import TYPE_CHECKING, Tuple, List, Dict, Union
 import logging
 import gym
 import numpy as np
 
 import solara.utils.logging
+from solara.data_loading.day_index import (
+    DaySampler,
+    get_num_start_days,
+    get_steps_per_day,
+)
 
 if TYPE_CHECKING:
     from solara.envs.components.battery import BatteryModel
@@ -14,6 +19,19 @@ if TYPE_CHECKING:
     from solara.envs.components.load import LoadModel
     from solara.envs.components.solar import PVModel
 
+# Keys of state dict, in order of state vector of `get_state()`
+STATE_KEYS = [
+    "load",
+    "pv_gen",
+    "battery_cont",
+    "time_step",
+    "time_step_cont",
+    "cum_load",
+    "cum_pv_gen",
+    "load_change",
+    "pv_change",
+]
+
 
 class BatteryControlEnv(gym.Env):
     """A gym enviroment for controlling a battery in a PV installation."""
@@ -31,6 +49,9 @@ class BatteryControlEnv(gym.Env):
         obs_keys: List = None,
         logging_level: str = "WARNING",
         log_handler: logging.Handler = None,
+        fast_mode: bool = False,
+        flat_obs: bool = False,
+        time_step_encoding: str = "one_hot",
     ) -> None:
         """A gym enviroment for controlling a battery in a PV installation.
 
@@ -51,6 +72,26 @@ class BatteryControlEnv(gym.Env):
         Note: a default reward range set to [-inf,+inf] already exists. Set it if you
         want a narrower range. The methods are accessed publicly as "step", "reset",
         etc...
+
+        Episodes start at the beginning of a day of the load and PV traces, which
+        have `24 / time_step_len` steps per day (e.g. 48 for half-hourly traces).
+        With `episode_len` larger than the steps per day, episodes span several days.
+
+        With `fast_mode=True`, `step()` avoids allocations: observations are
+        preallocated float32 arrays that are updated in place (and hence overwritten
+        by the next step), the same info dict is returned at every step, and actions
+        are only validated if the logging level is DEBUG.
+
+        With `flat_obs=True`, observations are a single float32 vector instead of a
+        dict, with the observations of `obs_keys` concatenated in the order of
+        `obs_keys`. The position of each key in the vector is given by
+        `self.obs_slices`. The (discrete) time step is encoded according to
+        `time_step_encoding`:
+            one_hot: one entry per time step 0 to episode_len (as done by RLlib's
+                preprocessor for dict observations)
+            scalar: single entry with the time step
+            sin_cos: two entries with sine and cosine of the position in the
+                episode, i.e. of 2*pi*time_step/episode_len
         """
 
         if obs_keys is None:
@@ -69,11 +110,28 @@ class BatteryControlEnv(gym.Env):
         self.components = [battery, solar, grid, load]
 
         self.data_len = min(len(self.load.data), len(self.solar.data))
-
         self.episode_len = episode_len
         self.time_step_len = time_step_len
+        self.steps_per_day = get_steps_per_day(time_step_len)
+        for component in [self.load, self.solar, self.battery, self.grid]:
+            steps_per_day = getattr(component, "steps_per_day", self.steps_per_day)
+            component_time_step_len = getattr(component, "time_step_len", time_step_len)
+            if steps_per_day != self.steps_per_day or not np.isclose(
+                component_time_step_len, time_step_len
+            ):
+                raise ValueError(
+                    "Time step length of {} does not match that of env.".format(
+                        type(component).__name__
+                    )
+                )
+
+        self.rng = np.random.default_rng()
+        self.set_day_sampling()
         self.grid_charging = grid_charging
         self.infeasible_control_penalty = infeasible_control_penalty
+        self.fast_mode = fast_mode
+        self.flat_obs = flat_obs
+        self.time_step_encoding = time_step_encoding
 
         # Setting up action and observation space
 
@@ -115,7 +173,10 @@ class BatteryControlEnv(gym.Env):
 
         # Selecting the subset of obs spaces selected
         obs_spaces = {key: obs_spaces[key] for key in self.obs_keys}
-        self.observation_space = gym.spaces.Dict(obs_spaces)
+        if self.flat_obs:
+            self._setup_flat_obs(obs_spaces)
+        else:
+            self.observation_space = gym.spaces.Dict(obs_spaces)
 
         (
             self.min_charge_power,
@@ -125,6 +186,30 @@ class BatteryControlEnv(gym.Env):
         self._setup_logging(logging_level, log_handler)
         self.logger.info("Environment initialised.")
 
+        if self.fast_mode:
+            # Buffers reused by every step, with state and observation as views
+            self._state_buffers = {
+                key: np.zeros(1, dtype=np.float32)
+                for key in [
+                    "load",
+                    "pv_gen",
+                    "battery_cont",
+                    "time_step_cont",
+                    "cum_load",
+                    "cum_pv_gen",
+                    "load_change",
+                    "pv_change",
+                ]
+            }
+            self.state = {"time_step": 0, **self._state_buffers}
+            if self.flat_obs:
+                self._observation = np.zeros(
+                    self.observation_space.shape, dtype=np.float32
+                )
+            else:
+                self._observation = self._get_obs_from_state(self.state)
+            self._info = {}
+
         self.reset()
 
     def step(self, action: object) -> Tuple[object, float, bool, dict]:
@@ -144,6 +229,9 @@ class BatteryControlEnv(gym.Env):
             info (dict): contains auxiliary diagnostic information
                 (helpful for debugging, and sometimes learning)
         """
+        if self.fast_mode:
+            return self._step_fast(action)
+
         assert self.action_space.contains(action), "%r (%s) invalid" % (
             action,
             type(action),
@@ -235,6 +323,228 @@ class BatteryControlEnv(gym.Env):
 
         return (observation, float(reward), done, info)
 
+    def _step_fast(self, action: object) -> Tuple[object, float, bool, dict]:
+        """Run one timestep without allocating new observations and info.
+
+        Same as `step()`, but operating on python floats and writing the new state
+        into the preallocated buffers. The returned observation and info dict are
+        reused by subsequent steps.
+
+        Args:
+            action (object): an action provided by the agent
+        Returns:
+            observation (object): agent's observation of the current environment
+            reward (float) : amount of reward returned after previous action
+            done (bool): whether the episode has ended
+            info (dict): contains auxiliary diagnostic information
+        """
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            assert self.action_space.contains(action), "%r (%s) invalid" % (
+                action,
+                type(action),
+            )
+
+        info = self._info
+
+        action = float(action)  # getting the float value
+        load = self._load
+        pv_generation = self._pv_gen
+
+        # Actions are proportion of max/min charging power, hence scale up
+        if action > 0:
+            action *= self.max_charge_power
+        else:
+            action *= -self.min_charge_power
+
+        attempted_action = action
+
+        if not self.grid_charging:
+            # If charging from grid not enabled, limit charging to solar generation
+            action = min(action, pv_generation)
+
+        charging_power = float(self.battery.charge(power=action))
+
+        # Get the net load after accounting for power stream of battery and PV
+        net_load = max(load + charging_power - pv_generation, 0.0)
+
+        # Draw remaining net load from grid and get price paid
+        cost = float(self.grid.draw_power(power=net_load))
+
+        reward = -cost
+
+        # Add impossible control penalty to cost
+        if self.infeasible_control_penalty:
+            power_diff = abs(charging_power - attempted_action)
+            reward -= power_diff
+            info["power_diff"] = power_diff
+
+        # Get load and PV generation for next time step
+        self._load = float(self.load.get_next_load())
+        self._pv_gen = float(self.solar.get_next_generation())
+
+        battery_cont = float(self.battery.get_energy_content())
+
+        self.time_step += 1
+        time_step = int(self.time_step[0])
+
+        buffers = self._state_buffers
+        buffers["load"][0] = self._load
+        buffers["pv_gen"][0] = self._pv_gen
+        buffers["battery_cont"][0] = battery_cont
+        buffers["time_step_cont"][0] = time_step
+        buffers["cum_load"][0] += self._load
+        buffers["cum_pv_gen"][0] += self._pv_gen
+        buffers["load_change"][0] = load - self._load
+        buffers["pv_change"][0] = pv_generation - self._pv_gen
+        self.state["time_step"] = time_step
+        if self.flat_obs:
+            self.flatten_obs(self.state, out=self._observation)
+        elif "time_step" in self._observation:
+            self._observation["time_step"] = time_step
+
+        done = time_step >= self.episode_len
+
+        info["net_load"] = net_load
+        info["charging_power"] = charging_power
+        info["cost"] = cost
+        info["battery_cont"] = battery_cont
+
+        if debug:
+            self.logger.debug(
+                "step return: obs: %s, rew: %6.3f, done: %s, info: %s",
+                self._observation,
+                reward,
+                done,
+                info,
+            )
+
+        return (self._observation, reward, done, info)
+
+    def rollout(self, actions: np.ndarray) -> Dict[str, np.ndarray]:
+        """Simulate the remainder of the episode for given action sequence(s).
+
+        Unlike repeated calls of `step()`, the whole sequence is simulated in one
+        pass: all exogenous quantities (load, PV generation and their sums and
+        changes) are computed up front, and only the battery is stepped through
+        time. Several candidate sequences can be evaluated at once by passing a 2D
+        array. The environment itself is left unchanged, so that rollouts can be
+        repeated from the same state.
+
+        Args:
+            actions (np.ndarray): actions for each remaining time step of the
+                episode, either of shape (num_steps,) or (num_sequences, num_steps).
+
+        Returns:
+            Dict[str, np.ndarray]: episode data in the format of
+                `solara.utils.episodes.get_episode_dict`, with observations including
+                the current one (num_steps + 1 entries) and all other values per step
+                (num_steps entries). For 2D actions, each value has an additional
+                leading axis over sequences.
+        """
+        start_step = self.time_step.item()
+        num_steps = self.episode_len - start_step
+
+        actions = np.asarray(actions, dtype=np.float64)
+        single_sequence = actions.ndim == 1
+        actions = actions.reshape(-1, num_steps)
+
+        end_step = self.episode_len + 1
+        load = self.load.episode_values[start_step:end_step]
+        pv_generation = self.solar.episode_values[start_step:end_step]
+
+        # Exogenous observations
+        observations = {
+            "load": load.astype(np.float32),
+            "pv_gen": pv_generation.astype(np.float32),
+            "time_step": np.arange(start_step, end_step),
+            "time_step_cont": np.arange(start_step, end_step, dtype=np.float32),
+            "cum_load": np.cumsum(
+                np.concatenate([self.state["cum_load"], load[1:]]), dtype=np.float32
+            ),
+            "cum_pv_gen": np.cumsum(
+                np.concatenate([self.state["cum_pv_gen"], pv_generation[1:]]),
+                dtype=np.float32,
+            ),
+            "load_change": np.concatenate(
+                [self.state["load_change"].ravel(), load[:-1] - load[1:]]
+            ).astype(np.float32),
+            "pv_change": np.concatenate(
+                [
+                    self.state["pv_change"].ravel(),
+                    pv_generation[:-1] - pv_generation[1:],
+                ]
+            ).astype(np.float32),
+        }
+        observations = {
+            key: np.broadcast_to(value, (len(actions), num_steps + 1))
+            for key, value in observations.items()
+        }
+
+        # Actions are proportion of max/min charging power, hence scale up
+        power = np.where(
+            actions > 0,
+            actions * self.max_charge_power,
+            actions * -self.min_charge_power,
+        )
+        attempted_power = power
+
+        if not self.grid_charging:
+            # If charging from grid not enabled, limit charging to solar generation
+            power = np.minimum(power, observations["pv_gen"][:, :-1])
+
+        # Battery is the only component depending on previous actions
+        charging_power = np.zeros(power.shape)
+        battery_cont = np.zeros(power.shape)
+        energy_content = np.full(len(actions), self.battery.get_energy_content())
+        for i in range(num_steps):
+            charging_power[:, i], energy_content = self.battery.simulate_charge(
+                power[:, i], energy_content
+            )
+            battery_cont[:, i] = energy_content
+
+        observations["battery_cont"] = np.concatenate(
+            [
+                np.broadcast_to(self.state["battery_cont"], (len(actions), 1)),
+                battery_cont.astype(np.float32),
+            ],
+            axis=1,
+        )
+
+        # Get the net load after accounting for power stream of battery and PV
+        net_load = (
+            observations["load"][:, :-1]
+            + charging_power
+            - observations["pv_gen"][:, :-1]
+        )
+        net_load = np.maximum(net_load, 0)
+
+        cost = self.grid.draw_power(power=net_load)
+
+        rewards = -cost
+
+        episode = {key: observations[key] for key in self.obs_keys}
+
+        if self.infeasible_control_penalty:
+            power_diff = np.abs(charging_power - attempted_power)
+            rewards = rewards - power_diff
+            episode["power_diff"] = power_diff
+
+        episode["net_load"] = net_load
+        episode["charging_power"] = charging_power
+        episode["cost"] = cost
+        episode["battery_cont"] = battery_cont
+        episode["price_threshold"] = np.full(
+            net_load.shape, self.grid.get_info()["price_threshold"]
+        )
+        episode["rewards"] = rewards
+        episode["actions"] = actions
+
+        if single_sequence:
+            episode = {key: value[0] for key, value in episode.items()}
+
+        return episode
+
     def _get_obs_from_state(self, state: dict) -> dict:
         """Get observation from state dict.
 
@@ -244,8 +554,100 @@ class BatteryControlEnv(gym.Env):
         Returns:
             dict: observation dictionary
         """
+        if self.flat_obs:
+            return self.flatten_obs(state)
         return {key: state[key] for key in self.obs_keys}
 
+    def _setup_flat_obs(self, obs_spaces: Dict[str, gym.spaces.Space]) -> None:
+        """Set up flat observation space and position of each key in it.
+
+        Args:
+            obs_spaces (Dict[str, gym.spaces.Space]): observation spaces of keys.
+        """
+        time_step_bounds = {
+            "one_hot": (np.zeros(self.episode_len + 1), np.ones(self.episode_len + 1)),
+            "scalar": ([0], [self.episode_len]),
+            "sin_cos": ([-1, -1], [1, 1]),
+        }
+        if self.time_step_encoding not in time_step_bounds:
+            raise ValueError(
+                "Unknown time step encoding '{}', must be one of {}.".format(
+                    self.time_step_encoding, list(time_step_bounds.keys())
+                )
+            )
+
+        lows = []
+        highs = []
+        self.obs_slices = {}
+        start = 0
+        for key, space in obs_spaces.items():
+            if key == "time_step":
+                low, high = time_step_bounds[self.time_step_encoding]
+            else:
+                low, high = space.low, space.high
+            self.obs_slices[key] = slice(start, start + len(low))
+            start += len(low)
+            lows.append(low)
+            highs.append(high)
+
+        self.observation_space = gym.spaces.Box(
+            low=np.concatenate(lows).astype(np.float32),
+            high=np.concatenate(highs).astype(np.float32),
+            dtype=np.float32,
+        )
+
+    def flatten_obs(self, state: dict, out: np.ndarray = None) -> np.ndarray:
+        """Get flat observation vector(s) from state dict.
+
+        Also works for batches of states, with each value of the state dict
+        containing one entry per state.
+
+        Args:
+            state (dict): state dictionary
+            out (np.ndarray, optional): array to write observation(s) into. Defaults
+                to None, which creates a new array.
+
+        Returns:
+            np.ndarray: observation of shape (obs_size,), or (num_states, obs_size)
+                for a batch of states.
+        """
+        num_states = np.size(state["time_step"])
+        if out is None:
+            shape = self.observation_space.shape
+            if np.ndim(state["time_step"]) > 0:
+                shape = (num_states, *shape)
+            out = np.zeros(shape, dtype=np.float32)
+        flat_out = out.reshape(num_states, -1)
+
+        for key, obs_slice in self.obs_slices.items():
+            if key != "time_step":
+                flat_out[:, obs_slice.start] = np.reshape(state[key], num_states)
+            elif self.time_step_encoding == "one_hot":
+                flat_out[:, obs_slice] = 0
+                flat_out[
+                    np.arange(num_states), obs_slice.start + state["time_step"]
+                ] = 1
+            elif self.time_step_encoding == "scalar":
+                flat_out[:, obs_slice.start] = state["time_step"]
+            else:
+                angle = 2 * np.pi * np.asarray(state["time_step"]) / self.episode_len
+                flat_out[:, obs_slice.start] = np.sin(angle)
+                flat_out[:, obs_slice.start + 1] = np.cos(angle)
+
+        return out
+
+    def unflatten_obs(self, obs: np.ndarray) -> Dict[str, np.ndarray]:
+        """Split flat observation vector(s) into dict of observations per key.
+
+        Args:
+            obs (np.ndarray): flat observation(s), with entries along last axis.
+
+        Returns:
+            Dict[str, np.ndarray]: views of the entries of each key. The time step is
+                given in its encoded form.
+        """
+        return {key: obs[..., obs_slice] for key, obs_slice in self.obs_slices.items()}
+
     def reset(self) -> object:
         """Resets environment to initial state and returns an initial observation.
 
@@ -253,7 +655,7 @@ class BatteryControlEnv(gym.Env):
             observation (object): the initial observation.
         """
 
-        start = np.random.randint((self.data_len // 24) - 1) * 24
+        start = self.day_sampler.sample() * self.steps_per_day
 
         self.battery.reset()
         self.load.reset(start=start)
@@ -262,6 +664,31 @@ class BatteryControlEnv(gym.Env):
         load = self.load.get_next_load()
         pv_gen = self.solar.get_next_generation()
 
+        self.time_step = np.array([0])
+
+        if self.fast_mode:
+            self._load = float(load)
+            self._pv_gen = float(pv_gen)
+            for buffer in self._state_buffers.values():
+                buffer[0] = 0.0
+            self._state_buffers["load"][0] = load
+            self._state_buffers["pv_gen"][0] = pv_gen
+            self.state["time_step"] = 0
+            if self.flat_obs:
+                self.flatten_obs(self.state, out=self._observation)
+            elif "time_step" in self._observation:
+                self._observation["time_step"] = 0
+            self._info.clear()
+            if self.infeasible_control_penalty:
+                self._info["power_diff"] = 0.0
+            for key in ["net_load", "charging_power", "cost", "battery_cont"]:
+                self._info[key] = 0.0
+            self._info.update(self.grid.get_info())
+
+            self.logger.debug("Environment reset.")
+
+            return self._observation
+
         self.state = {
             "load": np.array([load], dtype=np.float32),
             "pv_gen": np.array([pv_gen], dtype=np.float32),
@@ -276,12 +703,94 @@ class BatteryControlEnv(gym.Env):
 
         observation = self._get_obs_from_state(self.state)
 
-        self.time_step = np.array([0])
-
         self.logger.debug("Environment reset.")
 
         return observation
 
+    def get_state(self) -> np.ndarray:
+        """Get compact snapshot of the environment's dynamic state.
+
+        The snapshot holds the state dict (observations before encoding) and the
+        states of the components, e.g. the battery content and the start and time
+        step of the load and PV episodes. It does not contain the load and PV data,
+        and has the same size for all states of an environment, such that branching
+        from a state (e.g. for tree search) is much cheaper than copying the
+        environment.
+
+        Returns:
+            np.ndarray: state vector, to be restored with `set_state()`.
+        """
+        return np.concatenate(
+            [
+                np.array(
+                    [np.ravel(self.state[key])[0] for key in STATE_KEYS], dtype=float
+                ),
+                *[component.get_state() for component in self.components],
+            ]
+        )
+
+    def set_state(self, state: np.ndarray) -> object:
+        """Restore dynamic state from snapshot taken with `get_state()`.
+
+        Args:
+            state (np.ndarray): state vector.
+
+        Returns:
+            observation (object): the observation of the restored state.
+        """
+        num_keys = len(STATE_KEYS)
+        values = dict(zip(STATE_KEYS, state[:num_keys]))
+        time_step = int(values["time_step"])
+
+        start = num_keys
+        for component in self.components:
+            end = start + len(component.get_state())
+            component.set_state(state[start:end])
+            start = end
+
+        self.time_step = np.array([time_step])
+
+        if self.fast_mode:
+            for key, buffer in self._state_buffers.items():
+                buffer[0] = values[key]
+            self.state["time_step"] = time_step
+            self._load = float(self.load.episode_values[self.load.time_step - 1])
+            self._pv_gen = float(self.solar.episode_values[self.solar.time_step - 1])
+            if self.flat_obs:
+                self.flatten_obs(self.state, out=self._observation)
+            elif "time_step" in self._observation:
+                self._observation["time_step"] = time_step
+            return self._observation
+
+        self.state = {
+            key: np.array([values[key]], dtype=np.float32) for key in STATE_KEYS
+        }
+        self.state["time_step"] = time_step
+
+        return self._get_obs_from_state(self.state)
+
+    def set_day_sampling(
+        self, mask: np.ndarray = None, weights: np.ndarray = None
+    ) -> None:
+        """Set which days are sampled when resetting the environment.
+
+        Days can be selected with the precomputed statistics of the load and PV
+        traces, e.g. `mask=env.solar.day_index.sums > 10` to only sample days with
+        high PV generation, and weighted for curriculum or stratified sampling.
+
+        Args:
+            mask (np.ndarray, optional): boolean array of days that can be sampled.
+                Defaults to None, which allows all days.
+            weights (np.ndarray, optional): non-negative sampling weights of days.
+                Defaults to None, which samples days uniformly.
+        """
+        num_days = get_num_start_days(
+            self.data_len, self.steps_per_day, self.episode_len
+        )
+        self.day_sampler = DaySampler(
+            num_days, mask=mask, weights=weights, rng=self.rng
+        )
+
     def render(self, mode: str = "human") -> None:
         """Renders the environment.
 
@@ -326,14 +835,25 @@ class BatteryControlEnv(gym.Env):
         """
         pass
 
-    def seed(self, seed: int = None) -> None:
+    def seed(self, seed: Union[int, np.random.SeedSequence] = None) -> List[int]:
         """Sets the seed for this env's random number generator(s).
 
+        The env and each of its components have their own generator, seeded with
+        independent seed sequences spawned from `seed`. Seeding an env hence does not
+        affect other envs in the same process. Envs of a pool can be given
+        independent streams by seeding each with a sequence spawned from a common
+        `np.random.SeedSequence`.
+
         Note:
             Some environments use multiple pseudorandom number generators.
             We want to capture all such seeds used in order to ensure that
             there aren't accidental correlations between multiple generators.
 
+        Args:
+            seed (Union[int, np.random.SeedSequence], optional): seed, or seed
+                sequence spawned e.g. by a pool of envs. Defaults to None, which seeds
+                from fresh entropy.
+
         Returns:
             list<bigint>: Returns the list of seeds used in this env's random
               number generators. The first value in the list should be the
@@ -341,12 +861,18 @@ class BatteryControlEnv(gym.Env):
               'seed'. Often, the main seed equals the provided 'seed', but
               this won't be true if seed=None, for example.
         """
-        if seed is None:
-            seed = np.random.randint(10000000)
+        if isinstance(seed, np.random.SeedSequence):
+            seed_seq = seed
+        else:
+            seed_seq = np.random.SeedSequence(seed)
 
-        np.random.seed(seed)
+        env_seq, *component_seqs = seed_seq.spawn(1 + len(self.components))
+        self.rng = np.random.default_rng(env_seq)
+        self.day_sampler.rng = self.rng
+        for component, component_seq in zip(self.components, component_seqs):
+            component.seed(component_seq)
 
-        return [seed]
+        return [seed_seq.entropy]
 
     def _setup_logging(self, logging_level: str, log_handler: str = None) -> None:
         """Setup logger and handler."""
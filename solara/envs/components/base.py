@@ -1,7 +1,10 @@
 """Module with base class for environment components."""
 
+from typing import Union
 import logging
 
+import numpy as np
+
 
 class EnvComponent:
     """Base class for environment component."""
@@ -14,6 +17,33 @@ class EnvComponent:
         self.logger = logging.getLogger(type(self).__name__)
         self.logger.info("Environment component initialised.")
 
+        self.rng = np.random.default_rng()
+
+    def seed(self, seed: Union[int, np.random.SeedSequence] = None) -> None:
+        """Set the component's own random number generator.
+
+        Args:
+            seed (Union[int, np.random.SeedSequence], optional): seed of generator,
+                e.g. spawned from the seed sequence of the environment. Defaults to
+                None, which seeds from fresh entropy.
+        """
+        self.rng = np.random.default_rng(seed)
+
+    def get_state(self) -> np.ndarray:
+        """Get compact representation of the component's dynamic state.
+
+        Returns:
+            np.ndarray: state vector of fixed size, empty for stateless components.
+        """
+        return np.zeros(0)
+
+    def set_state(self, state: np.ndarray) -> None:
+        """Restore dynamic state from `get_state()`.
+
+        Args:
+            state (np.ndarray): state vector.
+        """
+
     def set_log_level(self, level: str) -> None:
         """Set level of logger.
 
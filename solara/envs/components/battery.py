@@ -1,6 +1,10 @@
 """Module with different types of batteries."""
 
+from __future__ import annotations
+
 from typing import List, Tuple
+import copy
+import logging
 
 import numpy as np
 import cvxpy as cp
@@ -12,9 +16,51 @@ class BatteryModel(EnvComponent):
     """Base battery model."""
 
 
+def _solve_linear_limit(
+    power: np.ndarray, coef: np.ndarray, slack: np.ndarray
+) -> np.ndarray:
+    """Get largest power p in [0, power] satisfying p * coef <= slack.
+
+    Args:
+        power (np.ndarray): (non-negative) power applied
+        coef (np.ndarray): coefficient of power in constraint
+        slack (np.ndarray): right hand side of constraint
+
+    Returns:
+        np.ndarray: largest feasible power, 0 if no power is feasible.
+    """
+    if np.ndim(power) == 0 and np.ndim(slack) == 0:
+        if power * coef <= slack:
+            return power
+        return max(slack / coef, 0) if coef > 0 else 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        limit = np.where(coef > 0, np.maximum(slack / coef, 0), 0)
+    return np.where(power * coef <= slack, power, limit)
+
+
 class LithiumIonBattery(BatteryModel):
     """Class modelling lithium-ion battery."""
 
+    _stacked_attrs = [
+        "size",
+        "chemistry",
+        "time_step_len",
+        "num_cells",
+        "kWh_per_cell",
+        "nominal_voltage_c",
+        "nominal_voltage_d",
+        "u1",
+        "v1_bar",
+        "u2",
+        "v2_bar",
+        "eta_d",
+        "eta_c",
+        "alpha_bar_d",
+        "alpha_bar_c",
+        "b",
+    ]
+
     def __init__(self, size: float, chemistry: str, time_step_len: float):
         """Class modelling lithium-ion battery.
 
@@ -104,47 +150,81 @@ class LithiumIonBattery(BatteryModel):
         else:
             print("chemistry is not supported")
 
-    def calc_max_charging(self, power: float) -> float:
+    @classmethod
+    def stack(cls, batteries: List[LithiumIonBattery]) -> LithiumIonBattery:
+        """Stack several batteries into a single battery with array parameters.
+
+        The returned battery has one entry per original battery in each of its
+        parameters and in its energy content, such that all methods operate on all
+        batteries at once.
+
+        Args:
+            batteries (List[LithiumIonBattery]): batteries to stack.
+
+        Returns:
+            LithiumIonBattery: battery with array parameters.
+        """
+        stacked = copy.copy(batteries[0])
+        for attr in cls._stacked_attrs:
+            setattr(
+                stacked,
+                attr,
+                np.array([getattr(battery, attr) for battery in batteries]),
+            )
+        return stacked
+
+    def calc_max_charging(
+        self, power: np.ndarray, energy_content: np.ndarray = None
+    ) -> np.ndarray:
         """Calculate the maximum amount of charging possible.
 
-        Decrease the applied (charging) power by increments of (1/30) until the power is
-        low enough to avoid violating the upper energy limit constraint.
-        Could speed these functions up with a binary search instead of linear search,
-        or a lookup table.
+        The upper energy limit constraint (4) is linear in the charging power c,
+        b + c * eta_c * T_u <= u2 * c / V_c + v2_bar, such that the largest feasible
+        charging power below the applied power can be computed exactly in closed form.
+        Both `power` and `energy_content` can also be arrays (e.g. one entry per
+        household).
 
         Args:
-            power (float): applied charging power (in kW)
+            power (np.ndarray): applied charging power (in kW)
+            energy_content (np.ndarray, optional): battery energy content to charge
+                from (in kWh). Defaults to None, which uses the current content.
 
         Returns:
-            float: max amount of power that can be charged.
+            np.ndarray: max amount of power that can be charged.
         """
-        # Implements constraint (4)
-        for c in np.linspace(power, 0, num=30):
-            upper_lim = self.u2 * (c / self.nominal_voltage_c) + self.v2_bar
-            b_temp = self.b + c * self.eta_c * self.time_step_len
-            if b_temp <= upper_lim:
-                return c
-        return 0
-
-    def calc_max_discharging(self, power: float) -> float:
+        if energy_content is None:
+            energy_content = self.b
+
+        # Implements constraint (4), rearranged to c * coef <= slack
+        coef = self.eta_c * self.time_step_len - self.u2 / self.nominal_voltage_c
+        slack = self.v2_bar - energy_content
+        return _solve_linear_limit(power, coef, slack)
+
+    def calc_max_discharging(
+        self, power: np.ndarray, energy_content: np.ndarray = None
+    ) -> np.ndarray:
         """Calculate the maximum amount of discharging possible.
 
-        Decrease the applied (discharging) power by increments of (1/30) until the power
-        is low enough to avoid violating the lower energy limit constraint.
+        The lower energy limit constraint (4) is linear in the discharging power d,
+        b - d * eta_d * T_u >= u1 * d / V_d + v1_bar, such that the largest feasible
+        discharging power below the applied power can be computed exactly in closed
+        form.
 
         Args:
-            power (float): power to be discharged (kW)
+            power (np.ndarray): power to be discharged (kW)
+            energy_content (np.ndarray, optional): battery energy content to discharge
+                from (in kWh). Defaults to None, which uses the current content.
 
         Returns:
-            float: max power that can be discharged.
+            np.ndarray: max power that can be discharged.
         """
-        # Implements constraint (4)
-        for d in np.linspace(power, 0, num=30):
-            lower_lim = self.u1 * (d / self.nominal_voltage_d) + self.v1_bar
-            b_temp = self.b - d * self.eta_d * self.time_step_len
-            if b_temp >= lower_lim:
-                return d
-        return 0
+        if energy_content is None:
+            energy_content = self.b
+
+        # Implements constraint (4), rearranged to d * coef <= slack
+        coef = self.eta_d * self.time_step_len + self.u1 / self.nominal_voltage_d
+        slack = energy_content - self.v1_bar
+        return _solve_linear_limit(power, coef, slack)
 
     def get_charging_limits(self) -> Tuple[float, float]:
         """Get general maximum and minimum charging constraints."""
@@ -153,31 +233,58 @@ class LithiumIonBattery(BatteryModel):
 
         return min_charge_power, max_charge_power
 
-    def charge(self, power: float) -> float:
-        """Update the battery's energy content.
+    def simulate_charge(
+        self, power: np.ndarray, energy_content: np.ndarray = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Simulate charging without changing the battery's energy content.
 
-        This method updates the battery's energy content (b) according to
-        charging/discharging power (p).
+        Both arguments can be arrays, in which case each entry is simulated
+        independently (e.g. one entry per household or per candidate action).
 
         Args:
-            power (float): power to charge or discharge (kW)
+            power (np.ndarray): power to charge or discharge (kW)
+            energy_content (np.ndarray, optional): battery energy content to charge
+                from (in kWh). Defaults to None, which uses the current content.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: actual power applied (kW) and resulting
+                energy content (kWh)
         """
-        new_c = 0
-        new_d = 0
+        if energy_content is None:
+            energy_content = self.b
 
         # clip power so that it satisfies charging rate constraints
-        if power > 0:
-            new_c = min(power, self.alpha_bar_c)  # Implements constraint (3)
-            new_c = self.calc_max_charging(new_c)
-            new_d = 0
-        elif power < 0:
-            new_d = min(-power, self.alpha_bar_d)  # Implements constraint (3)
-            new_d = self.calc_max_discharging(new_d)
+        if np.ndim(power) == 0 and np.ndim(energy_content) == 0:
+            # Scalar case, avoiding overhead of array operations
             new_c = 0
+            new_d = 0
+            if power > 0:
+                new_c = min(power, self.alpha_bar_c)  # Implements constraint (3)
+                new_c = self.calc_max_charging(new_c, energy_content)
+            elif power < 0:
+                new_d = min(-power, self.alpha_bar_d)  # Implements constraint (3)
+                new_d = self.calc_max_discharging(new_d, energy_content)
+        else:
+            new_c = np.where(
+                power > 0,
+                self.calc_max_charging(
+                    np.minimum(np.maximum(power, 0), self.alpha_bar_c),
+                    energy_content,
+                ),
+                0,
+            )
+            new_d = np.where(
+                power < 0,
+                self.calc_max_discharging(
+                    np.minimum(np.maximum(-power, 0), self.alpha_bar_d),
+                    energy_content,
+                ),
+                0,
+            )
 
         # Implements contraint (1) and (2)
-        self.b = (
-            self.b
+        new_energy_content = (
+            energy_content
             + new_c * self.eta_c * self.time_step_len
             - new_d * self.eta_d * self.time_step_len
         )
@@ -185,12 +292,26 @@ class LithiumIonBattery(BatteryModel):
         # actual amount of power applied
         actual_power = new_c - new_d
 
-        self.logger.debug(
-            "Charged %6.4fkW (attempted %6.4f), new content %2.2fkWh",
-            actual_power,
-            power,
-            self.b,
-        )
+        return actual_power, new_energy_content
+
+    def charge(self, power: float) -> float:
+        """Update the battery's energy content.
+
+        This method updates the battery's energy content (b) according to
+        charging/discharging power (p).
+
+        Args:
+            power (float): power to charge or discharge (kW)
+        """
+        actual_power, self.b = self.simulate_charge(power)
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                "Charged %6.4fkW (attempted %6.4f), new content %2.2fkWh",
+                actual_power,
+                power,
+                self.b,
+            )
 
         return actual_power
 
@@ -202,6 +323,22 @@ class LithiumIonBattery(BatteryModel):
         """Reset battery energy content."""
         self.b = self.v1_bar
 
+    def get_state(self) -> np.ndarray:
+        """Get energy content (one entry per battery if stacked).
+
+        Returns:
+            np.ndarray: state vector.
+        """
+        return np.ravel(self.b).astype(float)
+
+    def set_state(self, state: np.ndarray) -> None:
+        """Restore energy content from `get_state()`.
+
+        Args:
+            state (np.ndarray): state vector.
+        """
+        self.b = state[0] if len(state) == 1 else np.array(state, dtype=float)
+
     def get_contraints(
         self, power_episode: cp.Variable, battery_content_episode: cp.Variable
     ) -> List:
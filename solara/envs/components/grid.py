@@ -1,5 +1,12 @@
 """This module contains electrical grid models."""
 
+from __future__ import annotations
+
+from typing import List
+import copy
+
+import numpy as np
+
 from solara.envs.components.base import EnvComponent
 
 
@@ -69,29 +76,57 @@ class PeakGrid(GridModel):
         self.base_price = base_price
         self.time_step_len = time_step_len
 
-    def draw_power(self, power: float) -> float:
+    def draw_power(self, power: np.ndarray) -> np.ndarray:
         """Transfer power to the grid.
 
         Returns the price paid to or from home owner for either receiving
-        or giving power to the grid at time t.
+        or giving power to the grid at time t. The power can also be an array, in
+        which case the price is computed for each entry.
 
         Args:
-            power (float): power to transfer (kW)
-            time (float): time of transfer
+            power (np.ndarray): power to transfer (kW)
 
         Returns:
-            float: price paid (can be positive or negative)
+            np.ndarray: price paid (can be positive or negative)
         """
-        if power < 0:
+        if np.any(power < 0):
             raise ValueError("Peak grid model can't accept incoming power (power<0).")
 
-        if power > self.peak_threshold:
-            return (
+        if isinstance(power, float) and isinstance(self.peak_threshold, float):
+            # Fast path avoiding array operations for scalar power and parameters
+            if power > self.peak_threshold:
+                price = (
+                    self.peak_threshold * self.base_price
+                    + (power - self.peak_threshold) * self.peak_price
+                )
+            else:
+                price = power * self.base_price
+            return price * self.time_step_len
+
+        return (
+            np.where(
+                power > self.peak_threshold,
                 self.peak_threshold * self.base_price
-                + (power - self.peak_threshold) * self.peak_price
-            ) * self.time_step_len
-        else:
-            return power * self.base_price * self.time_step_len
+                + (power - self.peak_threshold) * self.peak_price,
+                power * self.base_price,
+            )
+            * self.time_step_len
+        )
 
     def get_info(self):
         return {"price_threshold": self.peak_threshold}
+
+    @classmethod
+    def stack(cls, grids: List[PeakGrid]) -> PeakGrid:
+        """Stack several grids into a single grid with array parameters.
+
+        Args:
+            grids (List[PeakGrid]): grids to stack.
+
+        Returns:
+            PeakGrid: grid with one entry per original grid in each parameter.
+        """
+        stacked = copy.copy(grids[0])
+        for attr in ["peak_threshold", "peak_price", "base_price", "time_step_len"]:
+            setattr(stacked, attr, np.array([getattr(grid, attr) for grid in grids]))
+        return stacked
@@ -1,8 +1,16 @@
 """This module contains photovoltaic system models."""
 
+from typing import Union
+
 import numpy as np
 
+from solara.data_loading.day_index import (
+    DaySampler,
+    get_num_start_days,
+    get_steps_per_day,
+)
 from solara.envs.components.base import EnvComponent
+from solara.envs.components.trace_cache import TRACE_CACHE
 
 
 class PVModel(EnvComponent):
@@ -37,23 +45,63 @@ class DataPV(PVModel):
         time_step_len: float = 1,
         num_steps: int = 24,
         fixed_sample_num: int = None,
+        dtype: str = "float64",
+        use_cache: bool = True,
     ) -> None:
         """Photovoltaic model that samples from data.
 
         Args:
             data_path (str): path to PV data in a txt file with solar trace in kW
-            time_step_len (float): length of time steps in hours. Defaults to 1.
-            num_steps (int): number of time steps. Defaults to 24.
+            time_step_len (float): length of time steps in hours, i.e. of the
+                intervals of the values in the trace (e.g. 0.5 for half-hourly data).
+                Must divide a day. Defaults to 1.
+            num_steps (int): number of time steps of an episode, which can span
+                several days. Episodes are views of the trace. Defaults to 24.
+            dtype (str): data type to load data as. Defaults to "float64". The data is
+                shared with other components in the process using the same file and
+                data type, see `solara.envs.components.trace_cache`.
+            use_cache (bool): whether to load data from a memory-mapped binary cache
+                file, which is created next to the txt file if necessary. Defaults to
+                True.
         """
         super().__init__()
 
-        self.data = np.loadtxt(data_path, delimiter=",")
+        self.data = TRACE_CACHE.get(data_path, dtype=dtype, use_cache=use_cache)
         self.num_steps = num_steps
         self.time_step_len = time_step_len
+        self.steps_per_day = get_steps_per_day(time_step_len)
+
+        metadata = TRACE_CACHE.get_metadata(data_path)
+        if metadata.get("steps_per_day", self.steps_per_day) != self.steps_per_day:
+            raise ValueError(
+                "Trace has {} steps per day, but time step length is {}h.".format(
+                    metadata["steps_per_day"], time_step_len
+                )
+            )
+        self.day_index = TRACE_CACHE.get_day_index(
+            data_path,
+            steps_per_day=self.steps_per_day,
+            dtype=dtype,
+            use_cache=use_cache,
+        )
+        self.day_sampler = DaySampler(
+            get_num_start_days(len(self.data), self.steps_per_day, num_steps),
+            rng=self.rng,
+        )
         self.fix_start(fixed_sample_num)
 
         self.reset()
 
+    def seed(self, seed: Union[int, np.random.SeedSequence] = None) -> None:
+        """Set the random number generator used to sample days.
+
+        Args:
+            seed (Union[int, np.random.SeedSequence], optional): seed of generator.
+                Defaults to None, which seeds from fresh entropy.
+        """
+        super().seed(seed)
+        self.day_sampler.rng = self.rng
+
     def reset(self, start: int = None) -> None:
         """Reset the load model to new randomly sampled data."""
 
@@ -63,7 +111,7 @@ class DataPV(PVModel):
         if self.fixed_start is not None:
             start = self.fixed_start
         elif start is None:
-            start = np.random.randint((len(self.data) // 24) - 1) * 24
+            start = self.day_sampler.sample() * self.steps_per_day
 
         self.start = start
 
@@ -73,6 +121,27 @@ class DataPV(PVModel):
     def step(self) -> None:
         self.time_step += 1
 
+    def get_state(self) -> np.ndarray:
+        """Get start of episode in data and current time step.
+
+        Returns:
+            np.ndarray: state vector.
+        """
+        return np.array([self.start, self.time_step], dtype=float)
+
+    def set_state(self, state: np.ndarray) -> None:
+        """Restore episode and time step from `get_state()`, without copying data.
+
+        Args:
+            state (np.ndarray): state vector.
+        """
+        start = int(state[0])
+        end = start + self.num_steps + 1
+
+        self.start = start
+        self.time_step = int(state[1])
+        self.episode_values = self.data[start:end]
+
     def get_next_generation(self) -> float:
         """Get power generation for next time step.
 
@@ -98,7 +167,9 @@ class DataPV(PVModel):
     def fix_start(self, start: int = 0) -> None:
         if start is None:
             self.fixed_start = None
-        elif start > len(self.data) // 24:
-            raise ValueError("Higher start index than days in data.")
+        elif start >= get_num_start_days(
+            len(self.data), self.steps_per_day, self.num_steps
+        ):
+            raise ValueError("Too late start day for an episode in data.")
         else:
-            self.fixed_start = start * 24
+            self.fixed_start = start * self.steps_per_day
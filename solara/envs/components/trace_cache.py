@@ -0,0 +1,196 @@
+"""Module with a process-wide cache of load and PV traces."""
+
+from __future__ import annotations
+
+from typing import Dict
+import collections
+import logging
+import os
+import threading
+
+import numpy as np
+
+from solara.data_loading.day_index import DayIndex
+from solara.data_loading.trace_store import TraceStore, get_trace_metadata, load_trace
+
+
+class TraceCache:
+    """Least-recently-used cache of traces shared by all components in a process."""
+
+    def __init__(self, max_bytes: int = 2**30) -> None:
+        """Least-recently-used cache of traces shared by all components in a process.
+
+        Traces are keyed by their path, data type and file modification time, such
+        that a changed file is loaded again. Components only receive read-only views
+        of the cached traces, so that environments created in the same process (e.g.
+        with RLlib's `num_envs_per_worker > 1`) share a single copy of each trace.
+        The day index of each cached trace and the store metadata of traces are
+        cached as well, such that creating further components is cheap.
+
+        Args:
+            max_bytes (int, optional): maximum size of all cached traces in bytes.
+                Least recently used traces are evicted once this size is exceeded.
+                Defaults to 2**30 (1 GiB).
+        """
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self._traces = collections.OrderedDict()
+        self._day_indices = {}
+        self._metadata = {}
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(type(self).__name__)
+
+    def get(
+        self, data_path: str, dtype: str = "float64", use_cache: bool = True
+    ) -> np.ndarray:
+        """Get read-only view of trace, loading it if not already cached.
+
+        Args:
+            data_path (str): path to trace.
+            dtype (str, optional): data type of trace. Defaults to "float64".
+            use_cache (bool, optional): whether to load the trace via its binary
+                cache file, see `solara.data_loading.trace_store.load_trace`.
+                Defaults to True.
+
+        Returns:
+            np.ndarray: read-only view of trace.
+        """
+        path = os.path.realpath(data_path)
+        key = (path, np.dtype(dtype).name, use_cache, os.path.getmtime(path))
+
+        with self._lock:
+            if key in self._traces:
+                self._traces.move_to_end(key)
+                trace = self._traces[key]
+            else:
+                # Remove outdated versions of trace loaded with the same settings
+                self._evict(
+                    lambda cached_key: cached_key[:3] == key[:3]
+                    and cached_key[3] != key[3]
+                )
+
+                trace = load_trace(path, dtype=dtype, use_cache=use_cache)
+                trace.flags.writeable = False
+
+                if trace.nbytes <= self.max_bytes:
+                    self._traces[key] = trace
+                    self.num_bytes += trace.nbytes
+                    self._evict_least_recently_used()
+
+                self.logger.debug("Loaded trace %s into cache.", path)
+
+        view = trace.view()
+        view.flags.writeable = False
+        return view
+
+    def get_day_index(
+        self,
+        data_path: str,
+        steps_per_day: int = 24,
+        dtype: str = "float64",
+        use_cache: bool = True,
+    ) -> DayIndex:
+        """Get day index of trace, creating it if not already cached.
+
+        The day index is cached as long as the trace itself, and is shared by all
+        components of the trace. Hence, its arrays are read-only.
+
+        Args:
+            data_path (str): path to trace.
+            steps_per_day (int, optional): number of values per day. Defaults to 24.
+            dtype (str, optional): data type of trace. Defaults to "float64".
+            use_cache (bool, optional): whether to load the trace via its binary
+                cache file, see `get()`. Defaults to True.
+
+        Returns:
+            DayIndex: index of the days of the trace.
+        """
+        trace = self.get(data_path, dtype=dtype, use_cache=use_cache)
+        path = os.path.realpath(data_path)
+        key = (path, np.dtype(dtype).name, use_cache, os.path.getmtime(path))
+
+        with self._lock:
+            day_index = self._day_indices.get(key + (steps_per_day,))
+        if day_index is not None:
+            return day_index
+
+        day_index = DayIndex(
+            trace,
+            steps_per_day=steps_per_day,
+            start_date=self.get_metadata(data_path).get("start_date"),
+        )
+        for value in vars(day_index).values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+        with self._lock:
+            if key in self._traces:
+                self._day_indices[key + (steps_per_day,)] = day_index
+        return day_index
+
+    def get_metadata(self, data_path: str) -> Dict:
+        """Get store metadata of trace, reading it if the store index changed.
+
+        Args:
+            data_path (str): path to trace.
+
+        Returns:
+            Dict: metadata of trace, see
+                `solara.data_loading.trace_store.get_trace_metadata`.
+        """
+        path = os.path.realpath(data_path)
+        index_path = os.path.join(os.path.dirname(path), TraceStore.index_file_name)
+        if os.path.exists(index_path):
+            index_mtime = os.path.getmtime(index_path)
+        else:
+            index_mtime = None
+
+        with self._lock:
+            cached = self._metadata.get(path)
+        if cached is not None and cached[0] == index_mtime:
+            return dict(cached[1])
+
+        metadata = get_trace_metadata(path)
+        with self._lock:
+            self._metadata[path] = (index_mtime, metadata)
+        return dict(metadata)
+
+    def evict(self, data_path: str = None) -> None:
+        """Evict trace(s) from cache.
+
+        Args:
+            data_path (str, optional): path of trace to evict. Defaults to None, which
+                evicts all traces.
+        """
+        with self._lock:
+            if data_path is None:
+                self._evict(lambda cached_key: True)
+                self._metadata.clear()
+            else:
+                path = os.path.realpath(data_path)
+                self._evict(lambda cached_key: cached_key[0] == path)
+                self._metadata.pop(path, None)
+
+    def _evict(self, condition: callable) -> None:
+        """Evict all traces (and their day indices) whose key satisfies condition."""
+        for key in [key for key in self._traces if condition(key)]:
+            self._pop(key)
+
+    def _evict_least_recently_used(self) -> None:
+        """Evict least recently used traces until cache fits into max size."""
+        while self.num_bytes > self.max_bytes:
+            self._pop(next(iter(self._traces)))
+
+    def _pop(self, key: tuple) -> None:
+        """Remove trace and its day indices from cache."""
+        self.num_bytes -= self._traces.pop(key).nbytes
+        for index_key in [
+            index_key for index_key in self._day_indices if index_key[:4] == key
+        ]:
+            del self._day_indices[index_key]
+
+    def __len__(self) -> int:
+        """Number of cached traces."""
+        return len(self._traces)
+
+
+TRACE_CACHE = TraceCache()
@@ -0,0 +1,154 @@
+"""Module with prefix-cached evaluation of changes to an episode's actions."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict
+import logging
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from solara.envs.battery_control import BatteryControlEnv
+
+
+class CounterfactualEvaluator:
+    """Evaluator of action changes relative to a base trajectory."""
+
+    def __init__(self, env: BatteryControlEnv, actions: np.ndarray) -> None:
+        """Evaluator of action changes relative to a base trajectory.
+
+        The base trajectory is simulated once from the environment's current state,
+        and the environment state after each step is cached (see
+        `BatteryControlEnv.get_state()`). Evaluating changed actions then only
+        re-simulates the episode from the first changed step onward, with
+        `BatteryControlEnv.rollout()`, and reuses the base trajectory before it. The
+        environment is left in the state it was given in.
+
+        Args:
+            env (BatteryControlEnv): environment, e.g. after reset.
+            actions (np.ndarray): actions of base trajectory for each remaining step
+                of the episode.
+        """
+        self.env = env
+        self.initial_state = env.get_state()
+        self.num_steps = env.episode_len - env.time_step.item()
+        self.logger = logging.getLogger(type(self).__name__)
+
+        self.set_base(actions)
+
+    def set_base(self, actions: np.ndarray, start_step: int = 0) -> None:
+        """Set base trajectory and cache environment states of its steps.
+
+        Args:
+            actions (np.ndarray): actions of new base trajectory.
+            start_step (int, optional): first step in which the actions differ from
+                the current base trajectory, whose cached states are kept up to this
+                step. Defaults to 0.
+        """
+        actions = np.array(actions, dtype=np.float64).reshape(self.num_steps)
+
+        if start_step == 0:
+            self.states = [self.initial_state]
+        else:
+            self.states = self.states[: start_step + 1]
+
+        self.env.set_state(self.states[start_step])
+        self.episode = self._splice(start_step, self.env.rollout(actions[start_step:]))
+        for action in actions[start_step:-1]:
+            self.env.step(np.array([action], dtype=np.float32))
+            self.states.append(self.env.get_state())
+        self.actions = actions
+
+        self.env.set_state(self.initial_state)
+
+    def _splice(
+        self, step: int, suffix: Dict[str, np.ndarray]
+    ) -> Dict[str, np.ndarray]:
+        """Join base trajectory before step with re-simulated trajectory from step.
+
+        Args:
+            step (int): first re-simulated step.
+            suffix (Dict[str, np.ndarray]): rollout from the state before the step,
+                either of a single or several action sequences.
+
+        Returns:
+            Dict[str, np.ndarray]: episode data.
+        """
+        if step == 0:
+            return suffix
+
+        episode = {}
+        for key, value in suffix.items():
+            prefix = self.episode[key][:step]
+            if value.ndim > 1:
+                prefix = np.broadcast_to(prefix, (len(value), step))
+            episode[key] = np.concatenate([prefix, value], axis=-1)
+        return episode
+
+    def evaluate(
+        self, actions: np.ndarray, update_base: bool = False
+    ) -> Dict[str, np.ndarray]:
+        """Get episode data for changed actions.
+
+        Args:
+            actions (np.ndarray): actions of each step.
+            update_base (bool, optional): whether to make the changed actions the new
+                base trajectory, e.g. for successive changes of the manual sliders
+                in `solara.plot.widgets.InteractiveEpisodes`. Defaults to False.
+
+        Returns:
+            Dict[str, np.ndarray]: episode data in the format of
+                `solara.utils.episodes.get_episode_dict`.
+        """
+        actions = np.asarray(actions, dtype=np.float64).reshape(self.num_steps)
+        changed = np.flatnonzero(actions != self.actions)
+        if len(changed) == 0:
+            return {key: value.copy() for key, value in self.episode.items()}
+
+        step = int(changed[0])
+        if update_base:
+            self.set_base(actions, start_step=step)
+            return {key: value.copy() for key, value in self.episode.items()}
+
+        self.env.set_state(self.states[step])
+        episode = self._splice(step, self.env.rollout(actions[step:]))
+        self.env.set_state(self.initial_state)
+
+        self.logger.debug("Evaluated actions changed from step %s.", step)
+
+        return episode
+
+    def evaluate_perturbations(
+        self, steps: np.ndarray, actions: np.ndarray
+    ) -> Dict[str, np.ndarray]:
+        """Get episode data for many single-step changes of the base actions.
+
+        Perturbations of the same step are simulated together in a single rollout.
+
+        Args:
+            steps (np.ndarray): step of each perturbation.
+            actions (np.ndarray): new action of each perturbation at its step.
+
+        Returns:
+            Dict[str, np.ndarray]: episode data of each perturbation, with an
+                additional leading axis over perturbations.
+        """
+        steps = np.asarray(steps, dtype=int)
+        actions = np.asarray(actions, dtype=np.float64)
+
+        episodes = {}
+        for step in np.unique(steps):
+            idxs = np.flatnonzero(steps == step)
+            sequences = np.tile(self.actions[step:], (len(idxs), 1))
+            sequences[:, 0] = actions[idxs]
+
+            self.env.set_state(self.states[step])
+            episode = self._splice(step, self.env.rollout(sequences))
+
+            for key, value in episode.items():
+                if key not in episodes:
+                    episodes[key] = np.empty((len(steps),) + value.shape[1:])
+                episodes[key][idxs] = value
+
+        self.env.set_state(self.initial_state)
+
+        return episodes
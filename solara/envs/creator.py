@@ -1,13 +1,15 @@
 """Module with functions to create envs from configs."""
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, List
 import copy
 import solara.envs.components.solar
 import solara.envs.components.load
 import solara.envs.components.grid
 import solara.envs.components.battery
 import solara.envs.battery_control
+import solara.envs.batched_battery_control
+import solara.envs.vector
 from solara.envs.configs import DEFAULT_ENV_CONFIG
 
 if TYPE_CHECKING:
@@ -17,6 +19,10 @@ if TYPE_CHECKING:
 def create_env(env_config: dict = None) -> gym.Env:
     """Create a battery control environment from config.
 
+    If "vector_env" is set in the general config to "gym" or "rllib", a batch of
+    "num_envs" environments with the config is created and returned as
+    `solara.envs.vector.GymVectorEnv` or `solara.envs.vector.RLlibVectorEnv`.
+
     Args:
         env_config (Dict, optional): configuration dict for environment.
             Defaults to None.
@@ -31,6 +37,19 @@ def create_env(env_config: dict = None) -> gym.Env:
     # Deep copy necessary because of use of .pop() method later
     env_config = copy.deepcopy(env_config)
 
+    # Optionally wrapping a batch of envs into a vector env
+    vector_env = env_config["general"].pop("vector_env", None)
+    num_envs = env_config["general"].pop("num_envs", 1)
+    if vector_env is not None:
+        batched_env = solara.envs.batched_battery_control.BatchedBatteryControlEnv(
+            [create_env(env_config) for _ in range(num_envs)]
+        )
+        if vector_env == "gym":
+            return solara.envs.vector.GymVectorEnv(batched_env)
+        if vector_env == "rllib":
+            return solara.envs.vector.RLlibVectorEnv(batched_env)
+        raise ValueError("Unknown vector env type '{}'.".format(vector_env))
+
     # Creating env components (battery, solar, etc.)
     components = {}
     for component in env_config["components"].keys():
@@ -51,3 +70,20 @@ def create_env(env_config: dict = None) -> gym.Env:
     env = env_class(**env_config["general"], **components)
 
     return env
+
+
+def create_batched_env(
+    env_configs: List[dict],
+) -> solara.envs.batched_battery_control.BatchedBatteryControlEnv:
+    """Create a batched battery control environment from a list of configs.
+
+    Args:
+        env_configs (List[dict]): one environment config per household in batch.
+
+    Returns:
+        BatchedBatteryControlEnv: batched environment
+    """
+
+    envs = [create_env(env_config) for env_config in env_configs]
+
+    return solara.envs.batched_battery_control.BatchedBatteryControlEnv(envs)
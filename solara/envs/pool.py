@@ -0,0 +1,386 @@
+"""Module with pool of environments stepped in parallel worker processes."""
+
+from __future__ import annotations
+
+from typing import Dict, List, Tuple, Union
+import logging
+import multiprocessing
+import multiprocessing.connection
+import multiprocessing.shared_memory
+import traceback
+
+import gym
+import numpy as np
+
+from solara.envs.creator import create_env
+
+
+class SharedArrays:
+    """Collection of numpy arrays backed by a single shared memory block."""
+
+    def __init__(self, specs: Dict[str, Tuple[Tuple, str]], name: str = None) -> None:
+        """Collection of numpy arrays backed by a single shared memory block.
+
+        Args:
+            specs (Dict[str, Tuple[Tuple, str]]): shape and dtype of each array.
+            name (str, optional): name of existing shared memory block to attach to.
+                Defaults to None, which creates a new block.
+        """
+        self.specs = specs
+
+        offsets = {}
+        size = 0
+        for key, (shape, dtype) in specs.items():
+            dtype = np.dtype(dtype)
+            size = -(-size // dtype.alignment) * dtype.alignment
+            offsets[key] = size
+            size += int(np.prod(shape)) * dtype.itemsize
+
+        if name is None:
+            self.shm = multiprocessing.shared_memory.SharedMemory(
+                create=True, size=max(size, 1)
+            )
+        else:
+            self.shm = multiprocessing.shared_memory.SharedMemory(name=name)
+
+        self.arrays = {
+            key: np.ndarray(
+                shape, dtype=dtype, buffer=self.shm.buf, offset=offsets[key]
+            )
+            for key, (shape, dtype) in specs.items()
+        }
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        """Get shared array."""
+        return self.arrays[key]
+
+    def close(self, unlink: bool = False) -> None:
+        """Close access to shared memory block.
+
+        Args:
+            unlink (bool, optional): whether to also free the block. Should only be
+                done by the process that created it. Defaults to False.
+        """
+        self.arrays = {}
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _get_obs_spec(space: gym.spaces.Space, num_envs: int) -> Tuple[Tuple, str]:
+    """Get shape and dtype of shared buffer for observation space."""
+    if isinstance(space, gym.spaces.Discrete):
+        return (num_envs,), "int64"
+    return (num_envs, *space.shape), space.dtype.name
+
+
+def _worker(
+    conn: multiprocessing.connection.Connection,
+    env_config: dict,
+    shm_name: str,
+    specs: Dict[str, Tuple[Tuple, str]],
+    index: int,
+    auto_reset: bool,
+    seed: np.random.SeedSequence,
+) -> None:
+    """Run environment in worker process, exchanging data via shared memory.
+
+    Each command (and the setup of the environment) is acknowledged with
+    `("ok", result)`, or with `("error", traceback)` if it raised an exception.
+
+    Args:
+        conn (multiprocessing.connection.Connection): connection to main process,
+            only used for commands and acknowledgements.
+        env_config (dict): config of environment.
+        shm_name (str): name of shared memory block.
+        specs (Dict[str, Tuple[Tuple, str]]): specs of shared arrays.
+        index (int): index of environment in pool.
+        auto_reset (bool): whether to reset environment at end of episode.
+        seed (np.random.SeedSequence): seed sequence of environment, distinct for
+            each worker.
+    """
+    try:
+        env = create_env(env_config)
+        env.seed(seed)
+        buffers = SharedArrays(specs, name=shm_name)
+    except Exception:  # pylint: disable=broad-except
+        conn.send(("error", traceback.format_exc()))
+        conn.close()
+        return
+    conn.send(("ok", None))
+
+    def write_obs(obs: object) -> None:
+        if not isinstance(obs, dict):
+            buffers["obs"][index] = obs
+            return
+        for key, value in obs.items():
+            buffer = buffers["obs_" + key]
+            buffer[index] = np.reshape(value, buffer.shape[1:])
+
+    try:
+        while True:
+            command, args = conn.recv()
+            if command == "close":
+                break
+            try:
+                result = None
+                if command == "step":
+                    obs, reward, done, info = env.step(buffers["actions"][index].copy())
+                    if done and auto_reset:
+                        obs = env.reset()
+                    write_obs(obs)
+                    buffers["rewards"][index] = reward
+                    buffers["dones"][index] = done
+                    for key in args:
+                        buffers["info_" + key][index] = info.get(key, np.nan)
+                elif command == "reset":
+                    write_obs(env.reset())
+                elif command == "call":
+                    method, method_args = args
+                    result = getattr(env, method)(*method_args)
+            except Exception:  # pylint: disable=broad-except
+                conn.send(("error", traceback.format_exc()))
+            else:
+                conn.send(("ok", result))
+    finally:
+        env.close()
+        buffers.close()
+        conn.close()
+
+
+class SubprocEnvPool:
+    """Pool of battery control environments stepped in worker processes."""
+
+    def __init__(
+        self,
+        env_config: dict = None,
+        num_envs: int = 2,
+        auto_reset: bool = True,
+        start_method: str = None,
+        seed: Union[int, np.random.SeedSequence] = None,
+    ) -> None:
+        """Pool of battery control environments stepped in worker processes.
+
+        Each environment is created via `solara.envs.creator.create_env` in its own
+        worker process. Actions, observations, rewards, dones and infos are exchanged
+        through preallocated shared memory buffers, such that only short commands are
+        sent between processes.
+
+        Args:
+            env_config (dict, optional): config of environments. Defaults to None,
+                which uses the default config.
+            num_envs (int, optional): number of environments. Defaults to 2.
+            auto_reset (bool, optional): whether environments are automatically reset
+                at the end of an episode. The returned observation is then the first
+                observation of the new episode. Defaults to True.
+            start_method (str, optional): multiprocessing start method, e.g. "fork" or
+                "spawn". Defaults to None, which uses the platform default.
+            seed (Union[int, np.random.SeedSequence], optional): seed from which the
+                environments get independent seed sequences, such that (also forked)
+                workers sample different days. Defaults to None, which seeds from
+                fresh entropy.
+        """
+        self.num_envs = num_envs
+        self.logger = logging.getLogger(type(self).__name__)
+
+        # Template env to get spaces and info keys
+        env = create_env(env_config)
+        self.single_action_space = env.action_space
+        self.single_observation_space = env.observation_space
+        self.dict_obs = isinstance(env.observation_space, gym.spaces.Dict)
+        if self.dict_obs:
+            self.obs_keys = list(env.observation_space.spaces.keys())
+        else:
+            self.obs_keys = []
+        _, _, _, info = env.step(np.zeros(env.action_space.shape, dtype=np.float32))
+        self.info_keys = list(info.keys())
+        env.close()
+
+        specs = {
+            "actions": ((num_envs, *env.action_space.shape), "float32"),
+            "rewards": ((num_envs,), "float64"),
+            "dones": ((num_envs,), "bool"),
+        }
+        if self.dict_obs:
+            for key, space in env.observation_space.spaces.items():
+                specs["obs_" + key] = _get_obs_spec(space, num_envs)
+        else:
+            specs["obs"] = _get_obs_spec(env.observation_space, num_envs)
+        for key in self.info_keys:
+            specs["info_" + key] = ((num_envs,), "float64")
+        self.buffers = SharedArrays(specs)
+
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_seq = seed
+
+        context = multiprocessing.get_context(start_method)
+        self.conns = []
+        self.processes = []
+        for index, env_seq in enumerate(self.seed_seq.spawn(num_envs)):
+            conn, worker_conn = context.Pipe()
+            process = context.Process(
+                target=_worker,
+                args=(
+                    worker_conn,
+                    env_config,
+                    self.buffers.shm.name,
+                    specs,
+                    index,
+                    auto_reset,
+                    env_seq,
+                ),
+                daemon=True,
+            )
+            process.start()
+            worker_conn.close()
+            self.conns.append(conn)
+            self.processes.append(process)
+
+        self.waiting = False
+        self.closed = False
+
+        # Waiting for environments to be created in workers
+        try:
+            self._receive()
+        except Exception:
+            self.close()
+            raise
+
+    def reset(self) -> Dict[str, np.ndarray]:
+        """Reset all environments.
+
+        Returns:
+            Dict[str, np.ndarray]: observations, with environments along first axis.
+                For flat observations, a single array of shape (num_envs, obs_size).
+        """
+        for conn in self.conns:
+            conn.send(("reset", None))
+        self._receive()
+        return self._get_obs()
+
+    def step_async(self, actions: np.ndarray) -> None:
+        """Start stepping all environments with given actions.
+
+        Args:
+            actions (np.ndarray): one action per environment.
+        """
+        self.buffers["actions"][:] = np.reshape(actions, self.buffers["actions"].shape)
+        for conn in self.conns:
+            conn.send(("step", self.info_keys))
+        self.waiting = True
+
+    def step_wait(
+        self,
+    ) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+        """Wait for step of all environments to finish.
+
+        The returned arrays are views of the shared buffers, and are overwritten by
+        the next step. Copy them if they need to be kept.
+
+        Returns:
+            observations (Dict[str, np.ndarray]): observations of environments.
+            rewards (np.ndarray): rewards of environments.
+            dones (np.ndarray): whether the episode of each environment has ended.
+            infos (Dict[str, np.ndarray]): info values of environments (NaN if an
+                environment did not return the key).
+        """
+        self.waiting = False
+        self._receive()
+
+        infos = {key: self.buffers["info_" + key] for key in self.info_keys}
+        return self._get_obs(), self.buffers["rewards"], self.buffers["dones"], infos
+
+    def step(
+        self, actions: np.ndarray
+    ) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+        """Step all environments, see `step_async()` and `step_wait()`."""
+        self.step_async(actions)
+        return self.step_wait()
+
+    def seed(self, seed: Union[int, np.random.SeedSequence] = None) -> List[int]:
+        """Seed environments with independent seed sequences spawned from seed.
+
+        Args:
+            seed (Union[int, np.random.SeedSequence], optional): seed. Defaults to
+                None, which seeds from fresh entropy.
+
+        Returns:
+            List[int]: entropy of the seed sequence, to pass as seed to reproduce.
+        """
+        if isinstance(seed, np.random.SeedSequence):
+            seed_seq = seed
+        else:
+            seed_seq = np.random.SeedSequence(seed)
+
+        for conn, env_seq in zip(self.conns, seed_seq.spawn(self.num_envs)):
+            conn.send(("call", ("seed", (env_seq,))))
+        self._receive()
+
+        return [seed_seq.entropy]
+
+    def call(self, method: str, *args) -> List:
+        """Call method on all environments and return results.
+
+        Args:
+            method (str): name of method, e.g. "seed".
+            *args: arguments passed to method.
+
+        Returns:
+            List: result of each environment.
+        """
+        for conn in self.conns:
+            conn.send(("call", (method, args)))
+        return self._receive()
+
+    def _receive(self) -> List:
+        """Receive acknowledgement of the last command from all workers.
+
+        Returns:
+            List: result of each worker.
+
+        Raises:
+            RuntimeError: if the command raised an exception in any worker, with the
+                traceback of the first such worker. All acknowledgements are
+                received before, such that the pool can still be used or closed.
+        """
+        messages = [conn.recv() for conn in self.conns]
+        for index, (status, result) in enumerate(messages):
+            if status == "error":
+                raise RuntimeError(
+                    "Exception in worker of environment {}:\n{}".format(index, result)
+                )
+        return [result for _, result in messages]
+
+    def _get_obs(self) -> Dict[str, np.ndarray]:
+        """Get views of observation buffers."""
+        if not self.dict_obs:
+            return self.buffers["obs"]
+        return {key: self.buffers["obs_" + key] for key in self.obs_keys}
+
+    def close(self) -> None:
+        """Stop worker processes and free shared memory."""
+        if self.closed:
+            return
+        if self.waiting:
+            for conn in self.conns:
+                conn.recv()
+        for conn in self.conns:
+            try:
+                conn.send(("close", None))
+            except BrokenPipeError:
+                # Worker whose environment could not be created has already exited
+                pass
+        for process in self.processes:
+            process.join()
+        self.buffers.close(unlink=True)
+        self.closed = True
+        self.logger.debug("Closed pool of %s environments.", self.num_envs)
+
+    def __enter__(self) -> SubprocEnvPool:
+        """Use pool as context manager, closing it on exit."""
+        return self
+
+    def __exit__(self, *args) -> None:
+        """Close pool."""
+        self.close()
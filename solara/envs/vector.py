@@ -0,0 +1,190 @@
+"""Module with vector environment adapters of the batched battery control env."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, Tuple, Union
+import logging
+
+import gym
+import numpy as np
+
+if TYPE_CHECKING:
+    from solara.envs.batched_battery_control import BatchedBatteryControlEnv
+
+
+class GymVectorEnv(gym.vector.VectorEnv):
+    """Gym vector environment stepping all sub-envs in a single vectorized call."""
+
+    def __init__(self, batched_env: BatchedBatteryControlEnv) -> None:
+        """Gym vector environment stepping all sub-envs in a single vectorized call.
+
+        The sub-environments are the households of a `BatchedBatteryControlEnv`.
+        Like gym's `SyncVectorEnv`, sub-environments whose episode is done are reset
+        automatically within `step()`, and the observations returned for them are
+        those of the new episode. The last observations of the finished episodes are
+        given in the infos under "terminal_observation", an object array with the
+        observation of each finished sub-environment and None for the others, with
+        the mask of finished sub-environments under "_terminal_observation" (as in
+        gym's vector infos). As `BatteryControlEnv`, the environment follows the gym
+        API with `(obs, rewards, dones, infos)` steps and observation-only resets.
+
+        Args:
+            batched_env (BatchedBatteryControlEnv): batched environment to adapt.
+        """
+        super().__init__(
+            batched_env.num_envs,
+            batched_env.single_observation_space,
+            batched_env.single_action_space,
+        )
+        self.batched_env = batched_env
+        self._actions = None
+        self.logger = logging.getLogger(type(self).__name__)
+
+    def reset_wait(self, **kwargs) -> Dict[str, np.ndarray]:
+        """Reset all sub-environments.
+
+        Args:
+            **kwargs: `seed` seeds the sub-environments' random number generator,
+                other arguments are ignored.
+
+        Returns:
+            Dict[str, np.ndarray]: batch of initial observations.
+        """
+        if kwargs.get("seed") is not None:
+            self.batched_env.seed(kwargs["seed"])
+        return self.batched_env.reset()
+
+    def step_async(self, actions: np.ndarray) -> None:
+        """Send actions of all sub-environments.
+
+        Args:
+            actions (np.ndarray): one action per sub-environment.
+        """
+        self._actions = actions
+
+    def step_wait(
+        self, **kwargs
+    ) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+        """Step all sub-environments with the sent actions.
+
+        Returns:
+            observations (Dict[str, np.ndarray]): batch of observations.
+            rewards (np.ndarray): reward of each sub-environment.
+            dones (np.ndarray): whether the episode of each sub-environment ended.
+            infos (Dict[str, np.ndarray]): auxiliary information, with one entry per
+                sub-environment for each key.
+        """
+        obs, rewards, dones, infos = self.batched_env.step(self._actions)
+        self._actions = None
+
+        done_idxs = np.flatnonzero(dones)
+        if len(done_idxs) > 0:
+            terminal_obs = np.full(self.num_envs, None, dtype=object)
+            for idx in done_idxs:
+                if isinstance(obs, dict):
+                    terminal_obs[idx] = {key: value[idx] for key, value in obs.items()}
+                else:
+                    terminal_obs[idx] = obs[idx]
+            infos["terminal_observation"] = terminal_obs
+            infos["_terminal_observation"] = np.array(dones, dtype=bool)
+            obs = self.batched_env.reset(env_idxs=done_idxs)
+
+        return obs, rewards, dones, infos
+
+    def close_extras(self, **kwargs) -> None:
+        """Close sub-environments (nothing to clean up)."""
+
+
+def _create_rllib_vector_env_class() -> type:
+    """Create the `RLlibVectorEnv` class, importing Ray only when it is needed."""
+    import ray.rllib.env  # pylint: disable=import-outside-toplevel
+
+    class RLlibVectorEnv(ray.rllib.env.VectorEnv):
+        """Vector env for RLlib stepping all sub-envs in a single vectorized call."""
+
+        def __init__(self, batched_env: BatchedBatteryControlEnv) -> None:
+            """Vector env for RLlib stepping all sub-envs in a single vectorized call.
+
+            The sub-environments are the households of a `BatchedBatteryControlEnv`.
+            RLlib resets sub-environments whose episode is done with `reset_at()`. Use
+            with `num_envs_per_worker=1`, setting the number of sub-environments with
+            "num_envs" in the env config instead (see `solara.envs.creator.create_env`).
+
+            Args:
+                batched_env (BatchedBatteryControlEnv): batched environment to adapt.
+            """
+            super().__init__(
+                batched_env.single_observation_space,
+                batched_env.single_action_space,
+                batched_env.num_envs,
+            )
+            self.batched_env = batched_env
+
+        def _split_obs(self, obs: Union[Dict[str, np.ndarray], np.ndarray]) -> List:
+            """Split batch of observations into list of observations per sub-env."""
+            if isinstance(obs, dict):
+                return [
+                    {key: value[i] for key, value in obs.items()}
+                    for i in range(self.num_envs)
+                ]
+            return list(obs)
+
+        def vector_reset(self) -> List:
+            """Reset all sub-environments.
+
+            Returns:
+                List: initial observation of each sub-environment.
+            """
+            return self._split_obs(self.batched_env.reset())
+
+        def reset_at(self, index: int = None) -> object:
+            """Reset a single sub-environment.
+
+            Args:
+                index (int, optional): index of sub-environment. Defaults to None, which
+                    resets the first sub-environment.
+
+            Returns:
+                object: initial observation of the sub-environment.
+            """
+            index = 0 if index is None else index
+            obs = self.batched_env.reset(env_idxs=[index])
+            if isinstance(obs, dict):
+                return {key: value[index] for key, value in obs.items()}
+            return obs[index]
+
+        def vector_step(self, actions: List) -> Tuple[List, List, List, List]:
+            """Step all sub-environments.
+
+            Args:
+                actions (List): action of each sub-environment.
+
+            Returns:
+                Tuple[List, List, List, List]: observation, reward, done and info of
+                    each sub-environment.
+            """
+            obs, rewards, dones, infos = self.batched_env.step(np.asarray(actions))
+            info_list = [
+                {key: float(np.ravel(value)[i]) for key, value in infos.items()}
+                for i in range(self.num_envs)
+            ]
+            return self._split_obs(obs), rewards.tolist(), dones.tolist(), info_list
+
+        def get_sub_environments(self) -> List[gym.Env]:
+            """Get the environments the households of the batch were created from."""
+            return self.batched_env.envs
+
+        def get_unwrapped(self) -> List[gym.Env]:
+            """Get the environments the households of the batch were created from."""
+            return self.get_sub_environments()
+
+    # Defined in this function, but found (e.g. when unpickling) as module attribute
+    RLlibVectorEnv.__qualname__ = "RLlibVectorEnv"
+    return RLlibVectorEnv
+
+
+def __getattr__(name: str) -> type:
+    """Create `RLlibVectorEnv` on first access, such that only it requires Ray."""
+    if name == "RLlibVectorEnv":
+        globals()[name] = _create_rllib_vector_env_class()
+        return globals()[name]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -27,7 +27,7 @@ def plot_episode(
     labels: Dict[str, str] = None,
     markers: Dict[str, str] = None,
     selected_keys: List[str] = None,
-    num_timesteps: int = 25,
+    num_timesteps: int = None,
     iteration: int = None,
     title: str = "Episode Trajectory",
     y_max: float = 4,
@@ -37,8 +37,14 @@ def plot_episode(
     rewards_key: str = "rewards",
     dpi: int = 100,
     include_episode_stats: bool = True,
+    time_step_len: float = 1,
 ):
-    """Plot a single episode of battery control problem."""
+    """Plot a single episode of battery control problem.
+
+    The number of time steps (if not given) is that of the longest line in the data.
+    Major x ticks are placed every 5 hours and minor ticks every hour, according to
+    `time_step_len` (in hours), and the ticks are labelled in hours.
+    """
 
     # default_setup()
 
@@ -53,7 +59,11 @@ def plot_episode(
     if markers is None:
         markers = MARKERS
 
-    x = np.arange(0, num_timesteps)
+    if num_timesteps is None:
+        num_timesteps = max(len(np.atleast_1d(values)) for values in data.values())
+    steps_per_hour = max(int(round(1 / time_step_len)), 1)
+    x = np.arange(0, num_timesteps, steps_per_hour)
+    major_ticks = [*range(0, num_timesteps - 2, 5 * steps_per_hour), num_timesteps - 2]
 
     if rewards_key in data.keys():
         episode_reward = sum(data[rewards_key])
@@ -62,9 +72,11 @@ def plot_episode(
 
     # Setting up the figure
     _, ax = plt.subplots(figsize=figsize, dpi=dpi)
-    ax.set_xticks([0, 5, 10, 15, 20, 23], minor=False)
+    ax.set_xticks(major_ticks, minor=False)
     ax.set_xticks(x, minor=True)
-    ax.set_xticklabels([0, 5, 10, 15, 20, 23], minor=False)
+    ax.set_xticklabels(
+        ["{:g}".format(tick * time_step_len) for tick in major_ticks], minor=False
+    )
 
     if show_grid:
         ax.yaxis.grid(True, which="major")
@@ -106,7 +118,7 @@ def plot_episode(
 
         plt.title(title)
     plt.ylabel("kW / kWh / other")
-    plt.xlabel("Time step")
+    plt.xlabel("Time (h)")
 
     # Adding overall data
     if "power_diff" in data:
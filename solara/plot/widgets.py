@@ -1,14 +1,15 @@
 """Widgets for visualising episodes in environments."""
 
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, Union
 
 import ipywidgets as widgets
 import numpy as np
 import matplotlib.pyplot as plt
 
 import solara.plot.pyplot
-import solara.utils.rllib
+from solara.envs.counterfactual import CounterfactualEvaluator
 from solara.plot.constants import LABELS
+from solara.utils.episode_store import EpisodeStore
 
 
 class InteractiveEpisodes(widgets.HBox):
@@ -16,7 +17,7 @@ class InteractiveEpisodes(widgets.HBox):
 
     def __init__(
         self,
-        episode_data: List[Dict] = None,
+        episode_data: Union[List[Dict], EpisodeStore] = None,
         initial_visibility: List[str] = None,
         manual_mode: bool = False,
         manual_start_actions: List = None,
@@ -26,16 +27,21 @@ class InteractiveEpisodes(widgets.HBox):
         """Interactive episode widget.
 
         Args:
-            episode_data (List[Dict]): list of dictionaries containing episode data.
-                Defaults to None.
+            episode_data (Union[List[Dict], EpisodeStore]): list of dictionaries
+                containing episode data, or store of episodes, which are then only
+                loaded from disk when shown. Defaults to None.
             initial_visibility (List[str], optional): which values to plot initially.
                 Defaults to None, which makes all lines visible.
             manual_mode (bool, optional): Whether to manually adapt policy.
                 Defaults to False.
             manual_start_actions (List, optional): Starting values for manual policy.
                 Only relevant if `manual_mode == True`. Defaults to None.
-            env (object, optional): environment to be used in manual mode.
-                Defaults to None.
+            env (object, optional): environment to be used in manual mode. It is
+                reset once, and changes of the manual actions are evaluated on the
+                same episode with a `CounterfactualEvaluator`. Otherwise, it is only
+                used for the time step length of the episodes, which is by default
+                taken from the "time_step_len" metadata of an `EpisodeStore`, or
+                else 1 hour. Defaults to None.
             plot_figsize (Tuple, optional): size of plot shown, arg is passed to
                 matplotlib. Defaults to (6, 4).
         """
@@ -47,6 +53,7 @@ class InteractiveEpisodes(widgets.HBox):
         }
 
         self.episode_data = episode_data
+        self.env = env
         self.manual_mode = manual_mode
         self.manual_start_actions = manual_start_actions
         self.plot_figsize = plot_figsize
@@ -63,8 +70,11 @@ class InteractiveEpisodes(widgets.HBox):
                 for child in top_widget.children:
                     child.layout = hidden_layout
         else:
-            self.env = env
-            sliders = self._create_manual_sliders()
+            sliders = self._create_manual_sliders(num=env.episode_len)
+            self.env.reset()
+            self.evaluator = CounterfactualEvaluator(
+                self.env, [slider.value for slider in sliders.values()]
+            )
             top_widget = widgets.HBox([*sliders.values()])
 
         settings = self._create_settings_accordion(initial_visibility)
@@ -224,20 +234,14 @@ class InteractiveEpisodes(widgets.HBox):
         if not self.manual_mode:
             iteration = self.widgets["iteration"].value
             single_episode_data = self.episode_data[iteration - 1]
+            time_step_len = self._get_time_step_len(iteration - 1)
         else:
-            actions = []
-            for slider in self.widgets["manual_sliders"].values():
-                actions.append(np.array([slider.value]))
-            agent = solara.utils.rllib.DeterministicAgent(actions, self.env)
-            observations, actions, rewards, infos = solara.utils.rllib.run_episode(
-                agent
-            )
-            single_episode_data = solara.utils.rllib.get_episode_dict(
-                observations,
-                actions,
-                rewards,
-                infos,
+            time_step_len = self.env.time_step_len
+            actions = np.array(
+                [slider.value for slider in self.widgets["manual_sliders"].values()]
             )
+            # Only re-simulates the episode from the first changed action onward
+            single_episode_data = self.evaluator.evaluate(actions, update_base=True)
 
         # Re-draw the plot in "plot" output widget
         self.widgets["plot"].clear_output(wait=True)
@@ -250,6 +254,7 @@ class InteractiveEpisodes(widgets.HBox):
                 y_min=y_range[0],
                 y_max=y_range[1],
                 figsize=self.plot_figsize,
+                time_step_len=time_step_len,
             )
             plt.show()
             self._print_episode_data(single_episode_data)
@@ -258,6 +263,22 @@ class InteractiveEpisodes(widgets.HBox):
             print("plotted")
             print(change)
 
+    def _get_time_step_len(self, idx: int) -> float:
+        """Get length of time steps of an episode in the episode data.
+
+        Args:
+            idx (int): index of episode in episode data.
+
+        Returns:
+            float: time step length (in hours) of the env if given, else that in the
+                episode's metadata if stored, else 1.
+        """
+        if self.env is not None:
+            return self.env.time_step_len
+        if isinstance(self.episode_data, EpisodeStore):
+            return self.episode_data.get_metadata(idx).get("time_step_len", 1)
+        return 1
+
     def _print_episode_data(self, single_episode_data: Dict) -> None:
         """Print summary data of episode.
 
@@ -0,0 +1,403 @@
+"""Module for solving optimal control problems of many days in parallel.
+
+Each job is a tuple (trace, day, env_config) of
+    trace: tuple of paths (load_path, pv_path) of the load and PV traces, or None
+        to use the data paths of the env config,
+    day: index of the day (episode start) in the traces,
+    env_config: environment config as used by `solara.envs.creator.create_env`.
+The optimal solutions are saved in a content-addressed cache directory, keyed by
+the hash of the trace files, the day, and the battery, grid and episode settings.
+Rerunning (or resuming) a batch therefore only solves the jobs not in the cache.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import collections
+import copy
+import functools
+import hashlib
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import tempfile
+import time
+
+import cvxpy as cp
+import numpy as np
+
+from solara.envs.configs import DEFAULT_ENV_CONFIG
+from solara.envs.creator import create_env
+from solara.solvers.convex import EpisodeProblem
+
+logger = logging.getLogger(__name__)
+
+Job = Tuple[Optional[Tuple[str, str]], int, dict]
+
+DEFAULT_SOLVERS = ("CLARABEL", "ECOS", "SCS")
+
+# Problems built in this process, reused for jobs with the same settings
+_PROBLEMS = {}
+
+
+@functools.lru_cache(maxsize=1024)
+def _hash_file(path: str, mtime: float, size: int) -> str:
+    """Get SHA-256 hash of file contents (cached by path, mtime and size)."""
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(2**20), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def hash_file(path: str) -> str:
+    """Get SHA-256 hash of file contents.
+
+    Args:
+        path (str): path to file.
+
+    Returns:
+        str: hex digest of hash.
+    """
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return _hash_file(path, stat.st_mtime, stat.st_size)
+
+
+def get_job_config(job: Job) -> dict:
+    """Get env config of job, with trace paths and day set.
+
+    Args:
+        job (Job): job tuple (trace, day, env_config).
+
+    Returns:
+        dict: env config fixed to the job's traces and day.
+    """
+    trace, day, env_config = job
+    env_config = copy.deepcopy(env_config or DEFAULT_ENV_CONFIG)
+    components = env_config["components"]
+    if trace is not None:
+        components["load"]["data_path"], components["solar"]["data_path"] = trace
+    components["load"]["fixed_sample_num"] = day
+    components["solar"]["fixed_sample_num"] = day
+    return env_config
+
+
+def _get_settings(env_config: dict) -> Dict:
+    """Get settings of battery, grid and episode that determine the problem."""
+    components = env_config["components"]
+    general = env_config["general"]
+    return {
+        "battery": components["battery"],
+        "grid": components["grid"],
+        "episode_len": general.get("episode_len", 24),
+        "grid_charging": general.get("grid_charging", False),
+    }
+
+
+def get_job_key(job: Job) -> str:
+    """Get content-addressed cache key of job.
+
+    Args:
+        job (Job): job tuple (trace, day, env_config).
+
+    Returns:
+        str: SHA-256 hex digest of trace hashes, day, battery, grid and episode
+            settings.
+    """
+    env_config = get_job_config(job)
+    components = env_config["components"]
+    key_data = {
+        "load": hash_file(components["load"]["data_path"]),
+        "pv": hash_file(components["solar"]["data_path"]),
+        "day": job[1],
+        **_get_settings(env_config),
+    }
+    return hashlib.sha256(
+        json.dumps(key_data, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def _get_cache_path(cache_dir: str, key: str) -> str:
+    """Get path of cached result, sharded by first two characters of key."""
+    return os.path.join(cache_dir, key[:2], key + ".json")
+
+
+def load_result(cache_dir: str, key: str) -> Optional[Dict]:
+    """Load result from cache.
+
+    Args:
+        cache_dir (str): cache directory.
+        key (str): key of job.
+
+    Returns:
+        Optional[Dict]: result, None if not cached.
+    """
+    path = _get_cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        result = json.load(file)
+    if result.get("episode") is not None:
+        result["episode"] = {
+            name: np.array(values) for name, values in result["episode"].items()
+        }
+    return result
+
+
+def save_result(cache_dir: str, key: str, result: Dict) -> None:
+    """Atomically save result to cache.
+
+    Args:
+        cache_dir (str): cache directory.
+        key (str): key of job.
+        result (Dict): result of job.
+    """
+    path = _get_cache_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    result = dict(result)
+    if result.get("episode") is not None:
+        result["episode"] = {
+            name: np.asarray(values).tolist()
+            for name, values in result["episode"].items()
+        }
+
+    file_descriptor, tmp_path = tempfile.mkstemp(
+        suffix=".json", dir=os.path.dirname(path)
+    )
+    with os.fdopen(file_descriptor, "w") as file:
+        json.dump(result, file)
+    os.replace(tmp_path, path)
+
+
+def _failed_result(status: str) -> Dict:
+    """Get result of job that could not be solved."""
+    return {"cost": None, "status": status, "solver": None, "episode": None}
+
+
+def solve_job(job: Job, solvers: Sequence[str] = DEFAULT_SOLVERS) -> Dict:
+    """Solve optimal control problem of a single job.
+
+    The (installed) solvers are tried in order until one succeeds. Problems are
+    built once per process and settings, and then reused for all jobs with the same
+    settings.
+
+    Args:
+        job (Job): job tuple (trace, day, env_config).
+        solvers (Sequence[str], optional): CVXPY solvers to try in order. Defaults
+            to ("CLARABEL", "ECOS", "SCS").
+
+    Returns:
+        Dict: result with keys cost, status, solver and episode (episode dict of
+            optimal solution, None if all solvers failed).
+    """
+    env_config = get_job_config(job)
+    env = create_env(env_config)
+
+    settings_key = json.dumps(_get_settings(env_config), sort_keys=True, default=str)
+    if settings_key not in _PROBLEMS:
+        _PROBLEMS[settings_key] = EpisodeProblem.from_env(env)
+    problem = _PROBLEMS[settings_key]
+
+    installed_solvers = cp.installed_solvers()
+    status = "no installed solver"
+    for solver in solvers:
+        if solver not in installed_solvers:
+            continue
+        try:
+            problem.solver = solver
+            episode = problem.solve_env_episode(env)
+            return {
+                "cost": float(np.sum(episode["cost"])),
+                "status": problem.problem.status,
+                "solver": solver,
+                "episode": episode,
+            }
+        except (cp.SolverError, ValueError) as error:
+            status = str(error)
+        logger.warning("Solver %s failed on day %s (%s).", solver, job[1], status)
+
+    return _failed_result(status)
+
+
+def _worker(conn: multiprocessing.connection.Connection) -> None:
+    """Solve jobs received from the main process with a single solver each.
+
+    Args:
+        conn (multiprocessing.connection.Connection): connection to main process,
+            receiving (job, solver) tuples (None to stop) and sending results.
+    """
+    try:
+        while True:
+            task = conn.recv()
+            if task is None:
+                break
+            job, solver = task
+            conn.send(solve_job(job, solvers=[solver]))
+    finally:
+        conn.close()
+
+
+def _start_worker(
+    context: multiprocessing.context.BaseContext,
+) -> Tuple[multiprocessing.Process, multiprocessing.connection.Connection]:
+    """Start worker process, returning process and connection to it."""
+    conn, worker_conn = context.Pipe()
+    process = context.Process(target=_worker, args=(worker_conn,), daemon=True)
+    process.start()
+    worker_conn.close()
+    return process, conn
+
+
+def _solve_in_workers(
+    jobs: Dict[str, Job], num_workers: int, timeout: float, solvers: Sequence[str]
+) -> Iterator[Tuple[str, Dict]]:
+    """Solve jobs in worker processes, with timeout enforced by the main process.
+
+    Each job is solved with one solver at a time. If a solver fails or exceeds the
+    timeout, the job is solved again with the next solver. A worker exceeding the
+    timeout (e.g. stuck in a native solver call) is terminated and replaced.
+
+    Args:
+        jobs (Dict[str, Job]): jobs by key.
+        num_workers (int): number of worker processes.
+        timeout (float): maximum time per job and solver in seconds, None for no
+            timeout.
+        solvers (Sequence[str]): CVXPY solvers to try in order.
+
+    Yields:
+        Tuple[str, Dict]: key and result of each job, in order of completion.
+    """
+    installed_solvers = cp.installed_solvers()
+    solvers = [solver for solver in solvers if solver in installed_solvers]
+    if not solvers:
+        for key in jobs:
+            yield key, _failed_result("no installed solver")
+        return
+
+    context = multiprocessing.get_context()
+    pending = collections.deque((key, job, 0) for key, job in jobs.items())
+    idle = [_start_worker(context) for _ in range(min(num_workers, len(jobs)))]
+    running = {}
+
+    try:
+        while pending or running:
+            while pending and idle:
+                process, conn = idle.pop()
+                key, job, solver_idx = pending.popleft()
+                conn.send((job, solvers[solver_idx]))
+                deadline = None if timeout is None else time.monotonic() + timeout
+                running[conn] = (process, key, job, solver_idx, deadline)
+
+            deadlines = [task[-1] for task in running.values() if task[-1] is not None]
+            wait_time = None
+            if deadlines:
+                wait_time = max(min(deadlines) - time.monotonic(), 0)
+            ready = multiprocessing.connection.wait(list(running), timeout=wait_time)
+
+            now = time.monotonic()
+            for conn in list(running):
+                process, key, job, solver_idx, deadline = running[conn]
+                result = None
+                if conn in ready:
+                    try:
+                        result = conn.recv()
+                        status = None
+                    except EOFError:
+                        status = "worker failed"
+                elif deadline is not None and now >= deadline:
+                    status = "timeout"
+                else:
+                    continue
+
+                del running[conn]
+                if result is None:
+                    logger.warning(
+                        "Solver %s failed on day %s (%s).",
+                        solvers[solver_idx],
+                        job[1],
+                        status,
+                    )
+                    process.terminate()
+                    process.join()
+                    conn.close()
+                    idle.append(_start_worker(context))
+                    result = _failed_result(status)
+                else:
+                    idle.append((process, conn))
+
+                if result["cost"] is None and solver_idx + 1 < len(solvers):
+                    pending.append((key, job, solver_idx + 1))
+                else:
+                    yield key, result
+    finally:
+        workers = idle + [(task[0], conn) for conn, task in running.items()]
+        for process, conn in workers:
+            process.terminate()
+            process.join()
+            conn.close()
+
+
+def solve_jobs(
+    jobs: List[Job],
+    cache_dir: str,
+    num_workers: int = None,
+    timeout: float = 60,
+    solvers: Sequence[str] = DEFAULT_SOLVERS,
+    retry_failed: bool = False,
+) -> List[Dict]:
+    """Solve optimal control problems of jobs in parallel, using an on-disk cache.
+
+    Results are saved to the cache as soon as they are available, such that an
+    interrupted batch can be resumed by calling this function again.
+
+    Args:
+        jobs (List[Job]): job tuples (trace, day, env_config).
+        cache_dir (str): directory of result cache.
+        num_workers (int, optional): number of worker processes. Defaults to None,
+            which uses the number of CPUs.
+        timeout (float, optional): maximum time per job and solver in seconds,
+            enforced by terminating the worker process, after which the next solver
+            is tried. Defaults to 60. With None and num_workers=1, jobs are solved in
+            the calling process.
+        solvers (Sequence[str], optional): CVXPY solvers to try in order. Defaults
+            to ("CLARABEL", "ECOS", "SCS").
+        retry_failed (bool, optional): whether to solve jobs again whose cached
+            result is a failure. Defaults to False.
+
+    Returns:
+        List[Dict]: result of each job, in order of jobs, see `solve_job()`.
+    """
+    keys = [get_job_key(job) for job in jobs]
+    results = {}
+    for key in keys:
+        if key not in results:
+            result = load_result(cache_dir, key)
+            if result is not None and (result["cost"] is not None or not retry_failed):
+                results[key] = result
+
+    missing = {}
+    for key, job in zip(keys, jobs):
+        if key not in results:
+            missing[key] = job
+
+    logger.info(
+        "Solving %s jobs (%s cached).", len(missing), len(set(keys)) - len(missing)
+    )
+
+    if num_workers == 1 and timeout is None:
+        solved = (
+            (key, solve_job(job, solvers=solvers)) for key, job in missing.items()
+        )
+    else:
+        solved = _solve_in_workers(
+            missing, num_workers or os.cpu_count(), timeout, solvers
+        )
+    for key, result in solved:
+        save_result(cache_dir, key, result)
+        results[key] = result
+
+    return [results[key] for key in keys]
@@ -0,0 +1,246 @@
+"""Module with convex optimal control problem of a battery control episode.
+
+The problem is built once from the battery and grid components, with the load, PV
+generation and initial battery content as CVXPY parameters. Solving the problem for
+another day only updates the parameter values, such that CVXPY can reuse the
+compiled (canonicalised) problem and warm start the solver. See the CVXPY docs on
+disciplined parametrized programming (DPP) for details:
+https://www.cvxpy.org/tutorial/advanced/index.html#disciplined-parametrized-programming
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict
+import logging
+
+import cvxpy as cp
+import numpy as np
+
+if TYPE_CHECKING:
+    from solara.envs.battery_control import BatteryControlEnv
+    from solara.envs.components.battery import LithiumIonBattery
+    from solara.envs.components.grid import PeakGrid
+
+
+class EpisodeProblem:
+    """Parametrized convex problem of optimal battery control for an episode."""
+
+    def __init__(
+        self,
+        battery: LithiumIonBattery,
+        grid: PeakGrid,
+        num_steps: int = 24,
+        grid_charging: bool = True,
+        solver: str = None,
+    ) -> None:
+        """Parametrized convex problem of optimal battery control for an episode.
+
+        The problem minimises the cost of power drawn from the peak-pricing grid,
+        subject to the C/L/C battery model constraints. As in
+        `solara.envs.battery_control.BatteryControlEnv`, the load and PV generation
+        at step t are the values of the component's `episode_values[t]`, and excess
+        PV generation is curtailed (not sold).
+
+        Args:
+            battery (LithiumIonBattery): battery model.
+            grid (PeakGrid): peak-pricing grid model.
+            num_steps (int, optional): number of time steps of episode. Defaults to
+                24.
+            grid_charging (bool, optional): whether the battery can be charged from
+                the grid. Otherwise charging is limited to the PV generation. Defaults
+                to True.
+            solver (str, optional): CVXPY solver to use, e.g. "ECOS". Defaults to None,
+                which lets CVXPY choose.
+        """
+        self.battery = battery
+        self.grid = grid
+        self.num_steps = num_steps
+        self.grid_charging = grid_charging
+        self.solver = solver
+        self.logger = logging.getLogger(type(self).__name__)
+
+        # Parameters changing between episodes
+        self.load = cp.Parameter(num_steps, nonneg=True, name="load")
+        self.pv_generation = cp.Parameter(num_steps, nonneg=True, name="pv_generation")
+        self.initial_content = cp.Parameter(nonneg=True, name="initial_content")
+
+        # Variables
+        self.power_charge = cp.Variable(num_steps, nonneg=True, name="power_charge")
+        self.power_discharge = cp.Variable(
+            num_steps, nonneg=True, name="power_discharge"
+        )
+        self.energy_content = cp.Variable(num_steps + 1, name="energy_content")
+        self.power_grid = cp.Variable(num_steps, nonneg=True, name="power_grid")
+        self.power_over_threshold = cp.Variable(
+            num_steps, nonneg=True, name="power_over_threshold"
+        )
+
+        self.problem = cp.Problem(self._get_objective(), self._get_constraints())
+
+        if not self.problem.is_dpp():
+            raise ValueError("Episode problem is not DPP-compliant.")
+
+        self.logger.info("Episode problem with %s steps built.", num_steps)
+
+    def _get_constraints(self) -> list:
+        """Get constraints of battery, grid and power flow."""
+        battery = self.battery
+        time_step_len = battery.time_step_len
+        content = self.energy_content
+
+        # The env's actions scale to at most the charging limits (see
+        # `BatteryControlEnv.step()`), which can be below the battery's max rates
+        min_charge_power, max_charge_power = battery.get_charging_limits()
+        max_charge = np.minimum(battery.alpha_bar_c, max_charge_power)
+        max_discharge = np.minimum(battery.alpha_bar_d, -min_charge_power)
+
+        battery_constraints = [
+            content[0] == self.initial_content,
+            # Equation (19) of C/L/C paper, with eta_d being reciprocal efficiency
+            content[1:]
+            == content[:-1]
+            + battery.eta_c * time_step_len * self.power_charge
+            - battery.eta_d * time_step_len * self.power_discharge,
+            # Equation (5), limited to charging limits of env
+            self.power_charge <= max_charge,
+            self.power_discharge <= max_discharge,
+            # Equation (22)
+            battery.u1 * self.power_discharge / battery.nominal_voltage_d
+            + battery.v1_bar
+            <= content[1:],
+            battery.u2 * self.power_charge / battery.nominal_voltage_c + battery.v2_bar
+            >= content[1:],
+        ]
+
+        power_flow_constraints = [
+            # Net load is drawn from grid, excess PV generation is curtailed
+            self.power_grid
+            >= self.load
+            + self.power_charge
+            - self.power_discharge
+            - self.pv_generation,
+            self.power_over_threshold >= self.power_grid - self.grid.peak_threshold,
+        ]
+        if not self.grid_charging:
+            power_flow_constraints.append(self.power_charge <= self.pv_generation)
+
+        return battery_constraints + power_flow_constraints
+
+    def _get_objective(self) -> cp.Minimize:
+        """Get objective, the total cost of power drawn from the grid."""
+        cost = (
+            self.grid.base_price * self.power_grid
+            + (self.grid.peak_price - self.grid.base_price) * self.power_over_threshold
+        ) * self.grid.time_step_len
+        return cp.Minimize(cp.sum(cost))
+
+    def solve(
+        self,
+        load: np.ndarray,
+        pv_generation: np.ndarray,
+        initial_content: float = None,
+        **solver_kwargs,
+    ) -> Dict[str, np.ndarray]:
+        """Solve problem for given episode, reusing the compiled problem.
+
+        Args:
+            load (np.ndarray): load at each step (kW), at least num_steps values.
+            pv_generation (np.ndarray): PV generation at each step (kW), at least
+                num_steps values.
+            initial_content (float, optional): battery content at beginning of episode
+                (kWh). Defaults to None, which uses the empty battery (v1_bar).
+            **solver_kwargs: further keyword arguments passed to
+                `cvxpy.Problem.solve()`.
+
+        Returns:
+            Dict[str, np.ndarray]: optimal episode in the format of
+                `solara.utils.episodes.get_episode_dict`, i.e. with load, pv_gen,
+                battery_cont, net_load, charging_power, cost, price_threshold,
+                rewards and actions per step.
+        """
+        if initial_content is None:
+            initial_content = self.battery.v1_bar
+
+        self.load.value = np.asarray(load[: self.num_steps], dtype=float)
+        self.pv_generation.value = np.asarray(
+            pv_generation[: self.num_steps], dtype=float
+        )
+        self.initial_content.value = float(initial_content)
+
+        self.problem.solve(solver=self.solver, warm_start=True, **solver_kwargs)
+
+        if self.problem.status not in cp.settings.SOLUTION_PRESENT:
+            raise ValueError(
+                "Episode problem could not be solved (status: {}).".format(
+                    self.problem.status
+                )
+            )
+
+        self.logger.debug(
+            "Solved episode problem in %ss with cost %s.",
+            self.problem.solver_stats.solve_time,
+            self.problem.value,
+        )
+
+        return self._get_episode_dict()
+
+    def solve_env_episode(self, env: BatteryControlEnv) -> Dict[str, np.ndarray]:
+        """Solve problem for the current episode of an environment.
+
+        Args:
+            env (BatteryControlEnv): environment after reset.
+
+        Returns:
+            Dict[str, np.ndarray]: optimal episode, see `solve()`.
+        """
+        return self.solve(
+            env.load.episode_values,
+            env.solar.episode_values,
+            initial_content=env.battery.get_energy_content(),
+        )
+
+    def _get_episode_dict(self) -> Dict[str, np.ndarray]:
+        """Get episode dict of current solution."""
+        load = self.load.value
+        pv_generation = self.pv_generation.value
+        charging_power = self.power_charge.value - self.power_discharge.value
+        net_load = np.maximum(load + charging_power - pv_generation, 0)
+        cost = self.grid.draw_power(power=net_load)
+
+        min_charge_power, max_charge_power = self.battery.get_charging_limits()
+        actions = np.where(
+            charging_power > 0,
+            charging_power / max_charge_power,
+            charging_power / -min_charge_power,
+        )
+
+        return {
+            "load": load,
+            "pv_gen": pv_generation,
+            "battery_cont": self.energy_content.value[1:],
+            "net_load": net_load,
+            "charging_power": charging_power,
+            "cost": cost,
+            "price_threshold": np.full(self.num_steps, self.grid.peak_threshold),
+            "rewards": -cost,
+            "actions": actions,
+        }
+
+    @classmethod
+    def from_env(cls, env: BatteryControlEnv, solver: str = None) -> EpisodeProblem:
+        """Create problem with the components and settings of an environment.
+
+        Args:
+            env (BatteryControlEnv): environment.
+            solver (str, optional): CVXPY solver to use. Defaults to None.
+
+        Returns:
+            EpisodeProblem: problem for episodes of the environment.
+        """
+        return cls(
+            battery=env.battery,
+            grid=env.grid,
+            num_steps=env.episode_len,
+            grid_charging=env.grid_charging,
+            solver=solver,
+        )
@@ -0,0 +1,371 @@
+"""Module with dynamic programming solver of battery control episodes.
+
+Unlike the convex problems of `solara.solvers.convex` and `solara.solvers.sparse_lp`,
+the dynamic program uses the transitions of the simulator itself
+(`LithiumIonBattery.simulate_charge` and `PeakGrid.draw_power`), including the
+asymmetric charging efficiencies, the limiting of charging to PV generation and the
+infeasible control penalty. The battery content is discretised into levels, and
+the backward induction is computed with array operations over all days, battery
+content levels and candidate actions at once.
+
+The reward of a step plus the (linearly interpolated) value of the next battery
+content is piecewise linear in the charging power. Its maximum is hence attained at
+one of the breakpoints, which are used as candidate actions: the feasible charging
+and discharging limits, no charging, the powers at which the net load reaches zero or
+the peak threshold, and the powers that lead exactly to a content level.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List
+import logging
+
+import numpy as np
+
+from solara.solvers.sparse_lp import SparseLP
+
+if TYPE_CHECKING:
+    from solara.envs.battery_control import BatteryControlEnv
+
+
+class DPSolver:
+    """Dynamic programming solver over discretised battery content."""
+
+    def __init__(
+        self, env: BatteryControlEnv, num_levels: int = 101, num_actions: int = 0
+    ) -> None:
+        """Dynamic programming solver over discretised battery content.
+
+        The value of each battery content level at each step is computed by backward
+        induction, with the value of the next content (which generally lies between
+        levels) linearly interpolated. At each level, the exact candidate actions
+        described in the module docstring are considered, such that the actions are
+        not restricted to a grid. The actions are then chosen in a forward pass
+        from the actual (not discretised) battery content, maximising the reward of
+        the step plus the value of the next content. The returned episodes are
+        simulated with the same transitions as the environment, such that replaying
+        the actions in the environment gives the same rewards (up to floating point
+        precision).
+
+        Args:
+            env (BatteryControlEnv): environment with the battery, grid and settings
+                to use.
+            num_levels (int, optional): number of battery content levels between
+                empty and full battery. Defaults to 101.
+            num_actions (int, optional): number of additional candidate actions,
+                evenly spaced between -1 and 1. Defaults to 0.
+        """
+        self.env = env
+        self.battery = env.battery
+        self.grid = env.grid
+        self.num_steps = env.episode_len
+        self.logger = logging.getLogger(type(self).__name__)
+
+        self.levels = np.linspace(self.battery.v1_bar, self.battery.v2_bar, num_levels)
+        self.actions = np.linspace(-1, 1, num_actions)
+        self.action_power = self._action_to_power(self.actions)
+
+    def _get_candidate_powers(
+        self,
+        load: np.ndarray,
+        pv_generation: np.ndarray,
+        energy_content: np.ndarray,
+    ) -> np.ndarray:
+        """Get feasible charging powers at breakpoints of the step's objective.
+
+        Args:
+            load (np.ndarray): load (kW).
+            pv_generation (np.ndarray): PV generation (kW).
+            energy_content (np.ndarray): battery content (kWh), broadcastable with
+                load and PV generation.
+
+        Returns:
+            np.ndarray: candidate powers (kW) along an additional last axis.
+        """
+        shape = np.broadcast(load, pv_generation, energy_content).shape
+        energy_content = np.broadcast_to(energy_content, shape)
+
+        max_power = np.full(shape, float(self.env.max_charge_power))
+        if not self.env.grid_charging:
+            max_power = np.minimum(max_power, pv_generation)
+        upper, _ = self.battery.simulate_charge(max_power, energy_content)
+        lower, _ = self.battery.simulate_charge(
+            np.full(shape, float(self.env.min_charge_power)), energy_content
+        )
+
+        # Powers leading exactly to each level, charging or discharging
+        content_change = self.levels - energy_content[..., np.newaxis]
+        level_powers = np.where(
+            content_change > 0,
+            content_change / (self.battery.eta_c * self.battery.time_step_len),
+            content_change / (self.battery.eta_d * self.battery.time_step_len),
+        )
+
+        # Powers at which net load reaches zero and the peak threshold
+        balance = pv_generation - load
+        breakpoints = [
+            lower,
+            upper,
+            np.zeros(shape),
+            balance,
+            balance + self.grid.peak_threshold,
+        ]
+        candidates = np.concatenate(
+            [
+                np.stack(np.broadcast_arrays(*breakpoints), axis=-1),
+                level_powers,
+                np.broadcast_to(self.action_power, shape + self.action_power.shape),
+            ],
+            axis=-1,
+        )
+        return np.clip(candidates, lower[..., np.newaxis], upper[..., np.newaxis])
+
+    def _power_to_action(self, power: np.ndarray) -> np.ndarray:
+        """Get (float32) actions of charging powers, as taken by the environment."""
+        actions = np.where(
+            power > 0,
+            power / self.env.max_charge_power,
+            power / -self.env.min_charge_power,
+        )
+        return np.clip(actions, -1, 1).astype(np.float32)
+
+    def _action_to_power(self, actions: np.ndarray) -> np.ndarray:
+        """Get power attempted by actions, as scaled in the environment."""
+        actions = np.asarray(actions, dtype=float)
+        return np.where(
+            actions > 0,
+            actions * self.env.max_charge_power,
+            actions * -self.env.min_charge_power,
+        )
+
+    def _step(
+        self,
+        load: np.ndarray,
+        pv_generation: np.ndarray,
+        energy_content: np.ndarray,
+        attempted_power: np.ndarray,
+    ) -> Dict[str, np.ndarray]:
+        """Simulate a step for arrays of (broadcastable) states and actions.
+
+        Args:
+            load (np.ndarray): load (kW).
+            pv_generation (np.ndarray): PV generation (kW).
+            energy_content (np.ndarray): battery content (kWh).
+            attempted_power (np.ndarray): power attempted by action (kW).
+
+        Returns:
+            Dict[str, np.ndarray]: rewards, new battery content, and step infos.
+        """
+        power = attempted_power
+        if not self.env.grid_charging:
+            # If charging from grid not enabled, limit charging to solar generation
+            power = np.minimum(power, pv_generation)
+
+        shape = np.broadcast(load, energy_content, power).shape
+        charging_power, new_content = self.battery.simulate_charge(
+            np.broadcast_to(power, shape), np.broadcast_to(energy_content, shape)
+        )
+
+        net_load = np.maximum(load + charging_power - pv_generation, 0)
+        cost = self.grid.draw_power(power=net_load)
+        step = {
+            "rewards": -cost,
+            "battery_cont": new_content,
+            "net_load": net_load,
+            "charging_power": charging_power,
+            "cost": cost,
+        }
+
+        if self.env.infeasible_control_penalty:
+            step["power_diff"] = np.abs(charging_power - attempted_power)
+            step["rewards"] = step["rewards"] - step["power_diff"]
+
+        return step
+
+    def _interpolate(
+        self, values: np.ndarray, energy_content: np.ndarray
+    ) -> np.ndarray:
+        """Linearly interpolate values of levels at battery contents.
+
+        Args:
+            values (np.ndarray): value of each level for each day, of shape
+                (num_days, num_levels).
+            energy_content (np.ndarray): battery contents for each day, of shape
+                (num_days, ...).
+
+        Returns:
+            np.ndarray: interpolated values, of same shape as energy_content.
+        """
+        num_days, num_levels = values.shape
+        level_len = self.levels[1] - self.levels[0]
+
+        position = np.clip(
+            (energy_content - self.levels[0]) / level_len, 0, num_levels - 1
+        )
+        lower = np.minimum(position.astype(int), num_levels - 2)
+        weight = position - lower
+
+        lower = lower.reshape(num_days, -1)
+        weight = weight.reshape(num_days, -1)
+        lower_values = np.take_along_axis(values, lower, axis=1)
+        upper_values = np.take_along_axis(values, lower + 1, axis=1)
+        interpolated = (1 - weight) * lower_values + weight * upper_values
+
+        return interpolated.reshape(energy_content.shape)
+
+    def solve(
+        self,
+        loads: np.ndarray,
+        pv_generations: np.ndarray,
+        initial_contents: np.ndarray = None,
+    ) -> Dict[str, np.ndarray]:
+        """Solve episodes of many days at once.
+
+        Args:
+            loads (np.ndarray): load of each day at each step (kW), of shape
+                (num_days, num_steps).
+            pv_generations (np.ndarray): PV generation of each day at each step (kW),
+                of shape (num_days, num_steps).
+            initial_contents (np.ndarray, optional): battery content at beginning of
+                each day (kWh). Defaults to None, which uses the empty battery
+                (v1_bar).
+
+        Returns:
+            Dict[str, np.ndarray]: optimal episodes, with rewards, actions,
+                battery_cont, net_load, charging_power, cost (and power_diff if the
+                environment has the infeasible control penalty) of shape
+                (num_days, num_steps), and the value of the initial state
+                (`values`) of shape (num_days,).
+        """
+        # Load and PV generation as observed by the environment (float32)
+        loads = np.asarray(loads, dtype=np.float32)[:, : self.num_steps]
+        pv_generations = np.asarray(pv_generations, dtype=np.float32)[
+            :, : self.num_steps
+        ]
+        loads = loads.astype(float)
+        pv_generations = pv_generations.astype(float)
+        num_days = len(loads)
+
+        if initial_contents is None:
+            initial_contents = np.full(num_days, float(self.battery.v1_bar))
+
+        # Backward induction, with arrays of shape
+        # (num_days, num_levels, num_candidates)
+        values = np.zeros((num_days, len(self.levels)))
+        all_values = [values]
+        for step in reversed(range(self.num_steps)):
+            load = loads[:, step, np.newaxis]
+            pv_generation = pv_generations[:, step, np.newaxis]
+            powers = self._get_candidate_powers(
+                load, pv_generation, self.levels[np.newaxis, :]
+            )
+            transition = self._step(
+                load[..., np.newaxis],
+                pv_generation[..., np.newaxis],
+                self.levels[np.newaxis, :, np.newaxis],
+                powers,
+            )
+            q_values = transition["rewards"] + self._interpolate(
+                values, transition["battery_cont"]
+            )
+            values = q_values.max(axis=2)
+            all_values.append(values)
+        all_values.reverse()
+
+        # Forward pass from actual battery content
+        episode = {}
+        energy_content = np.asarray(initial_contents, dtype=float)
+        for step in range(self.num_steps):
+            load = loads[:, step]
+            pv_generation = pv_generations[:, step]
+            powers = self._get_candidate_powers(
+                load[:, np.newaxis],
+                pv_generation[:, np.newaxis],
+                energy_content[:, np.newaxis],
+            )[:, 0]
+            transition = self._step(
+                load[:, np.newaxis],
+                pv_generation[:, np.newaxis],
+                energy_content[:, np.newaxis],
+                powers,
+            )
+            q_values = transition["rewards"] + self._interpolate(
+                all_values[step + 1], transition["battery_cont"]
+            )
+            best_power = np.take_along_axis(
+                powers, q_values.argmax(axis=1)[:, np.newaxis], axis=1
+            )[:, 0]
+
+            # Simulate the best action as taken by the environment (float32)
+            actions = self._power_to_action(best_power)
+            transition = self._step(
+                load, pv_generation, energy_content, self._action_to_power(actions)
+            )
+            for key, value in transition.items():
+                episode.setdefault(key, []).append(value)
+            episode.setdefault("actions", []).append(actions.astype(float))
+            energy_content = transition["battery_cont"]
+
+        episode = {key: np.stack(value, axis=1) for key, value in episode.items()}
+        episode["values"] = self._interpolate(
+            all_values[0], np.asarray(initial_contents, dtype=float)[:, np.newaxis]
+        )[:, 0]
+
+        self.logger.debug("Solved %s days with dynamic programming.", num_days)
+
+        return episode
+
+    def solve_days(self, days: List[int]) -> Dict[str, np.ndarray]:
+        """Solve episodes starting at given days of the environment's traces.
+
+        Args:
+            days (List[int]): indices of days.
+
+        Returns:
+            Dict[str, np.ndarray]: optimal episodes, see `solve()`.
+        """
+        starts = np.asarray(days)[:, np.newaxis] * self.env.steps_per_day
+        steps = starts + np.arange(self.num_steps)
+        loads = np.asarray(self.env.load.data)[steps]
+        pv_generations = np.asarray(self.env.solar.data)[steps]
+        return self.solve(loads, pv_generations)
+
+    def check_against_lp(
+        self, days: List[int], rtol: float = 1e-2, atol: float = 1e-2
+    ) -> np.ndarray:
+        """Check that costs of days match the optimal costs of the linear program.
+
+        The remaining difference to `SparseLP` is due to the interpolation of the
+        values between battery content levels, and decreases with `num_levels`.
+
+        Args:
+            days (List[int]): indices of days to check.
+            rtol (float, optional): relative tolerance of cost of each day. Defaults
+                to 1e-2.
+            atol (float, optional): absolute tolerance of cost of each day. Defaults
+                to 1e-2.
+
+        Returns:
+            np.ndarray: difference of dynamic programming and linear program cost of
+                each day.
+        """
+        episode = self.solve_days(days)
+        linear_program = SparseLP.from_envs([self.env])
+
+        gaps = []
+        for day, cost in zip(days, episode["cost"].sum(axis=1)):
+            steps = day * self.env.steps_per_day + np.arange(self.num_steps)
+            solution = linear_program.solve(
+                np.asarray(self.env.load.data, dtype=np.float32)[steps],
+                np.asarray(self.env.solar.data, dtype=np.float32)[steps],
+            )
+            optimal_cost = solution["cost"].sum()
+            if not np.isclose(cost, optimal_cost, rtol=rtol, atol=atol):
+                raise ValueError(
+                    "Cost {:.4f} of day {} does not match optimal cost {:.4f}.".format(
+                        cost, day, optimal_cost
+                    )
+                )
+            gaps.append(cost - optimal_cost)
+
+        return np.array(gaps)
@@ -0,0 +1,212 @@
+"""Module with model predictive control (MPC) agent."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict
+import logging
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+from solara.solvers.convex import EpisodeProblem
+from solara.solvers.sparse_lp import SparseLP
+
+try:
+    import highspy
+except ImportError:
+    highspy = None
+
+if TYPE_CHECKING:
+    from solara.envs.battery_control import BatteryControlEnv
+
+
+class MPCAgent:
+    """Rolling-horizon model predictive control agent."""
+
+    def __init__(
+        self, env: BatteryControlEnv, backend: str = None, solver: str = None
+    ) -> None:
+        """Rolling-horizon model predictive control agent.
+
+        At each step, the agent solves the optimal control problem over the
+        remaining episode, using the predictions of the environment's load and PV
+        models (`get_prediction()`), and applies the first charging power of the
+        solution. The problem has a fixed horizon of `env.episode_len` steps and is
+        built once. Steps beyond the end of the episode have zero load and PV
+        generation, and hence don't affect the solution. Each re-solve only updates
+        the predictions and battery content, and is warm-started from the previous
+        solution.
+
+        Like `solara.utils.episodes.DeterministicAgent`, the agent can be used with
+        `solara.utils.episodes.run_episode()`.
+
+        Args:
+            env (BatteryControlEnv): environment of the agent.
+            backend (str, optional): "highs" to solve the sparse LP of
+                `solara.solvers.sparse_lp` with the HiGHS solver API (requires the
+                `highspy` package), or "cvxpy" to solve the parametrized problem of
+                `solara.solvers.convex`. Defaults to None, which uses "highs" if
+                `highspy` is installed and "cvxpy" otherwise.
+            solver (str, optional): CVXPY solver used with "cvxpy" backend. Defaults
+                to None.
+        """
+        if backend is None:
+            backend = "cvxpy" if highspy is None else "highs"
+        if backend == "highs" and highspy is None:
+            raise ImportError("Backend 'highs' requires the highspy package.")
+        if backend not in ["highs", "cvxpy"]:
+            raise ValueError("Unknown backend '{}'.".format(backend))
+
+        self.env = env
+        self.backend = backend
+        self.config = {"env_config": None}
+        self.num_steps = env.episode_len
+        self.latencies = []
+        self.logger = logging.getLogger(type(self).__name__)
+
+        if backend == "highs":
+            self._setup_highs()
+        else:
+            self.problem = EpisodeProblem.from_env(env, solver=solver)
+
+    def _setup_highs(self) -> None:
+        """Pass sparse LP of environment to HiGHS solver instance."""
+        self.lp = SparseLP.from_envs([self.env])
+        self.charge_idxs = [
+            self.lp.get_var_slice(connection).start
+            for connection in self.lp.connections
+            if connection[1] == "battery"
+        ]
+        self.discharge_idxs = [
+            self.lp.get_var_slice(connection).start
+            for connection in self.lp.connections
+            if connection[0] == "battery"
+        ]
+
+        constraints = sp.vstack([self.lp.a_ub, self.lp.a_eq], format="csr")
+        self._num_ub = self.lp.a_ub.shape[0]
+        self._row_idxs = np.arange(constraints.shape[0], dtype=np.int32)
+        self._row_lower = np.full(constraints.shape[0], -highspy.kHighsInf)
+
+        model = highspy.HighsLp()
+        model.num_col_ = constraints.shape[1]
+        model.num_row_ = constraints.shape[0]
+        model.col_cost_ = self.lp.costs
+        model.col_lower_ = np.maximum(self.lp.bounds[:, 0], -highspy.kHighsInf)
+        model.col_upper_ = np.minimum(self.lp.bounds[:, 1], highspy.kHighsInf)
+        model.row_lower_ = self._row_lower
+        model.row_upper_ = np.zeros(constraints.shape[0])
+        model.a_matrix_.format_ = highspy.MatrixFormat.kRowwise
+        model.a_matrix_.start_ = constraints.indptr
+        model.a_matrix_.index_ = constraints.indices
+        model.a_matrix_.value_ = constraints.data
+
+        self.highs = highspy.Highs()
+        self.highs.setOptionValue("output_flag", False)
+        self.highs.passModel(model)
+
+    def compute_action(
+        self, obs: object, explore: bool = False
+    ):  # pylint: disable=unused-argument
+        """Get action by solving the control problem over the remaining episode.
+
+        Args:
+            obs (object): observations, not used as the agent reads the state of the
+                environment directly.
+            explore (bool, optional): Whether to explore, has no effect.
+                Defaults to False.
+
+        Returns:
+            np.array: action taken by agent
+        """
+        start_time = time.perf_counter()
+
+        time_step = int(np.ravel(self.env.time_step)[0])
+        load = np.zeros(self.num_steps)
+        pv_generation = np.zeros(self.num_steps)
+        load_prediction = self.env.load.get_prediction(time_step, self.num_steps)
+        pv_prediction = self.env.solar.get_prediction(time_step, self.num_steps)
+        load[: len(load_prediction)] = load_prediction
+        pv_generation[: len(pv_prediction)] = pv_prediction
+        energy_content = float(np.ravel(self.env.battery.get_energy_content())[0])
+
+        if self.backend == "highs":
+            charging_power = self._solve_highs(load, pv_generation, energy_content)
+        else:
+            episode = self.problem.solve(
+                load, pv_generation, initial_content=energy_content
+            )
+            charging_power = episode["charging_power"][0]
+
+        if charging_power > 0:
+            action = charging_power / self.env.max_charge_power
+        else:
+            action = charging_power / -self.env.min_charge_power
+        action = np.clip(np.array([action], dtype=np.float32), -1, 1)
+
+        self.latencies.append(time.perf_counter() - start_time)
+
+        return action
+
+    def _solve_highs(
+        self, load: np.ndarray, pv_generation: np.ndarray, energy_content: float
+    ) -> float:
+        """Solve sparse LP with HiGHS, hot-started from the previous solution.
+
+        Args:
+            load (np.ndarray): predicted load of each step in horizon (kW).
+            pv_generation (np.ndarray): predicted PV generation (kW).
+            energy_content (float): current battery content (kWh).
+
+        Returns:
+            float: charging power of first step (kW).
+        """
+        b_ub, b_eq = self.lp.get_rhs(load, pv_generation, [energy_content])
+        num_ub = self._num_ub
+        self._row_lower[num_ub:] = b_eq
+        self.highs.changeRowsBounds(
+            len(self._row_idxs),
+            self._row_idxs,
+            self._row_lower,
+            np.concatenate([b_ub, b_eq]),
+        )
+        self.highs.run()
+
+        if self.highs.getModelStatus() != highspy.HighsModelStatus.kOptimal:
+            raise ValueError(
+                "MPC problem could not be solved (status: {}).".format(
+                    self.highs.modelStatusToString(self.highs.getModelStatus())
+                )
+            )
+
+        x = np.asarray(self.highs.getSolution().col_value)
+        return float(np.sum(x[self.charge_idxs]) - np.sum(x[self.discharge_idxs]))
+
+    def get_latency_stats(self) -> Dict[str, float]:
+        """Get statistics of the time taken to compute each action.
+
+        Returns:
+            Dict[str, float]: number of steps, and mean, median, 95th percentile and
+                maximum latency (in seconds).
+        """
+        latencies = np.array(self.latencies)
+        if len(latencies) == 0:
+            return {"num_steps": 0}
+        return {
+            "num_steps": len(latencies),
+            "mean": float(np.mean(latencies)),
+            "median": float(np.median(latencies)),
+            "p95": float(np.percentile(latencies, 95)),
+            "max": float(np.max(latencies)),
+        }
+
+    def reset_latency_stats(self) -> None:
+        """Clear recorded latencies."""
+        self.latencies = []
+
+    def env_creator(
+        self, env_config: dict = None
+    ) -> BatteryControlEnv:  # pylint: disable=unused-argument
+        """Get environment of agent."""
+        return self.env
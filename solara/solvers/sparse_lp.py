@@ -0,0 +1,393 @@
+"""Module compiling power flow topologies into sparse linear programs.
+
+Instead of building CVXPY expression trees, the constraint matrices of the optimal
+control problem are assembled directly as `scipy.sparse` matrices and solved with
+the HiGHS solver of `scipy.optimize.linprog`. The problem variables are the power
+flows of all connections of a `solara.envs.wiring.PowerFlow` (corresponding to the
+`power_flow['source','target']` variables of
+`solara.utils.notation.create_power_variables`) at each time step, the battery
+energy content and the grid power above the peak threshold.
+
+Several households with the same topology (but different battery, grid, load and
+PV parameters) are combined into one block-diagonal problem.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, Tuple
+import logging
+
+import numpy as np
+import scipy.optimize
+import scipy.sparse as sp
+
+from solara.envs.wiring import PowerFlow
+
+if TYPE_CHECKING:
+    from solara.envs.battery_control import BatteryControlEnv
+    from solara.envs.components.battery import LithiumIonBattery
+    from solara.envs.components.grid import PeakGrid
+
+
+COMPONENTS = ["solar", "battery", "load", "grid"]
+
+
+def create_power_flow(grid_charging: bool = True) -> PowerFlow:
+    """Create power flow of a household with PV, battery and peak-pricing grid.
+
+    As in `solara.envs.battery_control.BatteryControlEnv`, no power is sold to the
+    grid, i.e. excess PV generation is curtailed.
+
+    Args:
+        grid_charging (bool, optional): whether the battery can be charged from the
+            grid. Defaults to True.
+
+    Returns:
+        PowerFlow: power flow with connections between components.
+    """
+    power_flow = PowerFlow(COMPONENTS)
+    power_flow.add_connection("solar", "battery")
+    power_flow.add_connection("solar", "load")
+    power_flow.add_connection("battery", "load")
+    power_flow.add_connection("grid", "load")
+    if grid_charging:
+        power_flow.add_connection("grid", "battery")
+    return power_flow
+
+
+class SparseLP:
+    """Linear program of optimal battery control compiled from a power flow."""
+
+    def __init__(
+        self,
+        power_flow: PowerFlow,
+        batteries: List[LithiumIonBattery],
+        grids: List[PeakGrid],
+        num_steps: int = 24,
+    ) -> None:
+        """Linear program of optimal battery control compiled from a power flow.
+
+        The constraint matrices only depend on the topology and the battery and grid
+        parameters, and are assembled once. The load, PV generation and initial
+        battery content only enter the right hand sides of the constraints, which are
+        updated on each call of `solve()`.
+
+        Args:
+            power_flow (PowerFlow): topology of each household, with components
+                "solar", "battery", "load" and "grid".
+            batteries (List[LithiumIonBattery]): battery of each household.
+            grids (List[PeakGrid]): grid of each household.
+            num_steps (int, optional): number of time steps. Defaults to 24.
+        """
+        if sorted(power_flow.components) != sorted(COMPONENTS):
+            raise ValueError(
+                "Power flow must have components {}, got {}.".format(
+                    COMPONENTS, power_flow.components
+                )
+            )
+        if len(batteries) != len(grids):
+            raise ValueError("Need one battery and one grid per household.")
+
+        self.power_flow = power_flow
+        self.batteries = batteries
+        self.grids = grids
+        self.num_steps = num_steps
+        self.num_households = len(batteries)
+        self.logger = logging.getLogger(type(self).__name__)
+
+        self.connections = power_flow.get_connections()
+        if any(target == "solar" for _, target in self.connections):
+            raise ValueError("PV installation can't receive power.")
+        if any(source == "load" for source, _ in self.connections):
+            raise ValueError("Load can't give power.")
+
+        # Variables per household: flows of connections, battery content b(1..T),
+        # grid power above threshold, each with one entry per time step
+        self.num_flows = len(self.connections)
+        self.num_vars = (self.num_flows + 2) * num_steps
+
+        # Components with one entry per household in their parameters
+        self.battery = type(batteries[0]).stack(batteries)
+        self.grid = type(grids[0]).stack(grids)
+
+        self.costs, self.a_ub, self.a_eq = self._assemble()
+
+        lower = np.zeros(self.num_vars)
+        lower[self.get_var_slice("battery_cont")] = -np.inf
+        self.bounds = np.tile(
+            np.stack([lower, np.full(self.num_vars, np.inf)], axis=1),
+            (self.num_households, 1),
+        )
+
+        self.logger.info(
+            "Sparse LP with %s variables and %s constraints assembled.",
+            self.a_ub.shape[1],
+            self.a_ub.shape[0] + self.a_eq.shape[0],
+        )
+
+    def get_var_slice(self, name: str) -> slice:
+        """Get slice of variable block of a household."""
+        num_steps = self.num_steps
+        if name == "battery_cont":
+            start = self.num_flows * num_steps
+        elif name == "power_over_threshold":
+            start = (self.num_flows + 1) * num_steps
+        else:
+            start = self.connections.index(name) * num_steps
+        return slice(start, start + num_steps)
+
+    def _get_flow_sum(self, component: str, direction: str) -> sp.spmatrix:
+        """Get matrix summing flows into ("in") or out of ("out") a component.
+
+        Args:
+            component (str): component name.
+            direction (str): "in" or "out".
+
+        Returns:
+            sp.spmatrix: matrix of shape (num_steps, num_vars).
+        """
+        position = 1 if direction == "in" else 0
+        selection = np.zeros((1, self.num_flows + 2))
+        for i, connection in enumerate(self.connections):
+            if connection[position] == component:
+                selection[0, i] = 1
+        return sp.kron(selection, sp.identity(self.num_steps), format="csr")
+
+    def _get_var(self, name: str) -> sp.spmatrix:
+        """Get matrix selecting battery content or power above threshold."""
+        selection = np.zeros((1, self.num_flows + 2))
+        if name == "battery_cont":
+            selection[0, self.num_flows] = 1
+        else:
+            selection[0, self.num_flows + 1] = 1
+        return sp.kron(selection, sp.identity(self.num_steps), format="csr")
+
+    def _per_household(self, coefs: np.ndarray, matrix: sp.spmatrix) -> sp.spmatrix:
+        """Apply matrix to variables of each household, scaled by its coefficient.
+
+        Args:
+            coefs (np.ndarray): coefficient of each household.
+            matrix (sp.spmatrix): matrix applied to variables of a single household.
+
+        Returns:
+            sp.spmatrix: block-diagonal matrix over all households.
+        """
+        coefs = np.broadcast_to(coefs, self.num_households)
+        return sp.kron(sp.diags(coefs), matrix, format="csr")
+
+    def _assemble(self) -> Tuple[np.ndarray, sp.spmatrix, sp.spmatrix]:
+        """Assemble objective and constraint matrices of all households.
+
+        Each constraint is assembled for all households at once, i.e. the rows of
+        the matrices are ordered by constraint, then household, then time step.
+
+        Returns:
+            Tuple[np.ndarray, sp.spmatrix, sp.spmatrix]: cost vector, inequality
+                and equality constraint matrices.
+        """
+        battery = self.battery
+        grid = self.grid
+        ones = np.ones(self.num_households)
+
+        charge = self._get_flow_sum("battery", "in")
+        discharge = self._get_flow_sum("battery", "out")
+        grid_draw = self._get_flow_sum("grid", "out")
+        content = self._get_var("battery_cont")
+        over_threshold = self._get_var("power_over_threshold")
+        shift = sp.eye(self.num_steps, k=-1, format="csr")
+
+        # Objective: cost of power drawn from grid (power fed into grid is free)
+        costs = (
+            np.outer(grid.base_price, grid_draw.sum(axis=0))
+            + np.outer(grid.peak_price - grid.base_price, over_threshold.sum(axis=0))
+        ) * np.reshape(grid.time_step_len, (-1, 1))
+
+        # Inequality constraints (A_ub x <= b_ub), in order of `get_rhs()`
+        a_ub = sp.vstack(
+            [
+                # PV generation is upper bound of flows from PV (rest is curtailed)
+                self._per_household(ones, self._get_flow_sum("solar", "out")),
+                # Grid power above threshold
+                self._per_household(ones, grid_draw - over_threshold),
+                # Equation (5) of C/L/C model
+                self._per_household(ones, charge),
+                self._per_household(ones, discharge),
+                # Equation (22) of C/L/C model
+                self._per_household(battery.u1 / battery.nominal_voltage_d, discharge)
+                - self._per_household(ones, content),
+                self._per_household(ones, content)
+                - self._per_household(battery.u2 / battery.nominal_voltage_c, charge),
+            ],
+            format="csr",
+        )
+
+        # Equality constraints (A_eq x = b_eq): load is met, battery dynamics
+        # (Equation (19) of C/L/C model, with eta_d being reciprocal efficiency)
+        a_eq = sp.vstack(
+            [
+                self._per_household(ones, self._get_flow_sum("load", "in")),
+                self._per_household(ones, content - shift @ content)
+                - self._per_household(battery.eta_c * battery.time_step_len, charge)
+                + self._per_household(battery.eta_d * battery.time_step_len, discharge),
+            ],
+            format="csr",
+        )
+
+        return costs.ravel(), a_ub, a_eq
+
+    def get_rhs(
+        self,
+        loads: np.ndarray,
+        pv_generations: np.ndarray,
+        initial_contents: np.ndarray = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get right hand sides of inequality and equality constraints.
+
+        Args:
+            loads (np.ndarray): load of each household at each step (kW), of shape
+                (num_households, num_steps).
+            pv_generations (np.ndarray): PV generation of each household at each step
+                (kW), of shape (num_households, num_steps).
+            initial_contents (np.ndarray, optional): battery content of each
+                household at beginning (kWh). Defaults to None, which uses the
+                empty batteries (v1_bar).
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: right hand sides b_ub and b_eq.
+        """
+        num_steps = self.num_steps
+        loads = np.reshape(loads, (self.num_households, -1))[:, :num_steps]
+        pv_generations = np.reshape(pv_generations, (self.num_households, -1))[
+            :, :num_steps
+        ]
+        if initial_contents is None:
+            initial_contents = self.battery.v1_bar
+
+        battery = self.battery
+        steps = np.ones((self.num_households, self.num_steps))
+
+        # Limited to the charging limits of the env, as in `EpisodeProblem`
+        min_charge_power, max_charge_power = battery.get_charging_limits()
+        max_charge = np.minimum(battery.alpha_bar_c, max_charge_power)
+        max_discharge = np.minimum(battery.alpha_bar_d, -min_charge_power)
+
+        b_ub = [
+            pv_generations,
+            steps * np.reshape(self.grid.peak_threshold, (-1, 1)),
+            steps * np.reshape(max_charge, (-1, 1)),
+            steps * np.reshape(max_discharge, (-1, 1)),
+            steps * -np.reshape(battery.v1_bar, (-1, 1)),
+            steps * np.reshape(battery.v2_bar, (-1, 1)),
+        ]
+
+        dynamics = np.zeros((self.num_households, self.num_steps))
+        dynamics[:, 0] = initial_contents
+        b_eq = [loads, dynamics]
+
+        return (
+            np.concatenate([rhs.ravel() for rhs in b_ub]),
+            np.concatenate([rhs.ravel() for rhs in b_eq]),
+        )
+
+    def solve(
+        self,
+        loads: np.ndarray,
+        pv_generations: np.ndarray,
+        initial_contents: np.ndarray = None,
+        **linprog_kwargs,
+    ) -> Dict[str, np.ndarray]:
+        """Solve linear program for given loads and PV generations.
+
+        Args:
+            loads (np.ndarray): load of each household at each step (kW), of shape
+                (num_households, num_steps).
+            pv_generations (np.ndarray): PV generation of each household at each step
+                (kW), of shape (num_households, num_steps).
+            initial_contents (np.ndarray, optional): battery content of each
+                household at beginning (kWh). Defaults to None, which uses the
+                empty batteries (v1_bar).
+            **linprog_kwargs: further keyword arguments passed to
+                `scipy.optimize.linprog`, e.g. options.
+
+        Returns:
+            Dict[str, np.ndarray]: optimal solution with values of shape
+                (num_households, num_steps): battery_cont (after each step),
+                charging_power, net_load (power drawn from grid), cost, and the flow
+                of each connection under key (source, target).
+        """
+        b_ub, b_eq = self.get_rhs(loads, pv_generations, initial_contents)
+
+        result = scipy.optimize.linprog(
+            self.costs,
+            A_ub=self.a_ub,
+            b_ub=b_ub,
+            A_eq=self.a_eq,
+            b_eq=b_eq,
+            bounds=self.bounds,
+            method="highs",
+            **linprog_kwargs,
+        )
+        if result.status != 0:
+            raise ValueError("Sparse LP could not be solved: {}".format(result.message))
+
+        self.logger.debug("Solved sparse LP with cost %s.", result.fun)
+
+        return self.get_solution(result.x)
+
+    def get_solution(self, x: np.ndarray) -> Dict[str, np.ndarray]:
+        """Get solution values from variable vector.
+
+        Args:
+            x (np.ndarray): values of all variables.
+
+        Returns:
+            Dict[str, np.ndarray]: solution, see `solve()`.
+        """
+        num_steps = self.num_steps
+        values = x.reshape(self.num_households, self.num_vars)
+        solution = {
+            connection: values[:, self.get_var_slice(connection)]
+            for connection in self.connections
+        }
+        charging_power = sum(
+            values[:, self.get_var_slice(connection)]
+            for connection in self.connections
+            if connection[1] == "battery"
+        ) - sum(
+            values[:, self.get_var_slice(connection)]
+            for connection in self.connections
+            if connection[0] == "battery"
+        )
+        net_load = sum(
+            values[:, self.get_var_slice(connection)]
+            for connection in self.connections
+            if connection[0] == "grid"
+        )
+        solution["battery_cont"] = values[:, self.get_var_slice("battery_cont")]
+        solution["charging_power"] = charging_power
+        solution["net_load"] = net_load
+        solution["cost"] = np.einsum(
+            "hvt,hvt->ht",
+            self.costs.reshape(self.num_households, self.num_flows + 2, num_steps),
+            values.reshape(self.num_households, self.num_flows + 2, num_steps),
+        )
+
+        return solution
+
+    @classmethod
+    def from_envs(cls, envs: List[BatteryControlEnv]) -> SparseLP:
+        """Create linear program for households of environments.
+
+        Args:
+            envs (List[BatteryControlEnv]): environments with the same episode
+                length and grid charging setting.
+
+        Returns:
+            SparseLP: linear program of all households.
+        """
+        return cls(
+            create_power_flow(grid_charging=envs[0].grid_charging),
+            batteries=[env.battery for env in envs],
+            grids=[env.grid for env in envs],
+            num_steps=envs[0].episode_len,
+        )
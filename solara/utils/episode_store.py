@@ -0,0 +1,413 @@
+"""Module with columnar recording and on-disk storage of episodes.
+
+`EpisodeRecorder` writes the data of each step directly into preallocated arrays
+with one row per episode, and `EpisodeStore` keeps recorded episodes on disk as
+`.npz` shards with a JSON index of the shards and episode metadata (e.g. checkpoint
+and day). Episodes of a store are only read from disk when accessed, and the store
+can be used in place of a list of episode dicts, e.g. with
+`solara.plot.widgets.InteractiveEpisodes`.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterator, List, Union
+import bisect
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+
+class EpisodeStore:
+    """Directory of episode shards with an index of their metadata."""
+
+    index_file_name = "index.json"
+
+    def __init__(self, path: str) -> None:
+        """Directory of episode shards with an index of their metadata.
+
+        Each shard is a `.npz` file with one array per key, of shape
+        (num_episodes, num_steps) for step data and (num_episodes, num_steps + 1) for
+        observations, and the episode lengths. The index (`index.json`) lists the
+        shards and the metadata of each episode.
+
+        Args:
+            path (str): path of store directory, created if it doesn't exist.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.logger = logging.getLogger(type(self).__name__)
+
+        index_path = os.path.join(path, self.index_file_name)
+        if os.path.exists(index_path):
+            with open(index_path, "r") as file:
+                self.index = json.load(file)
+        else:
+            self.index = {"shards": [], "episodes": []}
+
+        self._update_offsets()
+        self._shard_cache = (None, None)
+
+    def _update_offsets(self) -> None:
+        """Compute index of first episode of each shard."""
+        self._offsets = np.cumsum(
+            [0] + [shard["num_episodes"] for shard in self.index["shards"]]
+        ).tolist()
+
+    def __len__(self) -> int:
+        """Get number of episodes in store."""
+        return len(self.index["episodes"])
+
+    def __getitem__(self, idx: int) -> Dict[str, np.ndarray]:
+        """Get episode data, in the format of `solara.utils.episodes.get_episode_dict`.
+
+        Args:
+            idx (int): index of episode.
+
+        Returns:
+            Dict[str, np.ndarray]: episode data.
+        """
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("Episode index out of range.")
+
+        shard_num = bisect.bisect_right(self._offsets, idx) - 1
+        shard = self.index["shards"][shard_num]
+        data = self._load_shard(shard_num)
+        row = idx - self._offsets[shard_num]
+        length = int(data["lengths"][row])
+
+        episode = {}
+        for key in shard["keys"]:
+            end = length + 1 if key in shard["obs_keys"] else length
+            episode[key] = data[key][row, :end]
+        return episode
+
+    def __iter__(self) -> Iterator[Dict[str, np.ndarray]]:
+        """Iterate over episodes in order."""
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def _load_shard(self, shard_num: int) -> Dict[str, np.ndarray]:
+        """Load arrays of shard, keeping the last loaded shard in memory."""
+        if self._shard_cache[0] != shard_num:
+            path = os.path.join(self.path, self.index["shards"][shard_num]["file"])
+            with np.load(path, allow_pickle=False) as shard_file:
+                data = {key: shard_file[key] for key in shard_file.files}
+            self._shard_cache = (shard_num, data)
+        return self._shard_cache[1]
+
+    def get_metadata(self, idx: int) -> Dict:
+        """Get metadata of episode.
+
+        Args:
+            idx (int): index of episode.
+
+        Returns:
+            Dict: metadata given when the episode was recorded.
+        """
+        return self.index["episodes"][idx]
+
+    def find(self, **metadata) -> List[int]:
+        """Get indices of episodes with given metadata values.
+
+        Args:
+            **metadata: metadata values to match, e.g. `day=3`.
+
+        Returns:
+            List[int]: indices of matching episodes.
+        """
+        return [
+            idx
+            for idx, episode in enumerate(self.index["episodes"])
+            if all(episode.get(key) == value for key, value in metadata.items())
+        ]
+
+    def write_shard(
+        self,
+        data: Dict[str, np.ndarray],
+        lengths: np.ndarray,
+        obs_keys: List[str],
+        metadata: List[Dict],
+    ) -> None:
+        """Atomically write episodes as new shard and add them to the index.
+
+        Args:
+            data (Dict[str, np.ndarray]): arrays of each key with one row per episode.
+            lengths (np.ndarray): number of steps of each episode.
+            obs_keys (List[str]): keys with num_steps + 1 entries per episode.
+            metadata (List[Dict]): metadata of each episode, must be JSON
+                serialisable.
+        """
+        file_name = "shard_{:06d}.npz".format(len(self.index["shards"]))
+
+        file_descriptor, tmp_path = tempfile.mkstemp(suffix=".npz", dir=self.path)
+        with os.fdopen(file_descriptor, "wb") as file:
+            np.savez(file, lengths=lengths, **data)
+        os.replace(tmp_path, os.path.join(self.path, file_name))
+
+        self.index["shards"].append(
+            {
+                "file": file_name,
+                "num_episodes": len(lengths),
+                "keys": list(data.keys()),
+                "obs_keys": [key for key in obs_keys if key in data],
+            }
+        )
+        self.index["episodes"].extend(metadata)
+        self.save_index()
+        self._update_offsets()
+
+        self.logger.debug("Wrote shard %s with %s episodes.", file_name, len(lengths))
+
+    def save_index(self) -> None:
+        """Atomically save index to store directory."""
+        file_descriptor, tmp_path = tempfile.mkstemp(suffix=".json", dir=self.path)
+        with os.fdopen(file_descriptor, "w") as file:
+            json.dump(self.index, file)
+        os.replace(tmp_path, os.path.join(self.path, self.index_file_name))
+
+
+class EpisodeRecorder:
+    """Recorder of episodes into preallocated columnar arrays."""
+
+    def __init__(
+        self, num_steps: int, capacity: int = 1024, store: EpisodeStore = None
+    ) -> None:
+        """Recorder of episodes into preallocated columnar arrays.
+
+        Episodes are either recorded step by step (`reset()`, `step()`,
+        `end_episode()`) or added as whole (batches of) episodes with
+        `add_episodes()`. Each key has an array with one row per episode, which is
+        allocated when the key is first recorded. As in
+        `solara.utils.episodes.get_episode_dict`, infos take precedence over
+        observations with the same key.
+
+        If a store is given, the recorded episodes are written to it as a shard
+        whenever `capacity` episodes have been recorded (and on `flush()`).
+        Otherwise, the arrays grow as needed.
+
+        Args:
+            num_steps (int): maximum number of steps of an episode.
+            capacity (int, optional): number of episodes per shard, or initial number
+                of episodes without store. Defaults to 1024.
+            store (EpisodeStore, optional): store to write episodes to. Defaults to
+                None, which keeps episodes in memory.
+        """
+        self.num_steps = num_steps
+        self.capacity = capacity
+        self.store = store
+        self.logger = logging.getLogger(type(self).__name__)
+        self._clear()
+
+    def _clear(self) -> None:
+        """Remove all recorded episodes."""
+        self.num_episodes = 0
+        self.metadata = []
+        self._obs = {}
+        self._steps = {}
+        self.lengths = np.zeros(self.capacity, dtype=int)
+        self._step = None
+
+    def _get_buffer(
+        self, buffers: Dict[str, np.ndarray], key: str, value: np.ndarray, length: int
+    ) -> np.ndarray:
+        """Get array of key, allocating it on first use.
+
+        The value is that of a single step, with the episodes along the first axis.
+        """
+        if key not in buffers:
+            buffers[key] = np.full(
+                (len(self.lengths), length) + value.shape[1:], np.nan
+            )
+        return buffers[key]
+
+    def _ensure_capacity(self, num_new: int) -> None:
+        """Flush or grow arrays such that num_new episodes can be added."""
+        required = self.num_episodes + num_new
+        if required <= len(self.lengths):
+            return
+        if self.store is not None and self.num_episodes > 0:
+            self.flush()
+            if num_new <= len(self.lengths):
+                return
+            required = num_new
+
+        size = max(required, 2 * len(self.lengths))
+        for buffers in [self._obs, self._steps]:
+            for key, buffer in buffers.items():
+                grown = np.full((size,) + buffer.shape[1:], np.nan)
+                grown[: len(buffer)] = buffer
+                buffers[key] = grown
+        lengths = np.zeros(size, dtype=int)
+        lengths[: len(self.lengths)] = self.lengths
+        self.lengths = lengths
+
+    @staticmethod
+    def _as_column(value: object) -> np.ndarray:
+        """Convert value of one step to array of shape (1,) or (1, size)."""
+        value = np.asarray(value, dtype=float)
+        if value.size == 1:
+            return value.reshape(1)
+        return value.reshape(1, -1)
+
+    def reset(self, obs: Union[Dict, np.ndarray]) -> None:
+        """Start recording a new episode.
+
+        Args:
+            obs (Union[Dict, np.ndarray]): initial observation, flat observations are
+                recorded with key "obs".
+        """
+        self._ensure_capacity(1)
+        self._step = 0
+        self._record_obs(obs)
+
+    def _record_obs(self, obs: Union[Dict, np.ndarray]) -> None:
+        """Write observation into arrays of current episode."""
+        if not isinstance(obs, dict):
+            obs = {"obs": obs}
+        for key, value in obs.items():
+            value = self._as_column(value)
+            buffer = self._get_buffer(self._obs, key, value, self.num_steps + 1)
+            buffer[self.num_episodes, self._step] = value[0]
+
+    def step(
+        self,
+        obs: Union[Dict, np.ndarray],
+        action: object,
+        reward: float,
+        info: Dict,
+    ) -> None:
+        """Record a step of the current episode.
+
+        Args:
+            obs (Union[Dict, np.ndarray]): observation after the step.
+            action (object): action of the step.
+            reward (float): reward of the step.
+            info (Dict): info of the step.
+        """
+        if self._step is None:
+            raise ValueError("Recorder must be reset before recording steps.")
+
+        row = self.num_episodes
+        for key, value in [("actions", action), ("rewards", reward), *info.items()]:
+            value = self._as_column(value)
+            buffer = self._get_buffer(self._steps, key, value, self.num_steps)
+            buffer[row, self._step] = value[0]
+
+        self._step += 1
+        self._record_obs(obs)
+
+    def end_episode(self, **metadata) -> None:
+        """Finish recording the current episode.
+
+        Args:
+            **metadata: metadata of episode, e.g. checkpoint and day. Must be JSON
+                serialisable to be written to a store.
+        """
+        self.lengths[self.num_episodes] = self._step
+        self.metadata.append(metadata)
+        self.num_episodes += 1
+        self._step = None
+
+        if self.store is not None and self.num_episodes == len(self.lengths):
+            self.flush()
+
+    def add_episodes(
+        self,
+        episodes: Union[Dict[str, np.ndarray], List[Dict]],
+        metadata: List[Dict] = None,
+        obs_keys: List[str] = None,
+    ) -> None:
+        """Add whole episodes.
+
+        Args:
+            episodes (Union[Dict[str, np.ndarray], List[Dict]]): either dict of arrays
+                with one row per episode, or list of episode dicts (e.g. from
+                `solara.utils.episodes.get_episode_dict`).
+            metadata (List[Dict], optional): metadata of each episode. Defaults to
+                None.
+            obs_keys (List[str], optional): keys with num_steps + 1 entries. Defaults
+                to None, which infers them from the length of the actions.
+        """
+        if not isinstance(episodes, dict):
+            episodes = {
+                key: np.stack([np.asarray(episode[key]) for episode in episodes])
+                for key in episodes[0].keys()
+            }
+        num_new = len(episodes["actions"])
+        length = np.shape(episodes["actions"])[1]
+        if obs_keys is None:
+            obs_keys = [
+                key for key, value in episodes.items() if np.shape(value)[1] > length
+            ]
+        if metadata is None:
+            metadata = [{} for _ in range(num_new)]
+
+        self._ensure_capacity(num_new)
+        rows = slice(self.num_episodes, self.num_episodes + num_new)
+        for key, value in episodes.items():
+            value = np.asarray(value, dtype=float)
+            if key in obs_keys:
+                buffer = self._get_buffer(
+                    self._obs, key, value[:, 0], self.num_steps + 1
+                )
+                buffer[rows, : length + 1] = value
+            else:
+                buffer = self._get_buffer(self._steps, key, value[:, 0], self.num_steps)
+                buffer[rows, :length] = value
+
+        self.lengths[rows] = length
+        self.metadata.extend(metadata)
+        self.num_episodes += num_new
+
+        if self.store is not None and self.num_episodes >= self.capacity:
+            self.flush()
+
+    def get_data(self) -> Dict[str, np.ndarray]:
+        """Get arrays of recorded episodes (views, with one row per episode).
+
+        Returns:
+            Dict[str, np.ndarray]: array of each key.
+        """
+        num_episodes = self.num_episodes
+        data = {key: value[:num_episodes] for key, value in self._obs.items()}
+        data.update({key: value[:num_episodes] for key, value in self._steps.items()})
+        return data
+
+    def get_episodes(self) -> List[Dict[str, np.ndarray]]:
+        """Get recorded episodes (not yet flushed to store) as episode dicts.
+
+        Returns:
+            List[Dict[str, np.ndarray]]: episode data in the format of
+                `solara.utils.episodes.get_episode_dict`.
+        """
+        episodes = []
+        for row in range(self.num_episodes):
+            length = self.lengths[row]
+            episode = {
+                key: value[row, : length + 1] for key, value in self._obs.items()
+            }
+            episode.update(
+                {key: value[row, :length] for key, value in self._steps.items()}
+            )
+            episodes.append(episode)
+        return episodes
+
+    def flush(self) -> None:
+        """Write recorded episodes to store and clear the recorder."""
+        if self.store is None:
+            raise ValueError("Recorder has no store to flush to.")
+        if self.num_episodes == 0:
+            return
+
+        self.store.write_shard(
+            self.get_data(),
+            self.lengths[: self.num_episodes].copy(),
+            obs_keys=[key for key in self._obs if key not in self._steps],
+            metadata=self.metadata,
+        )
+        self._clear()
@@ -0,0 +1,321 @@
+"""Module with functions running episodes of agents in environments.
+
+The functions only require the agent to have an `env_creator()` method, a `config`
+with "env_config", and a `compute_action()` (or batched `compute_actions()`) method.
+They do not import Ray, such that agents without Ray (e.g.
+`solara.utils.numpy_policy.NumpyPolicy` or `DeterministicAgent`) can be evaluated in
+processes where Ray is not installed. RLlib trainers are supported as well, and are
+re-exported from `solara.utils.rllib` together with these functions.
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Tuple, List, Dict, Union
+import sys
+
+import numpy as np
+
+from solara.envs.batched_battery_control import BatchedBatteryControlEnv
+from solara.utils.episode_store import EpisodeRecorder
+
+if TYPE_CHECKING:
+    import gym
+    import ray.rllib
+
+
+def run_episode(
+    agent: ray.rllib.agents.trainer.Trainer, explore: bool = False
+) -> Tuple:
+    """Run an episode with an agent.
+
+    This function runs an episode with an agent in the environment given by its
+    `env_creator()` method. The observations and infos of environments in fast mode,
+    which are overwritten by the next step, are copied.
+
+    Args:
+        agent (ray.rllib.agents.trainer.Trainer): agent to be used for episode.
+        explore (bool): whether the agent should use exploration policy. Defaults to
+            False.
+
+    Returns:
+        Tuple: observations, actions, rewards, info
+    """
+
+    done = False
+    actions = []
+    observations = []
+    rewards = []
+    infos = []
+
+    env = agent.env_creator(agent.config["env_config"])
+
+    # In fast mode, the env reuses its observation buffers and info dict every step
+    copy = getattr(env, "fast_mode", False)
+
+    obs = env.reset()
+    observations.append(_copy_obs(obs) if copy else obs)
+
+    # Running episode
+    while not done:
+        action = agent.compute_action(obs, explore=explore)
+        obs, reward, done, info = env.step(action)
+        actions.append(float(action))
+        observations.append(_copy_obs(obs) if copy else obs)
+        rewards.append(reward)
+        infos.append(dict(info) if copy else info)
+
+    return (observations, np.array(actions), np.array(rewards), infos)
+
+
+def _copy_obs(
+    obs: Union[Dict[str, np.ndarray], np.ndarray]
+) -> Union[Dict[str, np.ndarray], np.ndarray]:
+    """Copy (dict or flat) observation, e.g. before the env overwrites it."""
+    if isinstance(obs, dict):
+        return {key: np.copy(value) for key, value in obs.items()}
+    return np.copy(obs)
+
+
+def compute_actions(
+    agent: ray.rllib.agents.trainer.Trainer,
+    observations: Union[Dict[str, np.ndarray], np.ndarray],
+    explore: bool = False,
+) -> np.ndarray:
+    """Compute actions for a batch of observations with a single policy call.
+
+    For RLlib trainers, the observations are preprocessed and filtered like in
+    `Trainer.compute_action()`, and the actions are unsquashed or clipped according
+    to the trainer config. Other agents are used via their `compute_actions()`
+    method if they have one, and otherwise via `compute_action()` per observation.
+
+    Args:
+        agent (ray.rllib.agents.trainer.Trainer): agent computing the actions.
+        observations (Union[Dict[str, np.ndarray], np.ndarray]): batch of
+            observations as returned by `BatchedBatteryControlEnv`, i.e. a dict with
+            the batch along the first axis of each entry or an array of flat
+            observations.
+        explore (bool): whether the agent should use exploration policy. Defaults to
+            False.
+
+    Returns:
+        np.ndarray: actions, of shape (batch_size, 1).
+    """
+    if isinstance(observations, dict):
+        batch_size = len(next(iter(observations.values())))
+        obs_list = [
+            {key: value[i] for key, value in observations.items()}
+            for i in range(batch_size)
+        ]
+    else:
+        batch_size = len(observations)
+        obs_list = list(observations)
+
+    trainer_module = sys.modules.get("ray.rllib.agents.trainer")
+    if trainer_module is not None and isinstance(agent, trainer_module.Trainer):
+        # Imported here such that Ray is only required for RLlib trainers
+        from solara.utils.rllib import (  # pylint: disable=import-outside-toplevel
+            compute_trainer_actions,
+        )
+
+        actions = compute_trainer_actions(agent, obs_list, explore=explore)
+    elif hasattr(agent, "compute_actions"):
+        actions = agent.compute_actions(observations, explore=explore)
+    else:
+        actions = [agent.compute_action(obs, explore=explore) for obs in obs_list]
+
+    return np.asarray(actions, dtype=np.float32).reshape(batch_size, 1)
+
+
+def run_episodes_batched(
+    agent: ray.rllib.agents.trainer.Trainer,
+    days: List[int] = None,
+    explore: bool = False,
+    recorder: EpisodeRecorder = None,
+    metadata: Dict = None,
+) -> List[Dict]:
+    """Run episodes of many days in lockstep, with one policy call per step.
+
+    The episodes are simulated with a `BatchedBatteryControlEnv` over the
+    environment given by the agent's `env_creator()` method, and the actions of all
+    episodes are computed at once with `compute_actions()`. The result is the same as
+    running each day with `run_episode()` and converting it with
+    `get_episode_dict()`, but much faster for many days.
+
+    Args:
+        agent (ray.rllib.agents.trainer.Trainer): agent to be used for episodes.
+        days (List[int], optional): days of the traces to run episodes for, even if
+            the environment's data has a fixed start. Defaults to None, which runs
+            all days that the environment samples from.
+        explore (bool): whether the agent should use exploration policy. Defaults to
+            False.
+        recorder (EpisodeRecorder, optional): recorder to add the episodes to, with
+            the day, time step length and the given metadata. Defaults to None.
+        metadata (Dict, optional): further metadata of the episodes for the recorder.
+            Defaults to None.
+
+    Returns:
+        List[Dict]: list of dictionaries, each with data from one episode (in order of
+            days) in the format of `get_episode_dict()`.
+    """
+    env = agent.env_creator(agent.config["env_config"])
+    if days is None:
+        days = range(env.day_sampler.num_days)
+    days = list(days)
+
+    # The days override a fixed start of the data (e.g. "fixed_sample_num" in the
+    # env config), which is restored once the episodes are reset
+    fixed_starts = env.load.fixed_start, env.solar.fixed_start
+    env.load.fixed_start, env.solar.fixed_start = None, None
+    try:
+        batched_env = BatchedBatteryControlEnv([env] * len(days))
+        obs = batched_env.reset(days=days)
+    finally:
+        env.load.fixed_start, env.solar.fixed_start = fixed_starts
+
+    obs_keys = batched_env.obs_keys
+    num_steps = batched_env.episode_len
+    observations = {key: np.empty((len(days), num_steps + 1)) for key in obs_keys}
+    for key in obs_keys:
+        observations[key][:, 0] = batched_env.state[key]
+
+    actions = np.empty((len(days), num_steps))
+    rewards = np.empty((len(days), num_steps))
+    infos = {}
+
+    # Running episodes
+    for step in range(num_steps):
+        action = compute_actions(agent, obs, explore=explore)
+        obs, reward, _, info = batched_env.step(action)
+        actions[:, step] = action[:, 0]
+        rewards[:, step] = reward
+        for key in obs_keys:
+            observations[key][:, step + 1] = batched_env.state[key]
+        for key, value in info.items():
+            if key not in infos:
+                infos[key] = np.empty((len(days), num_steps))
+            infos[key][:, step] = value
+
+    episode_data = {**observations, **infos, "rewards": rewards, "actions": actions}
+
+    if recorder is not None:
+        recorder.add_episodes(
+            episode_data,
+            metadata=[
+                {
+                    **(metadata or {}),
+                    "day": int(day),
+                    "time_step_len": env.time_step_len,
+                }
+                for day in days
+            ],
+            obs_keys=[key for key in obs_keys if key not in infos],
+        )
+
+    return [
+        {key: value[i] for key, value in episode_data.items()} for i in range(len(days))
+    ]
+
+
+def concat_dict_data(dicts: List[Dict]) -> Dict[str, np.array]:
+    """Concatenate list of dicts into dict of np.arrays.
+
+    Each dictionary in list must have the same keys. For example, input
+    `[{'a':1},{'a':2}]` is returned as `{'a': np.array([1,2])}`.
+
+    Args:
+        dicts (List[Dict]): list of dicts to be combined
+
+    Returns:
+        Dict[str, np.array]: dictionary with np.array values
+    """
+    concat_dict = {}
+    for key in dicts[0].keys():
+        concat_dict[key] = np.empty(len(dicts))
+
+    for i, dictionary in enumerate(dicts):
+        for key, value in dictionary.items():
+            concat_dict[key][i] = value
+
+    return concat_dict
+
+
+def get_episode_dict(
+    observations: List[Dict],
+    actions: List,
+    rewards: List,
+    infos,
+) -> Dict:
+    """Get dictionary form of episode data.
+
+    The return can be used for plotting an episode, and defines what is plotted
+    for other functions.
+
+    Args:
+        observations (List): list of observations (of type gym.spaces.Dict)
+        actions (List): list of actions
+        rewards (List): list of rewards
+        infos ([type]): list of infos
+
+    Returns:
+        Dict: dictionary used for plotting.
+    """
+
+    obs_dict = concat_dict_data(observations)
+    info_dict = concat_dict_data(infos)
+
+    episode_dict = {**obs_dict, **info_dict}
+
+    episode_dict["rewards"] = rewards
+    episode_dict["actions"] = actions
+
+    return episode_dict
+
+
+class DeterministicAgent:
+    """Deterministic Agent."""
+
+    def __init__(self, actions: List, env: gym.Env) -> None:
+        """Deterministic Agent.
+
+        Args:
+            actions (List): list of actions the agent takes
+            env (gym.Env): environment of the agent
+        """
+        self.actions = actions
+        self.env = env
+        self.step = 0
+        self.config = {"env_config": None}
+
+    def compute_action(
+        self, obs: object, explore: bool = False
+    ):  # pylint: disable=unused-argument
+        """Get action.
+
+        Args:
+            obs (object): observations
+            explore (bool, optional): Whether to explore, has no effect.
+                Defaults to False.
+
+        Returns:
+            np.array: action taken by agent
+        """
+
+        action = self.actions[self.step]
+        self.step += 1
+        return action
+
+    def env_creator(
+        self, env_config: dict = None
+    ) -> gym.Env:  # pylint: disable=unused-argument
+        return self.env
+
+    def rollout(self) -> Dict:
+        """Run the agent's full action sequence in a single environment rollout.
+
+        This is equivalent to, but much faster than, running an episode with
+        `run_episode()` and converting it with `get_episode_dict()`.
+
+        Returns:
+            Dict: episode data in the format of `get_episode_dict()`.
+        """
+        self.env.reset()
+        return self.env.rollout(np.array(self.actions, dtype=np.float64).ravel())
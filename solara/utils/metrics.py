@@ -0,0 +1,162 @@
+"""Module with streaming accumulators of episode metrics.
+
+The accumulators keep a fixed amount of state, independent of the number of values
+added, such that metrics of long episodes can be computed without retaining the
+values of each step.
+"""
+
+from typing import Dict, List
+import math
+
+
+class P2Quantile:
+    """Streaming estimate of a quantile with the P² algorithm."""
+
+    def __init__(self, quantile: float) -> None:
+        """Streaming estimate of a quantile with the P² algorithm.
+
+        The estimate is kept with five markers, whose heights are adjusted with
+        piecewise-parabolic interpolation as values are added. See Jain and
+        Chlamtac, The P² algorithm for dynamic calculation of quantiles and
+        histograms without storing observations, 1985.
+
+        Args:
+            quantile (float): quantile to estimate, between 0 and 1.
+        """
+        self.quantile = quantile
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * quantile, 4 * quantile, 2 + 2 * quantile, 4]
+        self.increments = [0, quantile / 2, quantile, (1 + quantile) / 2, 1]
+
+    def update(self, value: float) -> None:
+        """Add value.
+
+        Args:
+            value (float): value to add.
+        """
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+
+        positions = self.positions
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Adjust heights of middle markers if they are off their desired position
+        for i in range(1, 4):
+            offset = self.desired[i] - positions[i]
+            if (offset >= 1 and positions[i + 1] - positions[i] > 1) or (
+                offset <= -1 and positions[i - 1] - positions[i] < -1
+            ):
+                step = int(math.copysign(1, offset))
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + step * (heights[i + step] - heights[i]) / (
+                        positions[i + step] - positions[i]
+                    )
+                heights[i] = height
+                positions[i] += step
+
+    def _parabolic(self, i: int, step: int) -> float:
+        """Get piecewise-parabolic prediction of height of marker i moved by step."""
+        heights = self.heights
+        positions = self.positions
+        return heights[i] + step / (positions[i + 1] - positions[i - 1]) * (
+            (positions[i] - positions[i - 1] + step)
+            * (heights[i + 1] - heights[i])
+            / (positions[i + 1] - positions[i])
+            + (positions[i + 1] - positions[i] - step)
+            * (heights[i] - heights[i - 1])
+            / (positions[i] - positions[i - 1])
+        )
+
+    def get(self) -> float:
+        """Get quantile estimate, exact for fewer than six values (NaN if empty)."""
+        heights = self.heights
+        if not heights:
+            return math.nan
+        if len(heights) < 5 or self.positions[4] == 4:
+            # Linear interpolation between sorted values, as np.quantile
+            index = self.quantile * (len(heights) - 1)
+            lower = int(math.floor(index))
+            upper = min(lower + 1, len(heights) - 1)
+            return heights[lower] + (index - lower) * (heights[upper] - heights[lower])
+        return heights[2]
+
+
+class StreamingStats:
+    """Streaming aggregation of values, e.g. of one info key over an episode."""
+
+    def __init__(self, aggregations: List[str] = None) -> None:
+        """Streaming aggregation of values, e.g. of one info key over an episode.
+
+        Args:
+            aggregations (List[str], optional): aggregations to compute, any of
+                "sum", "mean", "min", "max", "count", "abs_sum", and "qXX" for the XX-th
+                percentile (e.g. "q50" or "q95", estimated with `P2Quantile`).
+                Defaults to None, which computes the sum.
+        """
+        if aggregations is None:
+            aggregations = ["sum"]
+
+        self.aggregations = list(aggregations)
+        self.count = 0
+        self.sum = 0.0
+        self.abs_sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.quantiles = {}
+
+        for aggregation in self.aggregations:
+            if aggregation.startswith("q"):
+                self.quantiles[aggregation] = P2Quantile(float(aggregation[1:]) / 100)
+            elif aggregation not in ["sum", "mean", "min", "max", "count", "abs_sum"]:
+                raise ValueError("Unknown aggregation '{}'.".format(aggregation))
+
+    def update(self, value: float) -> None:
+        """Add value.
+
+        Args:
+            value (float): value to add.
+        """
+        self.count += 1
+        self.sum += value
+        self.abs_sum += abs(value)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        for quantile in self.quantiles.values():
+            quantile.update(value)
+
+    def get(self) -> Dict[str, float]:
+        """Get value of each aggregation.
+
+        Returns:
+            Dict[str, float]: aggregated value by aggregation name.
+        """
+        results = {}
+        for aggregation in self.aggregations:
+            if aggregation in self.quantiles:
+                results[aggregation] = self.quantiles[aggregation].get()
+            elif aggregation == "mean":
+                results[aggregation] = self.sum / self.count if self.count else math.nan
+            else:
+                results[aggregation] = getattr(self, aggregation)
+        return results
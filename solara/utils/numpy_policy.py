@@ -0,0 +1,307 @@
+"""Module with Ray-free export and inference of trained policies.
+
+A policy of an RLlib trainer with the default fully connected model can be exported
+with `export_policy()` to a `.npz` file holding the network weights, the observation
+preprocessing (flattening and one-hot encoding as done by RLlib's
+`DictFlatteningPreprocessor`, and the `MeanStdFilter` statistics) and the action
+postprocessing. `NumpyPolicy` loads such a file and computes actions with NumPy only,
+so that policies can be evaluated in processes that never import Ray.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, Tuple, Union
+import json
+import logging
+import re
+
+import gym
+import numpy as np
+
+from solara.envs.creator import create_env
+
+if TYPE_CHECKING:
+    import ray.rllib
+
+ACTIVATIONS = {
+    "tanh": np.tanh,
+    "relu": lambda x: np.maximum(x, 0),
+    "elu": lambda x: np.where(x > 0, x, np.expm1(np.minimum(x, 0))),
+    "swish": lambda x: x / (1 + np.exp(-x)),
+    "linear": lambda x: x,
+    None: lambda x: x,
+}
+
+# Names of weights of RLlib's fully connected networks (torch and tf)
+TORCH_HIDDEN = re.compile(r"_hidden_layers\.(\d+)\._model\.0\.(weight|bias)$")
+TORCH_LOGITS = re.compile(r"_logits\._model\.0\.(weight|bias)$")
+TF_HIDDEN = re.compile(r"(?:^|/)fc_(\d+)/(kernel|bias)")
+TF_LOGITS = re.compile(r"(?:^|/)fc_out/(kernel|bias)")
+
+logger = logging.getLogger(__name__)
+
+
+def get_obs_spec(observation_space: gym.spaces.Space) -> List[Dict]:
+    """Get flattening spec of observation space, in the order used by RLlib.
+
+    Args:
+        observation_space (gym.spaces.Space): Dict, Box or Discrete observation space.
+
+    Returns:
+        List[Dict]: key (None for non-dict spaces), type ("box" or "discrete") and
+            size of each flattened entry.
+    """
+    if isinstance(observation_space, gym.spaces.Dict):
+        items = list(observation_space.spaces.items())
+    else:
+        items = [(None, observation_space)]
+
+    spec = []
+    for key, space in items:
+        if isinstance(space, gym.spaces.Discrete):
+            spec.append({"key": key, "type": "discrete", "size": int(space.n)})
+        elif isinstance(space, gym.spaces.Box):
+            spec.append({"key": key, "type": "box", "size": int(np.prod(space.shape))})
+        else:
+            raise ValueError("Unsupported observation space {}.".format(space))
+    return spec
+
+
+def _get_layers(weights: Dict[str, np.ndarray]) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Get (kernel, bias) of each layer of policy network from RLlib weights.
+
+    Kernels are returned with shape (num_inputs, num_outputs).
+    """
+    hidden = {}
+    logits = {}
+    for name, value in weights.items():
+        value = np.asarray(value)
+        for pattern, transpose in [(TORCH_HIDDEN, True), (TF_HIDDEN, False)]:
+            match = pattern.search(name)
+            if match:
+                layer = hidden.setdefault(int(match.group(1)), {})
+                kind = "bias" if match.group(2) == "bias" else "kernel"
+                layer[kind] = value.T if transpose and kind == "kernel" else value
+        for pattern, transpose in [(TORCH_LOGITS, True), (TF_LOGITS, False)]:
+            match = pattern.search(name)
+            if match:
+                kind = "bias" if match.group(1) == "bias" else "kernel"
+                logits[kind] = value.T if transpose and kind == "kernel" else value
+
+    if set(logits) != {"kernel", "bias"}:
+        raise ValueError(
+            "Policy weights are not those of RLlib's fully connected network."
+        )
+
+    # Torch hidden layers are numbered from 0, tf layers from 1
+    layers = [(hidden[i]["kernel"], hidden[i]["bias"]) for i in sorted(hidden)]
+    layers.append((logits["kernel"], logits["bias"]))
+    return layers
+
+
+def export_policy(
+    agent: ray.rllib.agents.trainer.Trainer,
+    path: str,
+    checkpoint: str = None,
+    policy_id: str = "default_policy",
+) -> None:
+    """Export policy of RLlib trainer to `.npz` file for use with `NumpyPolicy`.
+
+    Only the default fully connected model (`fcnet_hiddens` and `fcnet_activation`)
+    without recurrent or attention wrappers is supported.
+
+    Args:
+        agent (ray.rllib.agents.trainer.Trainer): trainer of policy.
+        path (str): path of `.npz` file to write.
+        checkpoint (str, optional): checkpoint to restore the trainer from before
+            exporting. Defaults to None, which exports the trainer's current policy.
+        policy_id (str, optional): policy to export. Defaults to "default_policy".
+    """
+    if checkpoint is not None:
+        agent.restore(checkpoint)
+
+    config = agent.config
+    env = agent.env_creator(config["env_config"])
+    action_space = env.action_space
+
+    spec = {
+        "obs": get_obs_spec(env.observation_space),
+        "activation": config.get("model", {}).get("fcnet_activation", "tanh"),
+        "action_dim": int(np.prod(action_space.shape)),
+        "normalize_actions": bool(config.get("normalize_actions", False)),
+        "clip_actions": bool(config.get("clip_actions", False)),
+        "filter": None,
+        "env_config": None,
+    }
+
+    try:
+        spec["env_config"] = json.loads(json.dumps(config["env_config"]))
+    except TypeError:
+        logger.warning("Env config is not JSON serialisable and is not exported.")
+
+    arrays = {
+        "action_low": np.asarray(action_space.low, dtype=np.float64),
+        "action_high": np.asarray(action_space.high, dtype=np.float64),
+    }
+
+    obs_filter = agent.workers.local_worker().filters[policy_id]
+    filter_type = type(obs_filter).__name__
+    if filter_type in ["MeanStdFilter", "ConcurrentMeanStdFilter"]:
+        spec["filter"] = {
+            "demean": bool(obs_filter.demean),
+            "destd": bool(obs_filter.destd),
+            "clip": None if obs_filter.clip is None else float(obs_filter.clip),
+        }
+        arrays["filter_mean"] = np.asarray(obs_filter.rs.mean, dtype=np.float64)
+        arrays["filter_std"] = np.asarray(obs_filter.rs.std, dtype=np.float64)
+    elif filter_type != "NoFilter":
+        raise ValueError("Unsupported observation filter {}.".format(filter_type))
+
+    layers = _get_layers(agent.get_policy(policy_id).get_weights())
+    for i, (kernel, bias) in enumerate(layers):
+        arrays["kernel_{}".format(i)] = np.asarray(kernel, dtype=np.float32)
+        arrays["bias_{}".format(i)] = np.asarray(bias, dtype=np.float32)
+    spec["num_layers"] = len(layers)
+
+    np.savez(path, spec=np.array(json.dumps(spec)), **arrays)
+
+
+class NumpyPolicy:
+    """Policy exported with `export_policy()`, evaluated with NumPy only."""
+
+    def __init__(self, path: str, env: gym.Env = None, seed: int = None) -> None:
+        """Policy exported with `export_policy()`, evaluated with NumPy only.
+
+        Like `solara.utils.episodes.DeterministicAgent`, the policy can be used with
+        `solara.utils.episodes.run_episode()`, and its `compute_actions()` method with
+        `solara.utils.episodes.run_episodes_batched()`. Neither these functions nor
+        the policy import Ray.
+
+        Args:
+            path (str): path of `.npz` file written by `export_policy()`.
+            env (gym.Env, optional): environment of the policy. Defaults to None,
+                which creates the environment from the exported env config (or the
+                default config if it was not exported) when needed.
+            seed (int, optional): seed of the random number generator used for
+                exploration. Defaults to None.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            self.spec = json.loads(str(data["spec"]))
+            arrays = {key: data[key] for key in data.files if key != "spec"}
+
+        self.layers = [
+            (arrays["kernel_{}".format(i)], arrays["bias_{}".format(i)])
+            for i in range(self.spec["num_layers"])
+        ]
+        self.activation = ACTIVATIONS[self.spec["activation"]]
+        self.action_low = arrays["action_low"]
+        self.action_high = arrays["action_high"]
+        self.filter_mean = arrays.get("filter_mean")
+        self.filter_std = arrays.get("filter_std")
+
+        self.env = env
+        self.config = {"env_config": self.spec["env_config"]}
+        self.rng = np.random.default_rng(seed)
+
+    def preprocess(
+        self, observations: Union[Dict[str, np.ndarray], np.ndarray]
+    ) -> np.ndarray:
+        """Flatten and filter a batch of observations like RLlib.
+
+        Args:
+            observations (Union[Dict[str, np.ndarray], np.ndarray]): batch of
+                observations, i.e. a dict with the batch along the first axis of each
+                entry or an array of flat observations.
+
+        Returns:
+            np.ndarray: network inputs, of shape (batch_size, num_inputs).
+        """
+        parts = []
+        for entry in self.spec["obs"]:
+            value = observations if entry["key"] is None else observations[entry["key"]]
+            value = np.asarray(value)
+            if entry["type"] == "discrete":
+                value = value.reshape(-1).astype(int)
+                one_hot = np.zeros((len(value), entry["size"]), dtype=np.float32)
+                one_hot[np.arange(len(value)), value] = 1
+                parts.append(one_hot)
+            else:
+                parts.append(value.reshape(-1, entry["size"]).astype(np.float32))
+        inputs = np.concatenate(parts, axis=1)
+
+        obs_filter = self.spec["filter"]
+        if obs_filter is not None:
+            if obs_filter["demean"]:
+                inputs = inputs - self.filter_mean
+            if obs_filter["destd"]:
+                inputs = inputs / (self.filter_std + 1e-8)
+            if obs_filter["clip"] is not None:
+                inputs = np.clip(inputs, -obs_filter["clip"], obs_filter["clip"])
+
+        return inputs
+
+    def compute_actions(
+        self,
+        observations: Union[Dict[str, np.ndarray], np.ndarray],
+        explore: bool = False,
+    ) -> np.ndarray:
+        """Get actions for a batch of observations.
+
+        Args:
+            observations (Union[Dict[str, np.ndarray], np.ndarray]): batch of
+                observations, see `preprocess()`.
+            explore (bool, optional): Whether to sample actions from the Gaussian
+                action distribution instead of taking its mean. Defaults to False.
+
+        Returns:
+            np.ndarray: actions, of shape (batch_size, action_dim).
+        """
+        outputs = self.preprocess(observations)
+        for i, (kernel, bias) in enumerate(self.layers):
+            outputs = outputs @ kernel + bias
+            if i < len(self.layers) - 1:
+                outputs = self.activation(outputs)
+
+        action_dim = self.spec["action_dim"]
+        actions = outputs[:, :action_dim]
+        if explore and outputs.shape[1] == 2 * action_dim:
+            log_std = outputs[:, action_dim:]
+            actions = actions + np.exp(log_std) * self.rng.standard_normal(
+                actions.shape
+            )
+
+        if self.spec["normalize_actions"]:
+            actions = (
+                self.action_low
+                + (actions + 1) * (self.action_high - self.action_low) / 2
+            )
+            actions = np.clip(actions, self.action_low, self.action_high)
+        elif self.spec["clip_actions"]:
+            actions = np.clip(actions, self.action_low, self.action_high)
+
+        return actions.astype(np.float32)
+
+    def compute_action(
+        self, obs: Union[Dict[str, np.ndarray], np.ndarray], explore: bool = False
+    ) -> np.ndarray:
+        """Get action for a single observation.
+
+        Args:
+            obs (Union[Dict[str, np.ndarray], np.ndarray]): observation.
+            explore (bool, optional): Whether to explore, see `compute_actions()`.
+                Defaults to False.
+
+        Returns:
+            np.array: action taken by agent
+        """
+        if isinstance(obs, dict):
+            batch = {key: np.asarray(value)[np.newaxis] for key, value in obs.items()}
+        else:
+            batch = np.asarray(obs)[np.newaxis]
+        return self.compute_actions(batch, explore=explore)[0]
+
+    def env_creator(self, env_config: dict = None) -> gym.Env:
+        """Get environment of policy, creating it from config if not given."""
+        if self.env is None:
+            self.env = create_env(env_config)
+        return self.env
@@ -3,60 +3,79 @@ from __future__ import annotations
 
 # Above enables using TYPE_CHECKING without using quotes around annotation
 
-from typing import TYPE_CHECKING, Tuple, List, Dict, Union
+from typing import List, Dict, Iterator, Union
 
 import numpy as np
 import glob
+import threading
+import ray
 import ray.rllib
+from ray.rllib.utils.spaces.space_utils import clip_action, unsquash_action
+
+from solara.envs.vector import (  # noqa: F401 pylint: disable=unused-import
+    RLlibVectorEnv,
+)
+from solara.utils.episode_store import EpisodeRecorder, EpisodeStore
+
+# Ray-free episode functions, re-exported for existing users of this module
+from solara.utils.episodes import (  # noqa: F401 pylint: disable=unused-import
+    DeterministicAgent,
+    compute_actions,
+    concat_dict_data,
+    get_episode_dict,
+    run_episode,
+    run_episodes_batched,
+)
+from solara.utils.metrics import StreamingStats
+
+
+def compute_trainer_actions(
+    agent: ray.rllib.agents.trainer.Trainer,
+    obs_list: List[Union[Dict[str, np.ndarray], np.ndarray]],
+    explore: bool = False,
+) -> np.ndarray:
+    """Compute actions of RLlib trainer for observations with a single policy call.
 
-if TYPE_CHECKING:
-    import gym
-
-
-def run_episode(
-    agent: ray.rllib.agents.trainer.Trainer, explore: bool = False
-) -> Tuple:
-    """Run an episode with an agent.
-
-    This function runs an episode with an agent in the environment given by its
-    `env_creator()` method.
+    The observations are preprocessed and filtered like in
+    `Trainer.compute_action()`, and the actions are unsquashed or clipped according
+    to the trainer config. Used by `solara.utils.episodes.compute_actions()`.
 
     Args:
-        agent (ray.rllib.agents.trainer.Trainer): agent to be used for episode.
+        agent (ray.rllib.agents.trainer.Trainer): trainer computing the actions.
+        obs_list (List[Union[Dict[str, np.ndarray], np.ndarray]]): observations.
         explore (bool): whether the agent should use exploration policy. Defaults to
             False.
 
     Returns:
-        Tuple: observations, actions, rewards, info
+        np.ndarray: actions, one per observation.
     """
+    policy_id = "default_policy"
+    worker = agent.workers.local_worker()
+    preprocessor = worker.preprocessors[policy_id]
+    obs_filter = worker.filters[policy_id]
+    obs_batch = np.stack(
+        [obs_filter(preprocessor.transform(obs), update=False) for obs in obs_list]
+    )
 
-    done = False
-    actions = []
-    observations = []
-    rewards = []
-    infos = []
-
-    env = agent.env_creator(agent.config["env_config"])
-    obs = env.reset()
-    observations.append(obs)
+    policy = agent.get_policy(policy_id)
+    actions, _, _ = policy.compute_actions(obs_batch, explore=explore)
 
-    # Running episode
-    while not done:
-        action = agent.compute_action(obs, explore=explore)
-        obs, reward, done, info = env.step(action)
-        actions.append(float(action))
-        observations.append(obs)
-        rewards.append(reward)
-        infos.append(info)
+    if agent.config.get("normalize_actions"):
+        actions = unsquash_action(actions, policy.action_space_struct)
+    elif agent.config.get("clip_actions"):
+        actions = clip_action(actions, policy.action_space_struct)
 
-    return (observations, np.array(actions), np.array(rewards), infos)
+    return actions
 
 
 def run_episodes_from_checkpoints(
     agent: ray.rllib.agents.trainer.Trainer,
     check_save_path: str,
     check_range: Union[int, List[int, int]] = None,
-) -> List[Dict]:
+    days: List[int] = None,
+    num_workers: int = None,
+    store: EpisodeStore = None,
+) -> Union[List[Union[Dict, List[Dict]]], EpisodeStore]:
     """Run episode from agent checkpoints and get corresponding episode trajectories.
 
     Args:
@@ -64,11 +83,71 @@ def run_episodes_from_checkpoints(
         check_save_path (str): path where checkpoints are saved.
         check_num (int): range, or single number of checkpoint(s) to load and run.
             Defaults to None which loads all checkpoints.
+        days (List[int], optional): days to run episodes for with each checkpoint,
+            using `run_episodes_batched()`. Defaults to None, which runs a single
+            episode per checkpoint with `run_episode()`.
+        num_workers (int, optional): number of Ray actors evaluating checkpoints in
+            parallel, each with its own trainer of the agent's class and config
+            (without rollout workers and GPUs, see `EVALUATOR_CONFIG`), see
+            `CheckpointEvaluator`. Defaults to None, which restores all checkpoints
+            into the given agent one after another.
+        store (EpisodeStore, optional): store to write the episodes to (with the
+            checkpoint, day and time step length as metadata) as soon as each
+            checkpoint is evaluated, instead of keeping them in memory. Defaults to
+            None.
 
     Returns:
-        List[Dict]: list of dictionaries, each with data from one episode.
+        Union[List[Union[Dict, List[Dict]]], EpisodeStore]: list of dictionaries, each
+            with data from one episode, or, if days are given, list of such lists for
+            each checkpoint. In order of checkpoints. If a store is given, the store
+            is returned instead.
     """
+    checkpoints = get_checkpoint_paths(check_save_path, check_range)
+
+    if num_workers is not None:
+        results = _run_checkpoints_parallel(agent, checkpoints, days, num_workers)
+    else:
+        results = (
+            run_checkpoint_episodes(agent, checkpoint, days)
+            for checkpoint in checkpoints
+        )
+
+    if store is None:
+        return list(results)
+
+    time_step_len = agent.env_creator(agent.config["env_config"]).time_step_len
+    recorder = None
+    for checkpoint, result in zip(checkpoints, results):
+        if days is None:
+            episodes = [result]
+            metadata = [{"checkpoint": checkpoint}]
+        else:
+            episodes = result
+            metadata = [{"checkpoint": checkpoint, "day": int(day)} for day in days]
+        for episode_metadata in metadata:
+            episode_metadata["time_step_len"] = time_step_len
+        if recorder is None:
+            recorder = EpisodeRecorder(len(episodes[0]["actions"]), store=store)
+        recorder.add_episodes(episodes, metadata=metadata)
+    if recorder is not None:
+        recorder.flush()
+
+    return store
+
+
+def get_checkpoint_paths(
+    check_save_path: str, check_range: Union[int, List[int, int]] = None
+) -> List[str]:
+    """Get paths of agent checkpoints.
 
+    Args:
+        check_save_path (str): path where checkpoints are saved.
+        check_range (Union[int, List[int, int]], optional): range, or single number of
+            checkpoint(s). Defaults to None which gets all checkpoints.
+
+    Returns:
+        List[str]: paths of checkpoints, in order of iteration number.
+    """
     final_iter_num = max(
         [
             int(dirname.split("_")[-1])
@@ -77,8 +156,6 @@ def run_episodes_from_checkpoints(
         ]
     )
 
-    episode_dicts = []
-
     if check_range is None:
         check_range = [1, final_iter_num + 1]
     elif isinstance(check_range, int):
@@ -87,119 +164,160 @@ def run_episodes_from_checkpoints(
     if check_range[1] > final_iter_num + 1:
         raise ValueError("check_range out of range of existing checkpoints.")
 
-    for i in range(*check_range):
-        agent.restore(
-            check_save_path + "/checkpoint_{i:06.0f}/checkpoint-{i}".format(i=i)
-        )
-        observations, actions, rewards, infos = run_episode(agent)
-        episode_dict = get_episode_dict(
-            observations,
-            actions,
-            rewards,
-            infos,
-        )
-        episode_dicts.append(episode_dict)
-
-    return episode_dicts
-
-
-def concat_dict_data(dicts: List[Dict]) -> Dict[str, np.array]:
-    """Concatenate list of dicts into dict of np.arrays.
+    return [
+        check_save_path + "/checkpoint_{i:06.0f}/checkpoint-{i}".format(i=i)
+        for i in range(*check_range)
+    ]
 
-    Each dictionary in list must have the same keys. For example, input
-    `[{'a':1},{'a':2}]` is returned as `{'a': np.array([1,2])}`.
 
-    Args:
-        dicts (List[Dict]): list of dicts to be combined
-
-    Returns:
-        Dict[str, np.array]: dictionary with np.array values
-    """
-    concat_dict = {}
-    for key in dicts[0].keys():
-        concat_dict[key] = np.empty(len(dicts))
-
-    for i, dictionary in enumerate(dicts):
-        for key, value in dictionary.items():
-            concat_dict[key][i] = value
-
-    return concat_dict
-
-
-def get_episode_dict(
-    observations: List[Dict],
-    actions: List,
-    rewards: List,
-    infos,
-) -> Dict:
-    """Get dictionary form of episode data.
-
-    The return can be used for plotting an episode, and defines what is plotted
-    for other functions.
+def run_checkpoint_episodes(
+    agent: ray.rllib.agents.trainer.Trainer, checkpoint: str, days: List[int] = None
+) -> Union[Dict, List[Dict]]:
+    """Restore agent from checkpoint and run episode(s).
 
     Args:
-        observations (List): list of observations (of type gym.spaces.Dict)
-        actions (List): list of actions
-        rewards (List): list of rewards
-        infos ([type]): list of infos
+        agent (ray.rllib.agents.trainer.Trainer): agent to restore.
+        checkpoint (str): path of checkpoint.
+        days (List[int], optional): days to run episodes for with
+            `run_episodes_batched()`. Defaults to None, which runs a single episode
+            with `run_episode()`.
 
     Returns:
-        Dict: dictionary used for plotting.
+        Union[Dict, List[Dict]]: data of episode, or list of data of each day's
+            episode, in the format of `get_episode_dict()`.
     """
+    agent.restore(checkpoint)
+    if days is not None:
+        return run_episodes_batched(agent, days=days)
+
+    observations, actions, rewards, infos = run_episode(agent)
+    return get_episode_dict(
+        observations,
+        actions,
+        rewards,
+        infos,
+    )
 
-    obs_dict = concat_dict_data(observations)
-    info_dict = concat_dict_data(infos)
 
-    episode_dict = {**obs_dict, **info_dict}
+# Overrides of the trainer config of each `CheckpointEvaluator` actor
+EVALUATOR_CONFIG = {
+    "num_workers": 0,
+    "evaluation_num_workers": 0,
+    "num_gpus": 0,
+}
 
-    episode_dict["rewards"] = rewards
-    episode_dict["actions"] = actions
 
-    return episode_dict
+def _read_checkpoint_files(checkpoint: str) -> None:
+    """Read files of checkpoint (and discard them) to load them into the OS cache."""
+    for path in glob.glob(glob.escape(checkpoint) + "*"):
+        with open(path, "rb") as file:
+            while file.read(2**20):
+                pass
 
 
-class DeterministicAgent:
-    """Deterministic Agent."""
+class CheckpointEvaluator:
+    """Evaluator of checkpoints with its own trainer, to be used as Ray actor."""
 
-    def __init__(self, actions: List, env: gym.Env) -> None:
-        """Deterministic Agent.
+    def __init__(self, trainer_cls: type, config: dict) -> None:
+        """Evaluator of checkpoints with its own trainer, to be used as Ray actor.
 
         Args:
-            actions (List): list of actions the agent takes
-            env (gym.Env): environment of the agent
+            trainer_cls (type): class of trainer, e.g.
+                `ray.rllib.agents.ppo.PPOTrainer`.
+            config (dict): config of trainer.
         """
-        self.actions = actions
-        self.env = env
-        self.step = 0
+        self.agent = trainer_cls(config=config)
+        self._prefetch_thread = None
 
-    def compute_action(
-        self, obs: object, explore: bool = False
-    ):  # pylint: disable=unused-argument
-        """Get action.
+    def evaluate(
+        self, checkpoint: str, days: List[int] = None, prefetch: str = None
+    ) -> Union[Dict, List[Dict]]:
+        """Restore checkpoint and run episode(s), see `run_checkpoint_episodes()`.
 
         Args:
-            obs (object): observations
-            explore (bool, optional): Whether to explore, has no effect.
-                Defaults to False.
+            checkpoint (str): path of checkpoint.
+            days (List[int], optional): days to run episodes for. Defaults to None.
+            prefetch (str, optional): path of the next checkpoint of this evaluator,
+                whose files are read in a background thread during the evaluation.
+                Defaults to None.
 
         Returns:
-            np.array: action taken by agent
+            Union[Dict, List[Dict]]: episode data.
         """
+        if self._prefetch_thread is not None:
+            self._prefetch_thread.join()
+            self._prefetch_thread = None
 
-        action = self.actions[self.step]
-        self.step += 1
-        return action
+        self.agent.restore(checkpoint)
 
-    def env_creator(self) -> gym.Env:
-        return self.env
+        if prefetch is not None:
+            self._prefetch_thread = threading.Thread(
+                target=_read_checkpoint_files, args=(prefetch,), daemon=True
+            )
+            self._prefetch_thread.start()
+
+        if days is not None:
+            return run_episodes_batched(self.agent, days=days)
+        observations, actions, rewards, infos = run_episode(self.agent)
+        return get_episode_dict(observations, actions, rewards, infos)
+
+
+def _run_checkpoints_parallel(
+    agent: ray.rllib.agents.trainer.Trainer,
+    checkpoints: List[str],
+    days: List[int],
+    num_workers: int,
+) -> Iterator[Union[Dict, List[Dict]]]:
+    """Evaluate checkpoints with a pool of Ray actors.
+
+    Checkpoint i is evaluated by actor i % num_workers. All tasks are submitted up
+    front, such that each actor starts its next checkpoint as soon as the previous one
+    is done, and reads the files of its next checkpoint while evaluating. Results are
+    yielded in order of checkpoints as they become available.
+    """
+    if not ray.is_initialized():
+        ray.init()
+
+    remote_cls = ray.remote(CheckpointEvaluator)
+    # Evaluation only uses the local policy, rollout workers and GPUs of the training
+    # config would be requested again by each evaluator's trainer
+    config = {**agent.config, **EVALUATOR_CONFIG}
+    num_workers = max(1, min(num_workers, len(checkpoints)))
+    evaluators = [remote_cls.remote(type(agent), config) for _ in range(num_workers)]
+
+    result_refs = []
+    for i, checkpoint in enumerate(checkpoints):
+        next_i = i + num_workers
+        prefetch = checkpoints[next_i] if next_i < len(checkpoints) else None
+        result_refs.append(
+            evaluators[i % num_workers].evaluate.remote(checkpoint, days, prefetch)
+        )
+
+    try:
+        for result_ref in result_refs:
+            yield ray.get(result_ref)
+    finally:
+        for evaluator in evaluators:
+            ray.kill(evaluator)
 
 
 class InfoCallback(ray.rllib.agents.callbacks.DefaultCallbacks):
-    """Callback to add additional metrics over the training process from step infos."""
+    """Callback to add additional metrics over the training process from step infos.
+
+    The infos of each step are aggregated with streaming accumulators
+    (`solara.utils.metrics.StreamingStats`), such that no per-step data is kept in
+    the episodes. The aggregations of each key in `info_keys` are set in
+    `info_aggregations` (default: sum). The sum is reported under the key itself,
+    other aggregations under the key with the aggregation as suffix, e.g.
+    `cost_max`. Additionally, the battery utilisation of the episode is reported as
+    the number of equivalent full cycles, i.e. the energy charged and discharged
+    divided by twice the usable battery capacity.
+    """
 
     # pylint: disable=unused-argument
 
     info_keys = ["cost", "power_diff", "battery_cont"]
+    info_aggregations = {}
 
     def on_episode_start(
         self,
@@ -209,11 +327,15 @@ class InfoCallback(ray.rllib.agents.callbacks.DefaultCallbacks):
         policies: Dict[str, ray.rllib.policy.Policy],
         episode: ray.rllib.evaluation.MultiAgentEpisode,
         env_index: int,
-        **kwargs
+        **kwargs,
     ):
         """Executed at start of episode."""
 
-        episode.user_data["infos"] = []
+        episode.user_data["info_stats"] = {
+            key: StreamingStats(self.info_aggregations.get(key, ["sum"]))
+            for key in self.info_keys
+        }
+        episode.user_data["charging_energy"] = StreamingStats(["abs_sum"])
 
     def on_episode_step(
         self,
@@ -222,11 +344,21 @@ class InfoCallback(ray.rllib.agents.callbacks.DefaultCallbacks):
         base_env: ray.rllib.env.BaseEnv,
         episode: ray.rllib.evaluation.MultiAgentEpisode,
         env_index: int,
-        **kwargs
+        **kwargs,
     ):
         """Executed on each episode step."""
 
-        episode.user_data["infos"].append(episode.last_info_for())
+        info = episode.last_info_for()
+        if not info:
+            return
+
+        for key, stats in episode.user_data["info_stats"].items():
+            if key in info:
+                stats.update(float(np.ravel(info[key])[0]))
+        if "charging_power" in info:
+            episode.user_data["charging_energy"].update(
+                float(np.ravel(info["charging_power"])[0])
+            )
 
     def on_episode_end(
         self,
@@ -236,11 +368,21 @@ class InfoCallback(ray.rllib.agents.callbacks.DefaultCallbacks):
         policies: Dict[str, ray.rllib.policy.Policy],
         episode: ray.rllib.evaluation.MultiAgentEpisode,
         env_index: int,
-        **kwargs
+        **kwargs,
     ):
         """Executed at end of episode."""
 
-        for key in self.info_keys:
-            if key in episode.user_data["infos"][0].keys():
-                key_data = [info[key] for info in episode.user_data["infos"]]
-                episode.custom_metrics[key] = sum(key_data)
+        for key, stats in episode.user_data["info_stats"].items():
+            if stats.count == 0:
+                continue
+            for aggregation, value in stats.get().items():
+                name = key if aggregation == "sum" else key + "_" + aggregation
+                episode.custom_metrics[name] = value
+
+        charging_energy = episode.user_data["charging_energy"]
+        if charging_energy.count > 0:
+            env = base_env.get_unwrapped()[env_index]
+            capacity = float(np.ravel(env.battery.v2_bar - env.battery.v1_bar)[0])
+            episode.custom_metrics["battery_utilisation"] = (
+                charging_energy.abs_sum * env.time_step_len / (2 * capacity)
+            )